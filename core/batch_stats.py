@@ -0,0 +1,144 @@
+"""
+Python module for maintaining the table of per-batch T&RH statistics,
+BatchTRHStatsClass, which holds partial aggregates (count, sum, sum of squares, min and
+max) of the T&RH conditions of each batch in its grow and propagation phases.
+
+The statistics of a batch are recomputed from scratch when its events or the sensor
+locations change, since that changes which readings belong to it. New readings are
+folded into the existing statistics, by merging their partial aggregates with the ones
+already in the table. An empty table, e.g. on a database that predates it, is first
+seeded from all the readings, so that folding never builds on missing statistics.
+"""
+
+import logging
+
+from sqlalchemy import delete
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql import func
+
+from .queries import (
+    TRH_AGGREGATE_COLUMNS,
+    batch_list,
+    batch_trh_partial_aggregates,
+    trh_with_vpd,
+)
+from .structure import BatchTRHStatsClass, ReadingsAranetTRHClass
+
+BATCH_PHASES = ("grow", "propagate")
+AGGREGATES = ("sum", "sumsq", "min", "max")
+
+# Maximum number of reading ids per statement when folding in new readings.
+FOLD_BATCH_SIZE = 5000
+
+
+def _stats_columns():
+    """Names of the columns of BatchTRHStatsClass that hold the partial aggregates."""
+    columns = ["num_readings"]
+    for column_name in TRH_AGGREGATE_COLUMNS:
+        columns += [f"{column_name}_{aggregate}" for aggregate in AGGREGATES]
+    return columns
+
+
+def _insert_partial_aggregates(session, trh_q, batch_ids=None, merge=False):
+    """Insert the partial aggregates over the readings in trh_q for the batches with
+    the given ids (all batches if None). If merge is True, they are merged with any
+    existing statistics of the same batches, otherwise existing rows are left as they
+    are.
+    """
+    batches_sq = batch_list(session).subquery("batch_list")
+    if batch_ids is not None:
+        batches_sq = (
+            session.query(batches_sq)
+            .filter(batches_sq.c.batch_id.in_(batch_ids))
+            .subquery("batch_list_filtered")
+        )
+    trh_sq = trh_q.subquery("trh")
+    columns = ["batch_id", "phase"] + _stats_columns()
+    for phase in BATCH_PHASES:
+        select = batch_trh_partial_aggregates(session, phase, batches_sq, trh_sq)
+        insert_stmt = insert(BatchTRHStatsClass).from_select(columns, select.statement)
+        if merge:
+            existing = BatchTRHStatsClass.__table__.c
+            merged = {}
+            for column_name in columns[2:]:
+                old, new = existing[column_name], insert_stmt.excluded[column_name]
+                if column_name.endswith("_min"):
+                    merged[column_name] = func.least(old, new)
+                elif column_name.endswith("_max"):
+                    merged[column_name] = func.greatest(old, new)
+                else:
+                    merged[column_name] = old + new
+            merged["time_updated"] = func.now()
+            insert_stmt = insert_stmt.on_conflict_do_update(
+                index_elements=["batch_id", "phase"], set_=merged
+            )
+        session.execute(insert_stmt)
+
+
+def _create_batch_trh_stats(session):
+    """Create the statistics table if it doesn't exist. Return whether it is empty."""
+    BatchTRHStatsClass.__table__.create(bind=session.get_bind(), checkfirst=True)
+    return session.query(BatchTRHStatsClass.batch_id).first() is None
+
+
+def seed_batch_trh_stats(engine):
+    """
+    Create the T&RH statistics table if it doesn't exist, and compute the statistics
+    of all batches from all the readings if it is empty.
+
+    Arguments:
+        engine: sqlalchemy engine, connected to the database
+    """
+    session = Session(bind=engine)
+    try:
+        if _create_batch_trh_stats(session):
+            rebuild_batch_trh_stats(session)
+    finally:
+        session.close()
+
+
+def rebuild_batch_trh_stats(session, batch_ids=None):
+    """
+    Recompute the T&RH statistics of batches from all the readings in the database.
+
+    Arguments:
+        session: sqlalchemy active session object
+        batch_ids: list of ids of the batches to recompute, or None for all batches
+    """
+    BatchTRHStatsClass.__table__.create(bind=session.get_bind(), checkfirst=True)
+    delete_stmt = delete(BatchTRHStatsClass)
+    if batch_ids is not None:
+        batch_ids = [int(batch_id) for batch_id in batch_ids]
+        delete_stmt = delete_stmt.where(BatchTRHStatsClass.batch_id.in_(batch_ids))
+    session.execute(delete_stmt)
+    _insert_partial_aggregates(session, trh_with_vpd(session), batch_ids=batch_ids)
+    session.commit()
+    logging.info("Rebuilt the batch T&RH statistics")
+
+
+def fold_trh_readings_into_batch_stats(session, reading_ids):
+    """
+    Merge newly inserted T&RH readings into the statistics of the batches they belong
+    to. Each reading must only be folded in once. If the statistics table is empty, it
+    is rebuilt from all the readings instead.
+
+    Arguments:
+        session: sqlalchemy active session object
+        reading_ids: list of ids of new rows in the ReadingsAranetTRHClass table
+    """
+    reading_ids = [int(reading_id) for reading_id in reading_ids]
+    if len(reading_ids) == 0:
+        return
+    if _create_batch_trh_stats(session):
+        # Nothing to fold into, e.g. the table was only just created. The new
+        # readings are already in the readings table, so the rebuild covers them.
+        rebuild_batch_trh_stats(session)
+        return
+    for i in range(0, len(reading_ids), FOLD_BATCH_SIZE):
+        trh_q = trh_with_vpd(session).filter(
+            ReadingsAranetTRHClass.id.in_(reading_ids[i : i + FOLD_BATCH_SIZE])
+        )
+        _insert_partial_aggregates(session, trh_q, merge=True)
+    session.commit()
+    logging.info(f"Folded {len(reading_ids)} readings into the batch T&RH statistics")
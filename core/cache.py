@@ -0,0 +1,199 @@
+"""
+Simple key-value caches with a common interface, for caching computed results such as
+the data of dashboard pages. The backends are
+
+* MemoryCache: in-process, with a time-to-live and least-recently-used eviction,
+* FileCache: pickled values in a directory, which can be shared between processes,
+* RedisCache: any Redis-compatible server, needs the redis package.
+
+Use make_cache to create one of these by name.
+"""
+
+import abc
+from collections import OrderedDict
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+
+
+class BaseCache(abc.ABC):
+    """Interface of the cache backends. Values can be any picklable object."""
+
+    def __init__(self, ttl=None):
+        """
+        Arguments:
+            ttl: default time-to-live of entries in seconds, or None for no expiry
+        """
+        self.ttl = ttl
+
+    @abc.abstractmethod
+    def get(self, key):
+        """Return the value for key, or None if it is not in the cache."""
+
+    @abc.abstractmethod
+    def set(self, key, value, ttl=None):
+        """Store value for key, expiring after ttl seconds (default self.ttl)."""
+
+    @abc.abstractmethod
+    def delete(self, key):
+        """Remove key from the cache, if it is there."""
+
+    @abc.abstractmethod
+    def clear(self):
+        """Remove all entries."""
+
+    def get_or_set(self, key, compute, ttl=None):
+        """Return the value for key, calling compute() to compute and store it if it is
+        not in the cache.
+        """
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.set(key, value, ttl=ttl)
+        return value
+
+    def _expiry(self, ttl):
+        ttl = self.ttl if ttl is None else ttl
+        return None if ttl is None else time.time() + ttl
+
+
+class MemoryCache(BaseCache):
+    """In-process cache, evicting the least recently used entries beyond max_entries."""
+
+    def __init__(self, ttl=None, max_entries=128):
+        super().__init__(ttl=ttl)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            expiry, value = self._entries[key]
+            if expiry is not None and expiry < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (self._expiry(ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class FileCache(BaseCache):
+    """Cache storing each entry as a pickle file in a directory."""
+
+    def __init__(self, directory=None, ttl=None):
+        super().__init__(ttl=ttl)
+        if directory is None:
+            directory = os.path.join(tempfile.gettempdir(), "crop_cache")
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest + ".pkl")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                expiry, value = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+        if expiry is not None and expiry < time.time():
+            self.delete(key)
+            return None
+        return value
+
+    def set(self, key, value, ttl=None):
+        # Write to a temporary file and rename it, so that readers in other processes
+        # never see a partially written entry.
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump((self._expiry(ttl), value), f)
+        os.replace(tmp_path, self._path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        for filename in os.listdir(self.directory):
+            if filename.endswith(".pkl"):
+                os.remove(os.path.join(self.directory, filename))
+
+
+class RedisCache(BaseCache):
+    """Cache backed by a Redis-compatible server."""
+
+    def __init__(self, url=None, client=None, ttl=None, prefix="crop:"):
+        """
+        Arguments:
+            url: URL of the server, e.g. redis://localhost:6379/0, used if client is None
+            client: an existing client with get, set, delete and scan_iter methods
+            ttl: default time-to-live of entries in seconds
+            prefix: prefix for all keys, so that clear only removes our own entries
+        """
+        super().__init__(ttl=ttl)
+        if client is None:
+            try:
+                import redis
+            except ImportError as e:
+                raise ImportError(
+                    "The redis package is needed for the Redis cache backend."
+                ) from e
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return None if value is None else pickle.loads(value)
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=ttl)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def clear(self):
+        for key in self.client.scan_iter(match=self.prefix + "*"):
+            self.client.delete(key)
+
+
+CACHE_BACKENDS = {"memory": MemoryCache, "file": FileCache, "redis": RedisCache}
+
+
+def make_cache(backend="memory", **kwargs):
+    """
+    Create a cache.
+
+    Arguments:
+        backend: str, one of "memory", "file", or "redis"
+        kwargs: passed to the constructor of the backend class
+    Returns:
+        cache: an instance of a subclass of BaseCache
+    """
+    if backend not in CACHE_BACKENDS:
+        raise ValueError(f"Unknown cache backend: {backend}")
+    return CACHE_BACKENDS[backend](**kwargs)
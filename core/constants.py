@@ -65,6 +65,32 @@ CONST_CROP_HYPER_APIKEY = (
     else "DUMMY"
 )
 
+# Timeout in seconds for each request to the Hyper API, and how many times, with what
+# exponential backoff factor in seconds, failed requests are retried.
+CONST_HYPER_API_TIMEOUT = (
+    float(os.environ["CROP_HYPER_API_TIMEOUT"])
+    if "CROP_HYPER_API_TIMEOUT" in os.environ
+    else 120.0
+)
+CONST_HYPER_API_MAX_RETRIES = (
+    int(os.environ["CROP_HYPER_API_MAX_RETRIES"])
+    if "CROP_HYPER_API_MAX_RETRIES" in os.environ
+    else 3
+)
+CONST_HYPER_API_BACKOFF_FACTOR = (
+    float(os.environ["CROP_HYPER_API_BACKOFF_FACTOR"])
+    if "CROP_HYPER_API_BACKOFF_FACTOR" in os.environ
+    else 1.0
+)
+# Maximum number of chunks the timer-triggered Hyper import backfills in one run, so
+# that a long backlog doesn't run past the function timeout. The rest is picked up by
+# the following runs, from the watermarks.
+CONST_HYPER_BACKFILL_MAX_CHUNKS = (
+    int(os.environ["CROP_HYPER_BACKFILL_MAX_CHUNKS"])
+    if "CROP_HYPER_BACKFILL_MAX_CHUNKS" in os.environ
+    else 6
+)
+
 # openweatherdata API
 CONST_OPENWEATHERMAP_APIKEY = (
     os.environ["CROP_OPENWEATHERMAP_APIKEY"].strip()
@@ -101,6 +127,28 @@ SQL_DBNAME = (
 SQL_DEFAULT_DBNAME = "postgres"
 SQL_SSLMODE = "require"
 
+# Connection pool settings for the engines held in the core.db engine registry.
+# A max overflow of -1 means no limit on connections beyond the pool size, and a
+# pool recycle of -1 means connections are never recycled based on their age.
+SQL_POOL_SIZE = (
+    int(os.environ["CROP_SQL_POOL_SIZE"]) if "CROP_SQL_POOL_SIZE" in os.environ else 20
+)
+SQL_MAX_OVERFLOW = (
+    int(os.environ["CROP_SQL_MAX_OVERFLOW"])
+    if "CROP_SQL_MAX_OVERFLOW" in os.environ
+    else -1
+)
+SQL_POOL_PRE_PING = (
+    os.environ["CROP_SQL_POOL_PRE_PING"].strip().lower() in ("1", "true", "yes")
+    if "CROP_SQL_POOL_PRE_PING" in os.environ
+    else True
+)
+SQL_POOL_RECYCLE = (
+    int(os.environ["CROP_SQL_POOL_RECYCLE"])
+    if "CROP_SQL_POOL_RECYCLE" in os.environ
+    else -1
+)
+
 # same for the temporary db used for unit testing
 SQL_TEST_USER = (
     os.environ["CROP_SQL_TESTUSER"].strip()
@@ -156,6 +204,13 @@ MODEL_PRODUCT_TABLE_NAME = "model_product"
 MODEL_VALUE_TABLE_NAME = "model_value"
 WARNING_TYPES_TABLE_NAME = "warning_types"
 WARNINGS_TABLE_NAME = "warnings"
+DATA_WATERMARK_TABLE_NAME = "data_watermarks"
+BATCH_TRH_STATS_TABLE_NAME = "batch_trh_stats"
+READINGS_ROLLUP_TABLE_NAME = "readings_rollups"
+
+# Materialised views
+LATEST_SENSOR_LOCATIONS_VIEW_NAME = "latest_sensor_locations"
+CLOSEST_TRH_SENSORS_VIEW_NAME = "closest_trh_sensors"
 
 ARANET_TRH_TABLE_NAME = "aranet_trh_data"
 ARANET_CO2_TABLE_NAME = "aranet_co2_data"
@@ -3,13 +3,32 @@ Module for the main functions to create a new database with SQLAlchemy and Postg
 drop database, and check its structure.
 """
 
+import threading
+
 from sqlalchemy import create_engine, inspect
 from sqlalchemy_utils import database_exists, drop_database
 from sqlalchemy.orm import registry, RelationshipProperty, sessionmaker
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 
-from .constants import SQL_DEFAULT_DBNAME
+from .constants import (
+    SQL_DEFAULT_DBNAME,
+    SQL_POOL_SIZE,
+    SQL_MAX_OVERFLOW,
+    SQL_POOL_PRE_PING,
+    SQL_POOL_RECYCLE,
+)
 from .structure import BASE
+from .lookups import create_location_lookups
+from .batch_stats import seed_batch_trh_stats
+from .rollups import seed_rollups
+
+# Process-wide registry of engines, keyed by the full database connection string, and
+# of the session factories bound to them. Every engine owns a connection pool, so
+# reusing engines means that a process keeps one pool per database, rather than
+# opening new connections every time connect_db is called.
+_ENGINES = {}
+_SESSION_FACTORIES = {}
+_REGISTRY_LOCK = threading.Lock()
 
 
 def create_database(conn_string, db_name):
@@ -28,11 +47,8 @@ def create_database(conn_string, db_name):
         # try:
         # On postgres, the postgres database is normally present by default.
         # Connecting as a superuser (eg, postgres), allows to connect and create a new db.
-        def_engine = create_engine(
-            "{}/{}".format(conn_string, SQL_DEFAULT_DBNAME),
-            pool_size=20,
-            max_overflow=-1,
-        )
+        # This engine is only needed once, so it is not kept in the engine registry.
+        def_engine = create_engine("{}/{}".format(conn_string, SQL_DEFAULT_DBNAME))
 
         # You cannot use engine.execute() directly, because postgres does not allow to create
         # databases inside transactions, inside which sqlalchemy always tries to run queries.
@@ -50,16 +66,58 @@ def create_database(conn_string, db_name):
         _, _, engine = connect_db(conn_string, db_name)
         # Adds the tables and columns from the classes in module structure
         BASE.metadata.create_all(engine)
+        create_location_lookups(engine)
+        seed_batch_trh_stats(engine)
+        seed_rollups(engine)
 
         conn.close()
+        def_engine.dispose()
         # except:
         #     return False, "Error creating a new database"
     return True, None
 
 
+def get_engine(
+    conn_string,
+    db_name,
+    pool_size=None,
+    max_overflow=None,
+    pool_pre_ping=None,
+    pool_recycle=None,
+):
+    """
+    Function to get the engine for a database from the engine registry, creating it
+    if this process has not connected to the database before.
+    Does not check whether the database exists, see connect_db for that.
+    -conn_string: the string that holds the connection to postgres
+    -dbname: name of the database
+    -pool_size, max_overflow, pool_pre_ping, pool_recycle: connection pool settings,
+        only used when a new engine is created. Default to the SQL_POOL_* constants.
+    return: engine: the engine object
+    """
+    db_conn_string = "{}/{}".format(conn_string, db_name)
+
+    with _REGISTRY_LOCK:
+        engine = _ENGINES.get(db_conn_string)
+        if engine is None:
+            engine = create_engine(
+                db_conn_string,
+                pool_size=SQL_POOL_SIZE if pool_size is None else pool_size,
+                max_overflow=SQL_MAX_OVERFLOW if max_overflow is None else max_overflow,
+                pool_pre_ping=(
+                    SQL_POOL_PRE_PING if pool_pre_ping is None else pool_pre_ping
+                ),
+                pool_recycle=SQL_POOL_RECYCLE if pool_recycle is None else pool_recycle,
+            )
+            _ENGINES[db_conn_string] = engine
+    return engine
+
+
 def connect_db(conn_string, db_name):
     """
     Function to connect to a database
+    The engine is taken from the engine registry, so repeated calls with the same
+    arguments share one engine and its connection pool.
     -conn_string: the string that holds the connection to postgres
     -dbname: name of the database
     return: True, None: if connected to the database,
@@ -69,10 +127,15 @@ def connect_db(conn_string, db_name):
     # Create connection string
     db_conn_string = "{}/{}".format(conn_string, db_name)
 
+    # We have connected to this database before, so it is known to exist.
+    engine = _ENGINES.get(db_conn_string)
+    if engine is not None:
+        return True, None, engine
+
     # Connect to an engine
     if database_exists(db_conn_string):
         try:
-            engine = create_engine(db_conn_string, pool_size=20, max_overflow=-1)
+            engine = get_engine(conn_string, db_name)
         except:
             return False, "Cannot connect to db: %s" % db_name, None
     else:
@@ -81,6 +144,38 @@ def connect_db(conn_string, db_name):
     return True, None, engine
 
 
+def dispose_engine(conn_string, db_name):
+    """
+    Function to close all pooled connections of a database engine, and remove it
+    from the engine registry. The next connect_db call creates a new engine.
+    -conn_string: the string that holds the connection to postgres
+    -dbname: name of the database
+    return: True if an engine was disposed, False if there was none in the registry
+    """
+    db_conn_string = "{}/{}".format(conn_string, db_name)
+
+    with _REGISTRY_LOCK:
+        engine = _ENGINES.pop(db_conn_string, None)
+        if engine is None:
+            return False
+        _SESSION_FACTORIES.pop(engine, None)
+    engine.dispose()
+    return True
+
+
+def dispose_all_engines():
+    """
+    Function to close all pooled connections of all engines in the engine registry,
+    and empty the registry.
+    """
+    with _REGISTRY_LOCK:
+        engines = list(_ENGINES.values())
+        _ENGINES.clear()
+        _SESSION_FACTORIES.clear()
+    for engine in engines:
+        engine.dispose()
+
+
 def drop_db(conn_string, db_name):
     """
     Function to drop db
@@ -94,6 +189,10 @@ def drop_db(conn_string, db_name):
     db_conn_string = "{}/{}".format(conn_string, db_name)
 
     if database_exists(db_conn_string):
+        # Pooled connections to the db would be terminated below anyway, and the
+        # registry must not hand out an engine for a db that no longer exists.
+        dispose_engine(conn_string, db_name)
+
         # Connect to the db
         _, _, engine = connect_db(conn_string, db_name)
 
@@ -115,6 +214,9 @@ def drop_db(conn_string, db_name):
             }
             connection.execute(text)
 
+            connection.close()
+            dispose_engine(conn_string, db_name)
+
             # Drops db
             drop_database(db_conn_string)
 
@@ -189,13 +291,28 @@ def check_database_structure(engine):
     return True, None
 
 
+def get_session_factory(engine):
+    """
+    Returns the session factory bound to the engine, creating it if needed.
+    -engine: the connected engine
+    """
+    with _REGISTRY_LOCK:
+        Session = _SESSION_FACTORIES.get(engine)
+        if Session is None:
+            Session = sessionmaker(bind=engine)
+            # Only keep factories for registered engines, so that one-off engines
+            # can still be garbage collected.
+            if engine in _ENGINES.values():
+                _SESSION_FACTORIES[engine] = Session
+    return Session
+
+
 def session_open(engine):
     """
     Opens a new connection/session to the db and binds the engine
     -engine: the connected engine
     """
-    Session = sessionmaker()
-    Session.configure(bind=engine)
+    Session = get_session_factory(engine)
     return Session()
 
 
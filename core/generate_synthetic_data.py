@@ -232,6 +232,31 @@ def generate_airvelocity_readings(sensor_ids=list(range(11, 15))):
     return df
 
 
+def generate_energy_readings(sensor_ids=list(range(1, 3)), days=365):
+    """
+    Generate half-hourly electricity consumption, as in the Stark energy data, for
+    each sensor id, then concatenate them at the end.
+    """
+    end_time = datetime.now()
+    start_time = end_time - timedelta(days=days)
+    sampling_period = 1800  # 30 mins
+    dfs = []
+    for sensor_id in sensor_ids:
+        df = initial_dataframe(
+            start_time, end_time, sampling_period, colnames=["electricity_consumption"]
+        )
+        df = add_const_offset(df, "electricity_consumption", 30.0)
+        # daily oscillation, from the lights going on and off
+        df = add_sinusoid(df, "electricity_consumption", 20.0, 60 * 60 * 24)
+        # random noise
+        df = add_gaussian_noise(df, "electricity_consumption", 0.0, 3.0)
+        df = convert_timestamp_column(df)
+        df["sensor_id"] = sensor_id
+        dfs.append(df)
+    df = pd.concat(dfs)
+    return df
+
+
 def generate_weather(start_time=None, end_time=None):
     """
     Generate hourly weather history or forecasts going back/forward 10 days.
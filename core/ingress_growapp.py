@@ -19,6 +19,8 @@ from sqlalchemy.exc import ProgrammingError
 from sqlalchemy.dialects.postgresql import insert
 
 from .db import connect_db, session_open, session_close
+from .lookups import refresh_location_lookups
+from .batch_stats import rebuild_batch_trh_stats
 from .structure import (
     LocationClass,
     CropTypeClass,
@@ -147,6 +149,8 @@ def add_new_location(zone, aisle, stack, shelf):
     session.add(location)
     session.commit()
     id = location.id
+    # A new location has no batches yet, so their statistics don't change.
+    refresh_location_lookups(session, rebuild_batch_stats=False)
     session_close(session)
     logging.info(f"Returning new location with id {id}")
     return id
@@ -538,6 +542,12 @@ def import_growapp_data(dt_from=None, dt_to=None):
         logging.info("Successfully wrote to BatchEvent table")
     else:
         logging.info("Problem writing to BatchEvent table")
+    if success and len(batchevent_df) > 0:
+        # New events change the time windows of the batches, so recompute their T&RH
+        # statistics.
+        session = get_crop_db_session()
+        rebuild_batch_trh_stats(session, batchevent_df["batch_id"].unique())
+        session_close(session)
     logging.info("Querying Growapp batch table to get harvest data")
     harvest_df = get_harvest_data(dt_from, dt_to)
     success &= write_new_data(harvest_df, HarvestClass)
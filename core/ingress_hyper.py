@@ -3,13 +3,17 @@ Python module to import data using the Hyper.ag API
 """
 
 from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import logging
 import time
 from datetime import datetime, timedelta
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import pandas as pd
 
 from sqlalchemy import and_
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.exc import ProgrammingError
 
 from .db import connect_db, session_open, session_close
@@ -23,6 +27,9 @@ from .structure import (
 )
 from .constants import (
     CONST_CROP_HYPER_APIKEY,
+    CONST_HYPER_API_TIMEOUT,
+    CONST_HYPER_API_MAX_RETRIES,
+    CONST_HYPER_API_BACKOFF_FACTOR,
     CONST_ARANET_TRH_SENSOR_TYPE,
     CONST_ARANET_CO2_SENSOR_TYPE,
     CONST_ARANET_AIRVELOCITY_SENSOR_TYPE,
@@ -31,12 +38,28 @@ from .constants import (
 
 from .utils import log_upload_event
 from .sensors import get_sensor_readings_db_timestamps
+from .watermarks import create_watermark_table, get_watermark, set_watermark
+from .batch_stats import fold_trh_readings_into_batch_stats, rebuild_batch_trh_stats
+from .rollups import refresh_rollups
 
 
 CONST_CHECK_URL_PATH = (
     "https://zcf.hyper.systems/api/sites/1/analytics/v3/device_metrics"
 )
 
+# Maximum number of readings sent to the database in a single INSERT statement when
+# using bulk ingestion.
+BULK_INSERT_BATCH_SIZE = 5000
+
+# Length of the time window requested from the Hyper API at a time by
+# backfill_hyper_data.
+HYPER_BACKFILL_CHUNK_SIZE = timedelta(days=1)
+# How far back backfill_hyper_data starts for a metric that has no watermark yet.
+HYPER_DEFAULT_LOOKBACK = timedelta(days=1)
+# How far before the watermark backfill_hyper_data starts, to pick up readings that
+# arrive at the Hyper API late.
+HYPER_WATERMARK_OVERLAP = timedelta(hours=1)
+
 READINGS_DICTS = [
     {
         "readings_class": ReadingsAranetTRHClass,
@@ -112,7 +135,46 @@ READINGS_DICTS = [
 ]
 
 
-def get_api_sensor_data(api_key, dt_from, dt_to, columns):
+def get_hyper_api_session(max_retries=None, backoff_factor=None, pool_size=10):
+    """
+    Create a requests session for the Hyper API, that keeps connections alive between
+    requests and retries failed requests with exponential backoff.
+
+    Arguments:
+        max_retries: int, number of retries for failed requests. Defaults to
+        CONST_HYPER_API_MAX_RETRIES.
+        backoff_factor: float, backoff factor in seconds between retries. Defaults to
+        CONST_HYPER_API_BACKOFF_FACTOR.
+        pool_size: int, number of connections to keep alive, should be at least the
+        number of threads using the session.
+    Return:
+        session: requests.Session
+    """
+    if max_retries is None:
+        max_retries = CONST_HYPER_API_MAX_RETRIES
+    if backoff_factor is None:
+        backoff_factor = CONST_HYPER_API_BACKOFF_FACTOR
+    retry = Retry(
+        total=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(["GET"]),
+        # Return the last response rather than raising, so that the status code is
+        # reported as for any other failed request.
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        max_retries=retry, pool_connections=pool_size, pool_maxsize=pool_size
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_api_sensor_data(
+    api_key, dt_from, dt_to, columns, session=None, timeout=None, url=None
+):
     """
     Makes a request to download sensor data for specified metrics for a specified period
     of time.  Note that this gets data for _all_ sensors, and returns it as a dict,
@@ -124,6 +186,12 @@ def get_api_sensor_data(api_key, dt_from, dt_to, columns):
         dt_to: date range to
         columns: list of dictionaries containing metric names, as defined in
         READINGS_DICTS
+        session: requests.Session to make the request with, e.g. one from
+        get_hyper_api_session. If None, a one-off request is made.
+        timeout: float, timeout for the request in seconds. Defaults to
+        CONST_HYPER_API_TIMEOUT.
+        url: str, URL of the device metrics endpoint. Defaults to
+        CONST_CHECK_URL_PATH.
     Return:
         success: whether data request was succesful
         error: error message
@@ -141,7 +209,12 @@ def get_api_sensor_data(api_key, dt_from, dt_to, columns):
     dt_from_iso = dt_from.strftime("%Y-%m-%dT%H:%M:%S") + "Z"
     dt_to_iso = dt_to.strftime("%Y-%m-%dT%H:%M:%S") + "Z"
 
-    url = CONST_CHECK_URL_PATH
+    if url is None:
+        url = CONST_CHECK_URL_PATH
+    if timeout is None:
+        timeout = CONST_HYPER_API_TIMEOUT
+    if session is None:
+        session = requests
 
     # get metrics as a single string, comma-separating each metric name
     metrics = ",".join([c["api_name"] for c in columns])
@@ -152,7 +225,12 @@ def get_api_sensor_data(api_key, dt_from, dt_to, columns):
         "resolution": "10m",
         "metadata": "true",
     }
-    response = requests.get(url, headers=headers, params=params)
+    try:
+        response = session.get(url, headers=headers, params=params, timeout=timeout)
+    except requests.exceptions.RequestException as e:
+        error = "Request [%s] failed: %s" % (url[:70], e)
+        success = False
+        return success, error, data_df_dict
 
     if response.status_code != 200:
         error = "Request's [%s] status code: %d" % (url[:70], response.status_code)
@@ -196,6 +274,70 @@ def get_api_sensor_data(api_key, dt_from, dt_to, columns):
     return success, error, data_df_dict
 
 
+def fetch_hyper_metrics(
+    api_key,
+    dt_from,
+    dt_to,
+    readings_dicts=None,
+    url=None,
+    timeout=None,
+    max_retries=None,
+    backoff_factor=None,
+    max_workers=None,
+):
+    """
+    Request data for several sensor types from the Hyper API concurrently, using a
+    thread pool and a shared keep-alive session.
+
+    This is a generator, that yields the results of each request as soon as it
+    completes, so that the caller can process them while other requests are still
+    running.
+
+    Arguments:
+        api_key: api key for authentication
+        dt_from: date range from
+        dt_to: date range to
+        readings_dicts: list of dicts like the ones in READINGS_DICTS, one request is
+        made for each. Defaults to READINGS_DICTS.
+        url, timeout: see get_api_sensor_data
+        max_retries, backoff_factor: see get_hyper_api_session
+        max_workers: int, number of concurrent requests. Defaults to one per entry in
+        readings_dicts.
+    Yields:
+        readings_dict: the entry of readings_dicts the request was for
+        success, error, data_df_dict: as returned by get_api_sensor_data
+    """
+    if readings_dicts is None:
+        readings_dicts = READINGS_DICTS
+    if max_workers is None:
+        max_workers = len(readings_dicts)
+    max_workers = max(1, max_workers)
+    with get_hyper_api_session(
+        max_retries=max_retries, backoff_factor=backoff_factor, pool_size=max_workers
+    ) as session, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                get_api_sensor_data,
+                api_key,
+                dt_from,
+                dt_to,
+                readings_dict["columns"],
+                session=session,
+                timeout=timeout,
+                url=url,
+            ): readings_dict
+            for readings_dict in readings_dicts
+        }
+        for future in as_completed(futures):
+            readings_dict = futures[future]
+            try:
+                success, error, data_df_dict = future.result()
+            except Exception as e:
+                # E.g. a malformed response that could not be parsed.
+                success, error, data_df_dict = False, str(e), {}
+            yield readings_dict, success, error, data_df_dict
+
+
 def _get_sensor_id_and_type(aranet_pro_id, engine):
     """Get the CROP sensor ID and sensor type from the CROP database, based on the
     Aranet Pro ID.
@@ -216,13 +358,140 @@ def _get_sensor_id_and_type(aranet_pro_id, engine):
     return sensor_id, sensor_type
 
 
-def import_hyper_metric(
-    engine, dt_from, dt_to, ReadingsClass, columns, sensor_type, conn_string
+def _readings_to_db_frame(api_data_df, sensor_id, columns):
+    """Convert a DataFrame of readings for one sensor, as returned by
+    get_api_sensor_data, to a DataFrame with one column per column of the readings
+    table, i.e. sensor_id, timestamp, and the db_name of every entry in columns.
+    Rows with missing values are dropped, and timestamps are converted to naive UTC.
+    """
+    readings_df = api_data_df.loc[:, [c["df_name"] for c in columns]]
+    readings_df = readings_df[~readings_df.isna().any(axis=1)]
+    readings_df = readings_df.rename(
+        columns={c["df_name"]: c["db_name"] for c in columns}
+    )
+    timestamps = readings_df.index
+    if timestamps.tz is not None:
+        timestamps = timestamps.tz_convert("UTC").tz_localize(None)
+    readings_df.insert(0, "timestamp", timestamps)
+    readings_df.insert(0, "sensor_id", sensor_id)
+    return readings_df.reset_index(drop=True)
+
+
+def bulk_insert_readings(
+    engine, ReadingsClass, readings_df, batch_size=None, return_ids=False
 ):
     """
-    For each type of sensor, make a call to the Hyper API, get a corresponding
-    dictionary of dataframes (keyed by the Aranet ID of the sensor), get the timestamps
-    of existing readings in the database, and upload new readings.
+    Insert readings into the table of ReadingsClass with batched
+    INSERT ... ON CONFLICT (sensor_id, timestamp) DO NOTHING statements, relying on the
+    unique constraint of the readings tables to skip readings that already exist.
+
+    Arguments:
+        engine: sqlalchemy engine, connected to the database
+        ReadingsClass: the SQLAlchemy class (from structure.py) of the readings table
+        readings_df: DataFrame with a column for every column to insert, including
+        sensor_id and timestamp
+        batch_size: int, maximum number of readings per INSERT statement. Defaults to
+        BULK_INSERT_BATCH_SIZE.
+        return_ids: bool, whether to also return the ids of the new rows.
+
+    Returns:
+        num_inserted: pandas Series, number of new readings inserted, indexed by
+        sensor_id. Sensors with no new readings are included with a count of 0.
+        inserted_ids: list of ids of the new rows, only if return_ids is True.
+    """
+    if batch_size is None:
+        batch_size = BULK_INSERT_BATCH_SIZE
+    num_inserted = pd.Series(0, index=readings_df["sensor_id"].unique())
+    inserted_ids = []
+    records = readings_df.to_dict(orient="records")
+    session = session_open(engine)
+    try:
+        for i in range(0, len(records), batch_size):
+            insert_stmt = (
+                insert(ReadingsClass)
+                .values(records[i : i + batch_size])
+                .on_conflict_do_nothing(index_elements=["sensor_id", "timestamp"])
+                .returning(ReadingsClass.id, ReadingsClass.sensor_id)
+            )
+            inserted = session.execute(insert_stmt).fetchall()
+            inserted_ids += [row[0] for row in inserted]
+            num_inserted = num_inserted.add(
+                pd.Series([row[1] for row in inserted], dtype="int64").value_counts(),
+                fill_value=0,
+            )
+    except:
+        # Commit nothing, so that no new rows are left in the table whose ids are not
+        # returned, and that the error isn't hidden by committing an aborted
+        # transaction.
+        session.rollback()
+        session.close()
+        raise
+    session_close(session)
+    if return_ids:
+        return num_inserted.astype(int), inserted_ids
+    return num_inserted.astype(int)
+
+
+def _insert_sensor_readings_by_row(
+    engine, dt_from, dt_to, ReadingsClass, columns, sensor_id, api_data_df
+):
+    """Write the readings of one sensor one row at a time, after filtering out the
+    timestamps that are already in the database. Returns the number of new readings.
+    """
+    session = session_open(engine)
+    db_data_df = get_sensor_readings_db_timestamps(
+        session,
+        sensor_id,
+        dt_from + timedelta(hours=-1),
+        dt_to + timedelta(hours=1),
+    )
+    session_close(session)
+    # From the data returned by Hyper, filter out all the data we already have.
+    if len(db_data_df) > 0:
+        api_index = api_data_df.index
+        db_index = db_data_df.index.tz_localize(api_index.tz)
+        new_data_df = api_data_df[~api_index.isin(db_index)]
+    else:
+        new_data_df = api_data_df
+    new_data_df = new_data_df[~new_data_df.isna().any(axis=1)]
+    if len(new_data_df) == 0:
+        return 0
+
+    logging.info(f"Writing {len(new_data_df)} new readings")
+    session = session_open(engine)
+    # loop over all readings for this sensor.
+    for idx, row in new_data_df.iterrows():
+        new_reading = ReadingsClass(sensor_id=sensor_id, timestamp=idx)
+        for column in columns:
+            setattr(new_reading, column["db_name"], row[column["df_name"]])
+        session.add(new_reading)
+    # end of loop over readings - update the 'last_updated' column for the Sensor.
+    session.query(SensorClass).filter(SensorClass.id == sensor_id).update(
+        {"last_updated": datetime.utcnow()}
+    )
+    session_close(session)
+    return len(new_data_df)
+
+
+def write_hyper_metric(
+    engine,
+    dt_from,
+    dt_to,
+    ReadingsClass,
+    columns,
+    sensor_type,
+    conn_string,
+    hyper_data_dict,
+    bulk=True,
+):
+    """
+    Upload new readings for one type of sensor, given the dictionary of dataframes
+    (keyed by the Aranet ID of the sensor) returned by get_api_sensor_data.
+
+    In bulk mode, the readings of all sensors are written with batched
+    INSERT ... ON CONFLICT DO NOTHING statements, and readings that are already in the
+    database are skipped by the database. Otherwise the timestamps of existing readings
+    are fetched first, and new readings are added one by one.
 
     Arguments:
         engine: sqlalchemy engine, connected to the database
@@ -234,12 +503,14 @@ def import_hyper_metric(
         of module.
         sensor_type: str, only used for log message.
         conn_string: str, only used for log message.
+        hyper_data_dict: dict of {aranet_pro_id (str): DataFrame of sensor_data}
+        bulk: bool, whether to use bulk ingestion.
 
     Returns:
-        success: bool, did we successfully retrieve data from the API, the DB, and
-        upload new data?
+        success: bool, did we successfully upload new data?
         error: str, any error messages that arose
     """
+    success = True
     # Create the readings table if it doesn't exist.
     try:
         ReadingsClass.__table__.create(bind=engine)
@@ -247,21 +518,13 @@ def import_hyper_metric(
         # The table already exists.
         pass
 
-    logging.info(
-        f"Requesting {sensor_type} data from {dt_from} to {dt_to} from the Hyper API"
-    )
-    success, error, hyper_data_dict = get_api_sensor_data(
-        CONST_CROP_HYPER_APIKEY, dt_from, dt_to, columns
-    )
-    if not success:
-        logging.info(error)
-        return success, error
-
-    # Write the data to the CROP database, sensor by sensor.
+    # Write the data to the CROP database, sensor by sensor, or collect it for a bulk
+    # insert.
+    readings_dfs = []
+    num_new_total = 0
     for aranet_pro_id, api_data_df in hyper_data_dict.items():
         logging.info(f"Writing data for sensor with Aranet Pro ID {aranet_pro_id}")
-        # Find the sensor_id that CROP uses for this sensor, and fetch existing data for
-        # this sensor.
+        # Find the sensor_id that CROP uses for this sensor.
         sensor_id, this_sensor_type = _get_sensor_id_and_type(aranet_pro_id, engine)
         if sensor_id is None:
             logging.info(f"Sensor {aranet_pro_id} does not exist in the CROP database")
@@ -275,40 +538,66 @@ def import_hyper_metric(
             logging.warning(msg)
             continue
 
-        session = session_open(engine)
-        db_data_df = get_sensor_readings_db_timestamps(
-            session,
-            sensor_id,
-            dt_from + timedelta(hours=-1),
-            dt_to + timedelta(hours=1),
+        if bulk:
+            readings_dfs.append(_readings_to_db_frame(api_data_df, sensor_id, columns))
+            continue
+
+        num_new = _insert_sensor_readings_by_row(
+            engine, dt_from, dt_to, ReadingsClass, columns, sensor_id, api_data_df
         )
-        session_close(session)
-        # From the data returned by Hyper, filter out all the data we already have.
-        if len(db_data_df) > 0:
-            api_index = api_data_df.index
-            db_index = db_data_df.index.tz_localize(api_index.tz)
-            new_data_df = api_data_df[~api_index.isin(db_index)]
-        else:
-            new_data_df = api_data_df
-        new_data_df = new_data_df[~new_data_df.isna().any(axis=1)]
-        if len(new_data_df) == 0:
+        if num_new == 0:
             continue
+        num_new_total += num_new
 
-        logging.info(f"Writing {len(new_data_df)} new readings")
+        upload_log = "New: {} (uploaded);".format(num_new)
+        log_upload_event(
+            sensor_type,
+            "Hyper API; Sensor ID {}".format(sensor_id),
+            success,
+            upload_log,
+            conn_string,
+        )
+
+    if not bulk:
+        if num_new_total > 0:
+            session = session_open(engine)
+            refresh_rollups(session, ReadingsClass, dt_from=dt_from)
+            if ReadingsClass is ReadingsAranetTRHClass:
+                # We don't know which readings are new, so recompute the batch
+                # statistics.
+                rebuild_batch_trh_stats(session)
+            session_close(session)
+        return True, ""
+    if len(readings_dfs) == 0:
+        return True, ""
+
+    readings_df = pd.concat(readings_dfs, ignore_index=True)
+    logging.info(f"Bulk inserting up to {len(readings_df)} {sensor_type} readings")
+    num_inserted, inserted_ids = bulk_insert_readings(
+        engine, ReadingsClass, readings_df, return_ids=True
+    )
+    if len(inserted_ids) > 0:
+        session = session_open(engine)
+        refresh_rollups(session, ReadingsClass, dt_from=readings_df["timestamp"].min())
+        if ReadingsClass is ReadingsAranetTRHClass:
+            fold_trh_readings_into_batch_stats(session, inserted_ids)
+        session_close(session)
+    num_readings = readings_df.groupby("sensor_id").size()
+    num_duplicates = num_readings - num_inserted.reindex(num_readings.index)
+
+    # Update the 'last_updated' column for all sensors that got new readings.
+    updated_ids = [int(i) for i in num_inserted.index[num_inserted > 0]]
+    if len(updated_ids) > 0:
         session = session_open(engine)
-        # loop over all readings for this sensor.
-        for idx, row in new_data_df.iterrows():
-            new_reading = ReadingsClass(sensor_id=sensor_id, timestamp=idx)
-            for column in columns:
-                setattr(new_reading, column["db_name"], row[column["df_name"]])
-            session.add(new_reading)
-        # end of loop over readings - update the 'last_updated' column for the Sensor.
-        session.query(SensorClass).filter(SensorClass.id == sensor_id).update(
-            {"last_updated": datetime.utcnow()}
+        session.query(SensorClass).filter(SensorClass.id.in_(updated_ids)).update(
+            {"last_updated": datetime.utcnow()}, synchronize_session=False
         )
         session_close(session)
 
-        upload_log = "New: {} (uploaded);".format(len(new_data_df.index))
+    for sensor_id in num_readings.index:
+        upload_log = "New: {} (uploaded); Duplicates: {} (ignored)".format(
+            num_inserted[sensor_id], num_duplicates[sensor_id]
+        )
         log_upload_event(
             sensor_type,
             "Hyper API; Sensor ID {}".format(sensor_id),
@@ -320,18 +609,91 @@ def import_hyper_metric(
     return True, ""
 
 
-def import_hyper_data(conn_string, database, dt_from, dt_to):
+def import_hyper_metric(
+    engine,
+    dt_from,
+    dt_to,
+    ReadingsClass,
+    columns,
+    sensor_type,
+    conn_string,
+    bulk=True,
+):
+    """
+    For each type of sensor, make a call to the Hyper API, get a corresponding
+    dictionary of dataframes (keyed by the Aranet ID of the sensor), and upload new
+    readings with write_hyper_metric.
+
+    Arguments:
+        engine: sqlalchemy engine, connected to the database
+        dt_from: datetime
+        dt_to: datetime,
+        ReadingsClass: the SQLAlchemy class (from structure.py) corresponding to the
+        sensor type
+        columns: list of dicts, names of the columns as defined in READINGS_DICTS at top
+        of module.
+        sensor_type: str, only used for log message.
+        conn_string: str, only used for log message.
+        bulk: bool, whether to use bulk ingestion.
+
+    Returns:
+        success: bool, did we successfully retrieve data from the API, the DB, and
+        upload new data?
+        error: str, any error messages that arose
+    """
+    logging.info(
+        f"Requesting {sensor_type} data from {dt_from} to {dt_to} from the Hyper API"
+    )
+    success, error, hyper_data_dict = get_api_sensor_data(
+        CONST_CROP_HYPER_APIKEY, dt_from, dt_to, columns
+    )
+    if not success:
+        logging.info(error)
+        return success, error
+
+    return write_hyper_metric(
+        engine,
+        dt_from,
+        dt_to,
+        ReadingsClass,
+        columns,
+        sensor_type,
+        conn_string,
+        hyper_data_dict,
+        bulk=bulk,
+    )
+
+
+def import_hyper_data(
+    conn_string,
+    database,
+    dt_from,
+    dt_to,
+    bulk=True,
+    url=None,
+    timeout=None,
+    max_retries=None,
+    backoff_factor=None,
+    max_workers=None,
+):
     """
     This is the main function for this module.
     Uploads data to the CROP database, for various metrics, from the Hyper.ag API.
     Uses the READINGS_DICTS defined at the top of this module to steer what metrics
-    go into what table, and calls import_hyper_metric for every entry in that.
+    go into what table.
+
+    The API requests for all metrics are made concurrently (see fetch_hyper_metrics),
+    and the data for each metric is written to the database with write_hyper_metric
+    as soon as its request completes, while the other requests are still running.
 
     Arguments:
         conn_string: connection string
         database: the name of the database
         dt_from: date range from
         dt_to: date range to
+        bulk: bool, whether to use bulk ingestion, see write_hyper_metric
+        url, timeout, max_retries, backoff_factor, max_workers: see
+        fetch_hyper_metrics
     Returns:
         status, error
     """
@@ -341,18 +703,192 @@ def import_hyper_data(conn_string, database, dt_from, dt_to):
         logging.info(log)
         return success, log
     error = ""
-    # loop through the different types of sensor, and call import_hyper_metric for each
-    for readings_dict in READINGS_DICTS:
+    logging.info(f"Requesting data from {dt_from} to {dt_to} from the Hyper API")
+    for (
+        readings_dict,
+        metric_success,
+        metric_error,
+        hyper_data_dict,
+    ) in fetch_hyper_metrics(
+        CONST_CROP_HYPER_APIKEY,
+        dt_from,
+        dt_to,
+        READINGS_DICTS,
+        url=url,
+        timeout=timeout,
+        max_retries=max_retries,
+        backoff_factor=backoff_factor,
+        max_workers=max_workers,
+    ):
         logging.info("===> Importing data from {}".format(readings_dict["sensor_type"]))
-        metric_success, metric_error = import_hyper_metric(
-            engine,
-            dt_from,
-            dt_to,
-            readings_dict["readings_class"],
-            readings_dict["columns"],
-            readings_dict["sensor_type"],
-            conn_string,
-        )
+        if metric_success:
+            metric_success, metric_error = write_hyper_metric(
+                engine,
+                dt_from,
+                dt_to,
+                readings_dict["readings_class"],
+                readings_dict["columns"],
+                readings_dict["sensor_type"],
+                conn_string,
+                hyper_data_dict,
+                bulk=bulk,
+            )
+        else:
+            logging.info(metric_error)
         success &= metric_success
         error += metric_error
     return success, error
+
+
+def hyper_watermark_name(readings_dict, job_name="hyper"):
+    """Name of the watermark that backfill_hyper_data uses for a metric, i.e. an entry
+    of READINGS_DICTS.
+    """
+    return "{}:{}".format(job_name, readings_dict["readings_class"].__tablename__)
+
+
+def get_hyper_backfill_start(
+    session, readings_dict, dt_to, dt_from=None, job_name="hyper"
+):
+    """
+    Compute where backfill_hyper_data should start for a metric. That's the watermark
+    of the metric, minus HYPER_WATERMARK_OVERLAP, but no earlier than dt_from. Without a
+    watermark, it's dt_from, or HYPER_DEFAULT_LOOKBACK before dt_to.
+
+    Arguments:
+        session: sqlalchemy active session object
+        readings_dict: entry of READINGS_DICTS for the metric
+        dt_to: datetime, end of the backfill
+        dt_from: datetime, start of the backfill, or None to start from the watermark
+        job_name: str, see backfill_hyper_data
+    Returns:
+        start: datetime
+    """
+    watermark = get_watermark(session, hyper_watermark_name(readings_dict, job_name))
+    if watermark is None:
+        return dt_from if dt_from is not None else dt_to - HYPER_DEFAULT_LOOKBACK
+    start = watermark - HYPER_WATERMARK_OVERLAP
+    if dt_from is not None:
+        start = max(start, dt_from)
+    return start
+
+
+def backfill_hyper_data(
+    conn_string,
+    database,
+    dt_from=None,
+    dt_to=None,
+    chunk_size=None,
+    max_chunks=None,
+    job_name="hyper",
+    bulk=True,
+    **fetch_kwargs,
+):
+    """
+    Upload data to the CROP database from the Hyper.ag API, for an arbitrarily long
+    period of time, in chunks.
+
+    The period is split into chunks of chunk_size, and each chunk is requested, parsed
+    and written to the database before the next one is requested, so memory use does
+    not grow with the length of the period. After each chunk has been written for a
+    metric, the watermark of that metric is moved to the end of the chunk. A backfill
+    that is interrupted can then be resumed by calling this function again with the
+    same job_name, and the regular import can compute its window from the watermark.
+
+    Arguments:
+        conn_string: connection string
+        database: the name of the database
+        dt_from: datetime, start of the period. If None, each metric starts from its
+        watermark, see get_hyper_backfill_start.
+        dt_to: datetime, end of the period. Defaults to now.
+        chunk_size: timedelta, length of the chunks. Defaults to
+        HYPER_BACKFILL_CHUNK_SIZE.
+        max_chunks: int, maximum number of chunks to backfill in this call, or None for
+        no limit. The rest of the period is left for the next call, which resumes from
+        the watermarks.
+        job_name: str, prefix of the names of the watermarks. Use a different one for
+        one-off backfills of old periods, so they don't interfere with the watermarks of
+        the regular import.
+        bulk: bool, whether to use bulk ingestion, see write_hyper_metric
+        fetch_kwargs: passed on to fetch_hyper_metrics, e.g. url or timeout.
+    Returns:
+        status, error
+    """
+    if dt_to is None:
+        dt_to = datetime.utcnow()
+    if chunk_size is None:
+        chunk_size = HYPER_BACKFILL_CHUNK_SIZE
+
+    success, log, engine = connect_db(conn_string, database)
+    if not success:
+        logging.info(log)
+        return success, log
+    create_watermark_table(engine)
+
+    session = session_open(engine)
+    starts = {
+        hyper_watermark_name(readings_dict, job_name): get_hyper_backfill_start(
+            session, readings_dict, dt_to, dt_from=dt_from, job_name=job_name
+        )
+        for readings_dict in READINGS_DICTS
+    }
+    session_close(session)
+
+    error = ""
+    # The metrics that are still being backfilled. A metric is dropped after a chunk
+    # fails, so that its watermark never skips over missing data.
+    pending = list(READINGS_DICTS)
+    chunk_from = min(starts.values())
+    num_chunks = 0
+    while chunk_from < dt_to and len(pending) > 0:
+        if max_chunks is not None and num_chunks >= max_chunks:
+            logging.info(
+                f"Stopping the Hyper backfill at {chunk_from} after {num_chunks} "
+                "chunks, the rest is left for the next run"
+            )
+            break
+        num_chunks += 1
+        chunk_to = min(chunk_from + chunk_size, dt_to)
+        chunk_dicts = [
+            readings_dict
+            for readings_dict in pending
+            if starts[hyper_watermark_name(readings_dict, job_name)] < chunk_to
+        ]
+        logging.info(f"Backfilling Hyper data from {chunk_from} to {chunk_to}")
+        for (
+            readings_dict,
+            metric_success,
+            metric_error,
+            hyper_data_dict,
+        ) in fetch_hyper_metrics(
+            CONST_CROP_HYPER_APIKEY,
+            chunk_from,
+            chunk_to,
+            chunk_dicts,
+            **fetch_kwargs,
+        ):
+            if metric_success:
+                metric_success, metric_error = write_hyper_metric(
+                    engine,
+                    chunk_from,
+                    chunk_to,
+                    readings_dict["readings_class"],
+                    readings_dict["columns"],
+                    readings_dict["sensor_type"],
+                    conn_string,
+                    hyper_data_dict,
+                    bulk=bulk,
+                )
+            if metric_success:
+                session = session_open(engine)
+                set_watermark(
+                    session, hyper_watermark_name(readings_dict, job_name), chunk_to
+                )
+                session_close(session)
+            else:
+                logging.info(metric_error)
+                pending.remove(readings_dict)
+                success = False
+                error += metric_error
+        chunk_from = chunk_to
+    return success, error
@@ -0,0 +1,133 @@
+"""
+Python module for creating and refreshing the materialised views that hold the sensor
+location lookups, i.e. the latest location of each sensor and the closest T&RH sensor
+to each location.
+
+These are expensive to compute, but the underlying tables change rarely, so they are
+stored as materialised views and refreshed whenever a location or a sensor location is
+written. Anything that writes to LocationClass or SensorLocationClass (or changes the
+type of a sensor) should call refresh_location_lookups afterwards. The views are
+refreshed concurrently, so that pages reading them are not blocked meanwhile.
+"""
+
+import logging
+
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
+
+from .constants import (
+    CLOSEST_TRH_SENSORS_VIEW_NAME,
+    LATEST_SENSOR_LOCATIONS_VIEW_NAME,
+)
+from .batch_stats import rebuild_batch_trh_stats
+from .queries import (
+    batch_list,
+    closest_trh_sensors,
+    closest_trh_sensors_live,
+    latest_sensor_locations_live,
+    trh_sensors_by_zone,
+)
+
+# The columns that identify a row of each view, used for their unique indices.
+VIEW_INDEX_COLUMNS = {
+    LATEST_SENSOR_LOCATIONS_VIEW_NAME: ("id",),
+    CLOSEST_TRH_SENSORS_VIEW_NAME: ("location_id", "sensor_id"),
+}
+
+
+def _view_definitions(session):
+    """Return a dictionary of view name: SQL for the SELECT that defines the view."""
+    queries = {
+        LATEST_SENSOR_LOCATIONS_VIEW_NAME: latest_sensor_locations_live(session),
+        CLOSEST_TRH_SENSORS_VIEW_NAME: closest_trh_sensors_live(session),
+    }
+    definitions = {}
+    for name, query in queries.items():
+        compiled = query.statement.compile(
+            dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+        )
+        definitions[name] = str(compiled)
+    return definitions
+
+
+def create_location_lookups(engine):
+    """
+    Create the materialised views for the location lookups, if they don't exist.
+
+    Arguments:
+        engine: sqlalchemy engine, connected to the database
+    """
+    session = Session(bind=engine)
+    try:
+        for name, definition in _view_definitions(session).items():
+            session.execute(
+                text(f"CREATE MATERIALIZED VIEW IF NOT EXISTS {name} AS {definition}")
+            )
+            columns = ", ".join(VIEW_INDEX_COLUMNS[name])
+            session.execute(
+                text(
+                    f"CREATE UNIQUE INDEX IF NOT EXISTS {name}_idx ON {name} ({columns})"
+                )
+            )
+        session.commit()
+    finally:
+        session.close()
+
+
+def _lookup_state(session):
+    """Return the closest T&RH sensor rows (location_id, sensor_id) and the ids of the
+    propagation T&RH sensors, as currently given by the location lookups.
+    """
+    closest = {tuple(row) for row in session.execute(closest_trh_sensors(session))}
+    propagation = {
+        row.id for row in session.execute(trh_sensors_by_zone(session, "Propagation"))
+    }
+    return closest, propagation
+
+
+def refresh_location_lookups(session, rebuild_batch_stats=True, all_batches=False):
+    """
+    Recompute the materialised views for the location lookups, and the batch T&RH
+    statistics that depend on them. Any pending changes in the session are committed
+    first.
+
+    Only the statistics of the batches at locations whose closest T&RH sensor changed
+    are recomputed, or those of all batches if the propagation T&RH sensors changed.
+
+    Arguments:
+        session: sqlalchemy active session object
+        rebuild_batch_stats: bool, False to leave the batch statistics as they are, e.g.
+        after adding a location, which has no batches yet
+        all_batches: bool, True to recompute the statistics of all batches. The
+        propagation sensors also depend on the types of the sensors and the zones of
+        the locations, which are committed before the views are refreshed, so pass
+        this after changing either.
+    """
+    session.commit()
+    if rebuild_batch_stats:
+        closest_before, propagation_before = _lookup_state(session)
+    for name in VIEW_INDEX_COLUMNS:
+        session.execute(text(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {name}"))
+    session.commit()
+    logging.info("Refreshed the location lookups")
+    if not rebuild_batch_stats:
+        return
+    closest_after, propagation_after = _lookup_state(session)
+    if all_batches or propagation_after != propagation_before:
+        rebuild_batch_trh_stats(session)
+        return
+    location_ids = {row[0] for row in closest_before ^ closest_after}
+    if not location_ids:
+        return
+    batch_list_sq = batch_list(session).subquery("batch_list")
+    batch_ids = [
+        row.batch_id
+        for row in session.execute(
+            session.query(batch_list_sq.c.batch_id).filter(
+                batch_list_sq.c.location_id.in_(location_ids)
+            )
+        )
+    ]
+    if batch_ids:
+        rebuild_batch_trh_stats(session, batch_ids=batch_ids)
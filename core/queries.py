@@ -3,21 +3,34 @@
 Each function return a SQLAlchemy Query object. Turning these into subqueries or CTEs is
 the responsibility of the caller.
 """
-from sqlalchemy import and_, case, func
+from datetime import timedelta
+
+from sqlalchemy import and_, case, func, literal
 from sqlalchemy.orm import aliased, Query
 
 from .structure import (
     BatchClass,
     BatchEventClass,
+    BatchTRHStatsClass,
+    ClosestTRHSensorsView,
     CropTypeClass,
     LocationClass,
     HarvestClass,
+    LatestSensorLocationsView,
     ReadingsAranetTRHClass,
+    ReadingsRollupClass,
     SensorClass,
     SensorLocationClass,
     TypeClass,
 )
 
+# The T&RH quantities aggregated over batches, and the suffixes used for them in the
+# columns of grow_trh_aggregate, propagate_trh_aggregate, and batch_trh_stats.
+TRH_AGGREGATE_COLUMNS = {"temperature": "temp", "humidity": "rh", "vpd": "vpd"}
+
+# The granularities of the readings rollups, from the coarsest to the finest.
+ROLLUP_GRANULARITIES = {"day": timedelta(days=1), "hour": timedelta(hours=1)}
+
 # The last columns considered to be in FrontFarm and MidFarm, respectively.
 REGION_SPLIT_FRONT_MID = 10
 REGION_SPLIT_MID_BACK = 23
@@ -31,6 +44,17 @@ def crop_types(session):
 def latest_sensor_locations(session):
     """A query like SensorLocationClass, but with only one row per sensor, the one with
     the most recent installation date.
+
+    This reads the materialised view defined by latest_sensor_locations_live, see
+    core.lookups for how it is kept up to date.
+    """
+    query = session.query(LatestSensorLocationsView)
+    return query
+
+
+def latest_sensor_locations_live(session):
+    """Like latest_sensor_locations, but computed from the SensorLocationClass table
+    rather than read from the materialised view.
     """
     subquery = session.query(
         SensorLocationClass,
@@ -44,11 +68,8 @@ def latest_sensor_locations(session):
     return query
 
 
-def latest_trh_locations(session):
-    """A query like latest_sensor_locations, but restricted to Aranet T&RH sensors
-    only.
-    """
-    subquery = latest_sensor_locations(session).subquery()
+def _restrict_to_trh(session, locations_q):
+    subquery = locations_q.subquery()
     query = (
         session.query(subquery)
         .join(SensorClass, SensorClass.id == subquery.c.sensor_id)
@@ -58,6 +79,18 @@ def latest_trh_locations(session):
     return query
 
 
+def latest_trh_locations(session):
+    """A query like latest_sensor_locations, but restricted to Aranet T&RH sensors
+    only.
+    """
+    return _restrict_to_trh(session, latest_sensor_locations(session))
+
+
+def latest_trh_locations_live(session):
+    """Like latest_trh_locations, but computed from latest_sensor_locations_live."""
+    return _restrict_to_trh(session, latest_sensor_locations_live(session))
+
+
 def location_distances(session):
     """A query with three columns: id1, id2, which are location ids, and distance, which
     is the distance metric value for those two locations.
@@ -108,7 +141,28 @@ def sensor_distances(session, latest_trh_locations_q=None):
 def closest_trh_sensors(session, latest_trh_locations_q=None):
     """Query with two columns: location_id (for every location there is) and sensor_id
     for the T&RH sensor closest to that location.
+
+    By default this reads the materialised view defined by closest_trh_sensors_live. If
+    latest_trh_locations_q is given, the closest sensors are computed from it instead.
     """
+    if latest_trh_locations_q is None:
+        query = session.query(
+            ClosestTRHSensorsView.c.location_id, ClosestTRHSensorsView.c.sensor_id
+        )
+        return query
+    return closest_trh_sensors_live(
+        session, latest_trh_locations_q=latest_trh_locations_q
+    )
+
+
+def closest_trh_sensors_live(session, latest_trh_locations_q=None):
+    """Like closest_trh_sensors, but computed from the sensor location and location
+    tables rather than read from the materialised view.
+    """
+    if latest_trh_locations_q is None:
+        latest_trh_locations_q = latest_trh_locations_live(session).subquery(
+            "latest_trh_locations_sensor_distances"
+        )
     sensor_distances_cte = sensor_distances(
         session, latest_trh_locations_q=latest_trh_locations_q
     ).cte(name="sensor_distances")
@@ -337,38 +391,120 @@ def propagate_trh_aggregate(session, batches_sq, trh_q, latest_trh_locations_q):
     return query
 
 
+def batch_trh_partial_aggregates(session, phase, batches_sq, trh_sq):
+    """Query with columns batch_id, phase, num_readings, and the sum, sum of squares,
+    minimum and maximum of each of temperature, humidity, and vpd (named e.g.
+    temperature_sum), over the T&RH readings of each batch in the given phase. The
+    columns match those of BatchTRHStatsClass.
+
+    For phase "grow" the readings are those from the sensor closest to the batch,
+    between transfer and harvest. For phase "propagate" they are those from the
+    propagation sensors, between propagation and transfer. Batches with no readings are
+    not included.
+
+    batches_sq is a subquery (probably of batch_list) with columns batch_id,
+    location_id, propagate_time, transfer_time and harvest_time, trh_sq is a subquery of
+    trh_with_vpd.
+    """
+    aggregates = []
+    for column_name in TRH_AGGREGATE_COLUMNS:
+        column = trh_sq.c[column_name]
+        aggregates += [
+            func.sum(column).label(f"{column_name}_sum"),
+            func.sum(column * column).label(f"{column_name}_sumsq"),
+            func.min(column).label(f"{column_name}_min"),
+            func.max(column).label(f"{column_name}_max"),
+        ]
+    query = session.query(
+        batches_sq.c.batch_id,
+        literal(phase).label("phase"),
+        func.count(trh_sq.c.id).label("num_readings"),
+        *aggregates,
+    )
+    if phase == "grow":
+        closest_trh_sensors_sq = closest_trh_sensors(session).subquery(
+            "closest_trh_sensors_partial"
+        )
+        query = query.join(
+            closest_trh_sensors_sq,
+            closest_trh_sensors_sq.c.location_id == batches_sq.c.location_id,
+        ).join(
+            trh_sq,
+            and_(
+                batches_sq.c.transfer_time < trh_sq.c.timestamp,
+                trh_sq.c.timestamp < batches_sq.c.harvest_time,
+                closest_trh_sensors_sq.c.sensor_id == trh_sq.c.sensor_id,
+            ),
+        )
+    elif phase == "propagate":
+        propagation_trh_sensors_q = trh_sensors_by_zone(session, "Propagation")
+        query = query.join(
+            trh_sq,
+            and_(
+                batches_sq.c.propagate_time < trh_sq.c.timestamp,
+                trh_sq.c.timestamp < batches_sq.c.transfer_time,
+                trh_sq.c.sensor_id.in_(propagation_trh_sensors_q),
+            ),
+        )
+    else:
+        raise ValueError(f"Unknown batch phase: {phase}")
+    query = query.group_by(batches_sq.c.batch_id)
+    return query
+
+
+def batch_trh_stats(session, phase):
+    """Query with the same columns as grow_trh_aggregate, i.e. batch_id and the mean,
+    min, max and sample standard deviation of temperature, humidity and vpd, computed
+    from the partial aggregates in BatchTRHStatsClass for the given phase ("grow" or
+    "propagate").
+    """
+    n = BatchTRHStatsClass.num_readings
+    averages, minima, maxima, sigmas = [], [], [], []
+    for column_name, suffix in TRH_AGGREGATE_COLUMNS.items():
+        total = getattr(BatchTRHStatsClass, f"{column_name}_sum")
+        total_sq = getattr(BatchTRHStatsClass, f"{column_name}_sumsq")
+        averages.append((total / n).label(f"avg_{suffix}"))
+        minima.append(
+            getattr(BatchTRHStatsClass, f"{column_name}_min").label(f"min_{suffix}")
+        )
+        maxima.append(
+            getattr(BatchTRHStatsClass, f"{column_name}_max").label(f"max_{suffix}")
+        )
+        # Rounding errors can make the variance very slightly negative.
+        variance = func.greatest(total_sq - total * total / n, 0.0) / func.nullif(
+            n - 1, 0
+        )
+        sigmas.append(
+            case([(n > 1, func.sqrt(variance))], else_=None).label(f"sigma_{suffix}")
+        )
+    query = session.query(
+        BatchTRHStatsClass.batch_id, *averages, *minima, *maxima, *sigmas
+    ).filter(BatchTRHStatsClass.phase == phase)
+    return query
+
+
 def batch_list_with_trh(session):
     """Query like batch_list, but with columns for information about the nearest sensor,
     and T&RH growing and propagation conditions.
 
     The added columns are called closest_sensor_name, sensor_location_summary,
     avg_grow_temperature, avg_grow_humidity, avg_grow_vpd, avg_propagate_temperature,
-    avg_propagate_humidity, and avg_propagate_vpd.
+    avg_propagate_humidity, and avg_propagate_vpd, and similarly for min, max and sigma.
+
+    The T&RH conditions are read from BatchTRHStatsClass, see core.batch_stats for how
+    it is kept up to date.
     """
     batch_list_sq = batch_list(session).subquery("batch_list")
 
-    # Drop all the TRH data from before the first batch event, to make the following
-    # queries faster.
-    first_event_time_sq = first_batch_event_time(session).subquery("first_event_time")
-    trh_q = trh_with_vpd(session).filter(
-        ReadingsAranetTRHClass.timestamp >= first_event_time_sq.c.min_time
-    )
-    trh_sq = trh_q.subquery("trh")
-
     latest_trh_locations_cte = latest_trh_locations(session).cte(
         name="latest_trh_locations"
     )
 
-    closest_trh_sensors_cte = closest_trh_sensors(
-        session, latest_trh_locations_q=latest_trh_locations_cte
-    ).cte(name="closest_trh_sensors_grow_trh_agg")
-    grow_trh_sq = grow_trh_aggregate(
-        session, batch_list_sq, trh_sq, closest_trh_sensors_cte
-    ).subquery("grow_trh")
-
-    propagate_trh_sq = propagate_trh_aggregate(
-        session, batch_list_sq, trh_q, latest_trh_locations_cte
-    ).subquery("propagate_trh")
+    closest_trh_sensors_cte = closest_trh_sensors(session).cte(
+        name="closest_trh_sensors_grow_trh_agg"
+    )
+    grow_trh_sq = batch_trh_stats(session, "grow").subquery("grow_trh")
+    propagate_trh_sq = batch_trh_stats(session, "propagate").subquery("propagate_trh")
 
     locations_sq = locations_with_extras(session).subquery("locations2")
 
@@ -570,3 +706,73 @@ def locations_with_extras(session):
         ).label("summary"),
     )
     return query
+
+
+def floor_to_granularity(timestamp, granularity):
+    """Round a datetime down to the start of its rollup bucket ("hour" or "day")."""
+    timestamp = timestamp.replace(minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        timestamp = timestamp.replace(hour=0)
+    return timestamp
+
+
+def rollup_granularity(resolution):
+    """Return the coarsest rollup granularity whose buckets are no longer than
+    resolution (a timedelta), or None if no rollup is fine enough and the readings have
+    to be queried directly.
+    """
+    for granularity, period in ROLLUP_GRANULARITIES.items():
+        if period <= resolution:
+            return granularity
+    return None
+
+
+def readings_rollup(
+    session, ReadingsClass, metrics, dt_from, dt_to, resolution=timedelta(hours=1)
+):
+    """Query of aggregated readings of ReadingsClass from dt_from to dt_to, read from
+    the coarsest rollup that has at least the given resolution (a timedelta), see
+    rollup_granularity.
+
+    The columns are sensor_id, timestamp (the start of each bucket), and for each
+    metric in metrics (e.g. "temperature"), one with the same name for the mean, and
+    ones called e.g. temperature_min, temperature_max and temperature_count. The
+    buckets that contain dt_from and dt_to are included in full.
+
+    Raises a ValueError if no rollup is fine enough.
+    """
+    granularity = rollup_granularity(resolution)
+    if granularity is None:
+        raise ValueError(f"No rollup with a resolution of {resolution}")
+    columns = []
+    for metric in metrics:
+        is_metric = ReadingsRollupClass.metric == metric
+        columns += [
+            func.max(case([(is_metric, ReadingsRollupClass.mean)])).label(metric),
+            func.max(case([(is_metric, ReadingsRollupClass.min)])).label(
+                f"{metric}_min"
+            ),
+            func.max(case([(is_metric, ReadingsRollupClass.max)])).label(
+                f"{metric}_max"
+            ),
+            func.max(case([(is_metric, ReadingsRollupClass.num_readings)])).label(
+                f"{metric}_count"
+            ),
+        ]
+    query = (
+        session.query(
+            ReadingsRollupClass.sensor_id, ReadingsRollupClass.timestamp, *columns
+        )
+        .filter(
+            and_(
+                ReadingsRollupClass.readings_table == ReadingsClass.__tablename__,
+                ReadingsRollupClass.granularity == granularity,
+                ReadingsRollupClass.metric.in_(metrics),
+                ReadingsRollupClass.timestamp
+                >= floor_to_granularity(dt_from, granularity),
+                ReadingsRollupClass.timestamp <= dt_to,
+            )
+        )
+        .group_by(ReadingsRollupClass.sensor_id, ReadingsRollupClass.timestamp)
+    )
+    return query
@@ -0,0 +1,187 @@
+"""
+Python module for maintaining the hourly and daily rollups of sensor readings, stored in
+ReadingsRollupClass.
+
+Each rollup is refreshed incrementally from a watermark, the latest reading timestamp
+it has processed. A refresh recomputes every bucket from the one containing the
+watermark onwards, so it is safe to repeat. Readings that arrive late, with timestamps
+before the watermark, are picked up by passing dt_from. A rollup without a watermark,
+e.g. on a database that predates the rollups, is first computed from all the readings,
+so that no history before the first refresh is left out.
+"""
+
+import logging
+
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql import func, literal
+
+from .queries import ROLLUP_GRANULARITIES, floor_to_granularity, trh_with_vpd
+from .structure import (
+    ReadingsAegisIrrigationClass,
+    ReadingsAranetAirVelocityClass,
+    ReadingsAranetCO2Class,
+    ReadingsAranetTRHClass,
+    ReadingsRollupClass,
+)
+from .watermarks import create_watermark_table, get_watermark, set_watermark
+
+# The readings columns that are rolled up for each readings table.
+ROLLUP_METRICS = {
+    ReadingsAranetTRHClass: ["temperature", "humidity", "vpd"],
+    ReadingsAranetCO2Class: ["co2"],
+    ReadingsAranetAirVelocityClass: ["air_velocity"],
+    ReadingsAegisIrrigationClass: [
+        "temperature",
+        "pH",
+        "dissolved_oxygen",
+        "conductivity",
+        "turbidity",
+        "peroxide",
+    ],
+}
+
+
+def rollup_watermark_name(ReadingsClass, granularity):
+    """The name of the watermark of the rollup of one readings table."""
+    return f"rollup:{ReadingsClass.__tablename__}:{granularity}"
+
+
+def _readings_query(session, ReadingsClass):
+    """Query of the readings to roll up, with the derived vpd column for T&RH."""
+    if ReadingsClass is ReadingsAranetTRHClass:
+        return trh_with_vpd(session)
+    return session.query(ReadingsClass)
+
+
+def refresh_rollup(session, ReadingsClass, granularity, dt_from=None):
+    """
+    Recompute the rollup of ReadingsClass at the given granularity, for all buckets
+    from the one containing the watermark, or dt_from if that is earlier. If there is
+    no watermark yet, the whole history is rolled up, whatever dt_from is.
+
+    Arguments:
+        session: sqlalchemy active session object
+        ReadingsClass: the SQLAlchemy class (from structure.py) of the readings table
+        granularity: str, "hour" or "day"
+        dt_from: datetime, optional, earliest timestamp of new readings
+    Returns:
+        dt_from: datetime, the start of the first bucket that was recomputed, or None if
+        there were no readings to roll up
+    """
+    watermark_name = rollup_watermark_name(ReadingsClass, granularity)
+    watermark = get_watermark(session, watermark_name)
+    if watermark is None:
+        # Nothing has been rolled up yet, including any readings before dt_from.
+        dt_from = None
+    else:
+        dt_from = floor_to_granularity(
+            min(watermark, dt_from) if dt_from is not None else watermark, granularity
+        )
+
+    readings_q = _readings_query(session, ReadingsClass)
+    if dt_from is not None:
+        readings_q = readings_q.filter(ReadingsClass.timestamp >= dt_from)
+    readings_sq = readings_q.subquery("readings")
+    latest = session.query(func.max(readings_sq.c.timestamp)).scalar()
+    if latest is None:
+        return None
+
+    bucket = func.date_trunc(granularity, readings_sq.c.timestamp)
+    for metric in ROLLUP_METRICS[ReadingsClass]:
+        column = readings_sq.c[metric]
+        select = session.query(
+            literal(ReadingsClass.__tablename__),
+            readings_sq.c.sensor_id,
+            literal(granularity),
+            literal(metric),
+            bucket,
+            func.count(column),
+            func.avg(column),
+            func.min(column),
+            func.max(column),
+        ).group_by(readings_sq.c.sensor_id, bucket)
+        insert_stmt = insert(ReadingsRollupClass).from_select(
+            [
+                "readings_table",
+                "sensor_id",
+                "granularity",
+                "metric",
+                "timestamp",
+                "num_readings",
+                "mean",
+                "min",
+                "max",
+            ],
+            select.statement,
+        )
+        insert_stmt = insert_stmt.on_conflict_do_update(
+            index_elements=["sensor_id", "granularity", "metric", "timestamp"],
+            set_={
+                "num_readings": insert_stmt.excluded.num_readings,
+                "mean": insert_stmt.excluded.mean,
+                "min": insert_stmt.excluded.min,
+                "max": insert_stmt.excluded.max,
+                "time_updated": func.now(),
+            },
+        )
+        session.execute(insert_stmt)
+    session.commit()
+    set_watermark(session, watermark_name, latest)
+    return dt_from
+
+
+def _create_rollup_tables(engine):
+    """Create the rollup and watermark tables if they don't exist."""
+    ReadingsRollupClass.__table__.create(bind=engine, checkfirst=True)
+    create_watermark_table(engine)
+
+
+def seed_rollups(engine):
+    """
+    Create the rollup tables if they don't exist, and roll up all the readings of each
+    readings table and granularity that has not been rolled up yet.
+
+    Arguments:
+        engine: sqlalchemy engine, connected to the database
+    """
+    _create_rollup_tables(engine)
+    session = Session(bind=engine)
+    try:
+        for readings_class in ROLLUP_METRICS:
+            for granularity in ROLLUP_GRANULARITIES:
+                watermark_name = rollup_watermark_name(readings_class, granularity)
+                if get_watermark(session, watermark_name) is None:
+                    refresh_rollup(session, readings_class, granularity)
+                    logging.info(
+                        f"Seeded the {granularity} rollup of "
+                        f"{readings_class.__tablename__}"
+                    )
+    finally:
+        session.close()
+
+
+def refresh_rollups(session, ReadingsClass=None, dt_from=None):
+    """
+    Refresh the hourly and daily rollups of ReadingsClass, or of all the readings
+    tables if ReadingsClass is None. See refresh_rollup.
+
+    Arguments:
+        session: sqlalchemy active session object
+        ReadingsClass: the SQLAlchemy class (from structure.py) of the readings table
+        dt_from: datetime, optional, earliest timestamp of new readings
+    """
+    _create_rollup_tables(session.get_bind())
+    if ReadingsClass is None:
+        readings_classes = list(ROLLUP_METRICS)
+    else:
+        readings_classes = [ReadingsClass]
+    for readings_class in readings_classes:
+        for granularity in ROLLUP_GRANULARITIES:
+            refreshed_from = refresh_rollup(
+                session, readings_class, granularity, dt_from=dt_from
+            )
+            logging.info(
+                f"Refreshed the {granularity} rollup of {readings_class.__tablename__}"
+                f" from {refreshed_from}"
+            )
@@ -16,7 +16,9 @@ from sqlalchemy import (
     Integer,
     JSON,
     LargeBinary,
+    MetaData,
     String,
+    Table,
     Text,
     Unicode,
     UniqueConstraint,
@@ -60,6 +62,11 @@ from .constants import (
     HARVEST_TABLE_NAME,
     WARNING_TYPES_TABLE_NAME,
     WARNINGS_TABLE_NAME,
+    DATA_WATERMARK_TABLE_NAME,
+    BATCH_TRH_STATS_TABLE_NAME,
+    READINGS_ROLLUP_TABLE_NAME,
+    LATEST_SENSOR_LOCATIONS_VIEW_NAME,
+    CLOSEST_TRH_SENSORS_VIEW_NAME,
 )
 
 SQLA = SQLAlchemy()
@@ -882,3 +889,119 @@ class WeatherForecastsClass(BASE):
     source = Column(String(50), nullable=True)
     time_created = Column(DateTime(), server_default=func.now())
     time_updated = Column(DateTime(), onupdate=func.now())
+
+
+class DataWatermarkClass(BASE):
+    """
+    High-water marks for data processing jobs, such as ingress backfills.
+
+    Each row records the time up to which the job called `name` has been completed, so
+    that the next run of the job can continue from there.
+    """
+
+    __tablename__ = DATA_WATERMARK_TABLE_NAME
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String(100), nullable=False, unique=True)
+    timestamp = Column(DateTime, nullable=False)
+
+    time_created = Column(DateTime(), server_default=func.now())
+    time_updated = Column(DateTime(), onupdate=func.now())
+
+
+class BatchTRHStatsClass(BASE):
+    """
+    Partial aggregates of the T&RH conditions a batch was exposed to, one row per
+    batch and phase ("grow" or "propagate").
+
+    The count, sums, sums of squares, minima and maxima can be merged with those of
+    new readings, and the means and standard deviations computed from them.
+    """
+
+    __tablename__ = BATCH_TRH_STATS_TABLE_NAME
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    batch_id = Column(
+        Integer,
+        ForeignKey("{}.{}".format(BATCH_TABLE_NAME, ID_COL_NAME)),
+        nullable=False,
+    )
+    phase = Column(String(20), nullable=False)
+    num_readings = Column(Integer, nullable=False)
+
+    temperature_sum = Column(Float, nullable=False)
+    temperature_sumsq = Column(Float, nullable=False)
+    temperature_min = Column(Float, nullable=False)
+    temperature_max = Column(Float, nullable=False)
+    humidity_sum = Column(Float, nullable=False)
+    humidity_sumsq = Column(Float, nullable=False)
+    humidity_min = Column(Float, nullable=False)
+    humidity_max = Column(Float, nullable=False)
+    vpd_sum = Column(Float, nullable=False)
+    vpd_sumsq = Column(Float, nullable=False)
+    vpd_min = Column(Float, nullable=False)
+    vpd_max = Column(Float, nullable=False)
+
+    time_created = Column(DateTime(), server_default=func.now())
+    time_updated = Column(DateTime(), onupdate=func.now())
+
+    # arguments
+    __table_args__ = (UniqueConstraint("batch_id", "phase"),)
+
+
+class ReadingsRollupClass(BASE):
+    """
+    Hourly and daily aggregates of sensor readings, one row per sensor, granularity
+    ("hour" or "day"), metric (the name of the readings column, e.g. "temperature"), and
+    time bucket. timestamp is the start of the bucket.
+    """
+
+    __tablename__ = READINGS_ROLLUP_TABLE_NAME
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    readings_table = Column(String(100), nullable=False)
+    sensor_id = Column(
+        Integer,
+        ForeignKey("{}.{}".format(SENSOR_TABLE_NAME, ID_COL_NAME)),
+        nullable=False,
+    )
+    granularity = Column(String(10), nullable=False)
+    metric = Column(String(50), nullable=False)
+    timestamp = Column(DateTime, nullable=False, index=True)
+
+    num_readings = Column(Integer, nullable=False)
+    mean = Column(Float, nullable=True)
+    min = Column(Float, nullable=True)
+    max = Column(Float, nullable=True)
+
+    time_created = Column(DateTime(), server_default=func.now())
+    time_updated = Column(DateTime(), onupdate=func.now())
+
+    # arguments
+    __table_args__ = (
+        UniqueConstraint("sensor_id", "granularity", "metric", "timestamp"),
+    )
+
+
+# Materialised views. These are kept in their own metadata, so that create_all doesn't
+# try to create them as tables. They are created and refreshed by core.lookups.
+VIEWS_METADATA = MetaData()
+
+LatestSensorLocationsView = Table(
+    LATEST_SENSOR_LOCATIONS_VIEW_NAME,
+    VIEWS_METADATA,
+    Column(ID_COL_NAME, Integer, primary_key=True),
+    Column("sensor_id", Integer),
+    Column("location_id", Integer),
+    Column("installation_date", DateTime),
+    Column("time_created", DateTime),
+    Column("time_updated", DateTime),
+    Column("max_date", DateTime),
+)
+
+ClosestTRHSensorsView = Table(
+    CLOSEST_TRH_SENSORS_VIEW_NAME,
+    VIEWS_METADATA,
+    Column("location_id", Integer, primary_key=True),
+    Column("sensor_id", Integer, primary_key=True),
+)
@@ -243,6 +243,7 @@ def log_upload_event(sensor_type, filename, status, log, connection_string):
     success = type_id > -1
 
     if not success:
+        session.close()
         return success, error
 
     if status:
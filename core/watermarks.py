@@ -0,0 +1,65 @@
+"""
+Python module for reading and updating the high-water marks of data processing jobs,
+stored in the DataWatermarkClass table.
+"""
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import ProgrammingError
+from sqlalchemy.sql import func
+
+from .structure import DataWatermarkClass
+
+
+def create_watermark_table(engine):
+    """
+    Create the watermark table if it doesn't exist.
+
+    Arguments:
+        engine: sqlalchemy engine, connected to the database
+    """
+    try:
+        DataWatermarkClass.__table__.create(bind=engine)
+    except ProgrammingError:
+        # The table already exists.
+        pass
+
+
+def get_watermark(session, name):
+    """
+    Get the high-water mark of a job.
+
+    Arguments:
+        session: sqlalchemy active session object
+        name: str, name of the job
+    Returns:
+        timestamp: datetime, or None if the job has no watermark yet
+    """
+    query = session.query(DataWatermarkClass.timestamp).filter(
+        DataWatermarkClass.name == name
+    )
+    result = session.execute(query).fetchone()
+    return None if result is None else result[0]
+
+
+def set_watermark(session, name, timestamp):
+    """
+    Set the high-water mark of a job, and commit. A watermark is never moved
+    backwards, if the existing one is later than timestamp it is kept.
+
+    Arguments:
+        session: sqlalchemy active session object
+        name: str, name of the job
+        timestamp: datetime
+    """
+    insert_stmt = insert(DataWatermarkClass).values(name=name, timestamp=timestamp)
+    upsert_stmt = insert_stmt.on_conflict_do_update(
+        index_elements=["name"],
+        set_={
+            "timestamp": func.greatest(
+                DataWatermarkClass.timestamp, insert_stmt.excluded.timestamp
+            ),
+            "time_updated": func.now(),
+        },
+    )
+    session.execute(upsert_stmt)
+    session.commit()
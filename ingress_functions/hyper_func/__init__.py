@@ -2,13 +2,17 @@
 Importing Hyper.ag data using Azure FunctionApp.
 """
 
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timezone
 import logging
 
 import azure.functions as func
 
-from core.ingress_hyper import import_hyper_data
-from core.constants import SQL_CONNECTION_STRING, SQL_DBNAME
+from core.ingress_hyper import backfill_hyper_data
+from core.constants import (
+    CONST_HYPER_BACKFILL_MAX_CHUNKS,
+    SQL_CONNECTION_STRING,
+    SQL_DBNAME,
+)
 
 
 def hyper_import(mytimer: func.TimerRequest):
@@ -19,9 +23,16 @@ def hyper_import(mytimer: func.TimerRequest):
     utc_timestamp = datetime.utcnow().replace(tzinfo=timezone.utc).isoformat()
     logging.info("Python Hyper timer trigger function started at %s", utc_timestamp)
 
+    # The start of the window is computed from the watermark of each metric, so that
+    # any gap since the last successful run is backfilled, a limited number of chunks
+    # at a time so that the run finishes within the function timeout.
     dt_to = datetime.utcnow()
-    dt_from = dt_to + timedelta(days=-1)
-    import_hyper_data(SQL_CONNECTION_STRING, SQL_DBNAME, dt_from, dt_to)
+    backfill_hyper_data(
+        SQL_CONNECTION_STRING,
+        SQL_DBNAME,
+        dt_to=dt_to,
+        max_chunks=CONST_HYPER_BACKFILL_MAX_CHUNKS,
+    )
 
     utc_timestamp = datetime.utcnow().replace(tzinfo=timezone.utc).isoformat()
     logging.info("Python Hyper timer trigger function finished at %s", utc_timestamp)
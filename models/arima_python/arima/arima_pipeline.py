@@ -6,18 +6,38 @@ import numpy as np
 from copy import deepcopy
 import pandas as pd
 import logging
+from contextlib import contextmanager
 from typing import Tuple, Union
 
 try:
     from arima.config import config
+    from arima.model_store import load_model_state, update_model_state
+    from arima.process_pool import get_num_workers, spawn_executor
 except ModuleNotFoundError:
     from models.arima_python.arima.config import config
+    from models.arima_python.arima.model_store import (
+        load_model_state,
+        update_model_state,
+    )
+    from models.arima_python.arima.process_pool import (
+        get_num_workers,
+        spawn_executor,
+    )
 
 
 logger = logging.getLogger(__name__)
 
 arima_config = config(section="arima")
 
+# the entries of the model state of a sensor that are set by `fit_arima_warm`
+WARM_START_ENTRIES = [
+    "arima_order",
+    "seasonal_order",
+    "trend",
+    "full_fit_timestamp",
+    "params",
+]
+
 
 def get_forecast_timestamp(data: pd.Series) -> pd.Timestamp:
     """
@@ -45,34 +65,156 @@ def get_forecast_timestamp(data: pd.Series) -> pd.Timestamp:
     return forecast_timestamp
 
 
-def fit_arima(train_data: pd.Series) -> SARIMAXResultsWrapper:
+@contextmanager
+def arima_config_overrides(overrides: Union[dict, None]):
     """
-    Fit a SARIMAX statsmodels model to a
-    training dataset (time series).
+    Temporarily update `arima_config`, e.g. with the model
+    orders selected for a sensor, restoring it on exit.
+
+    Arguments:
+        overrides: dict of settings of the [arima] section of
+            config.ini and their values, or None.
+    """
+    overrides = overrides or {}
+    original = {key: arima_config[key] for key in overrides}
+    arima_config.update(overrides)
+    try:
+        yield
+    finally:
+        arima_config.update(original)
+
+
+def build_arima(train_data: pd.Series) -> SARIMAX:
+    """
+    Build a SARIMAX statsmodels model of a
+    training dataset (time series), without fitting it.
     The model parameters are specified through the
     `arima_order`, `seasonal_order` and `trend`
     settings in config.ini.
 
     Parameters:
         train_data: a pandas Series containing the
-            training data on which to fit the model.
+            training data of the model.
 
     Returns:
-        model_fit: the fitted model, which can now be
-            used for forecasting.
+        model: the SARIMAX model.
     """
-    model = SARIMAX(
+    return SARIMAX(
         train_data,
         order=arima_config["arima_order"],
         seasonal_order=arima_config["seasonal_order"],
         trend=arima_config["trend"],
     )
+
+
+def fit_arima(
+    train_data: pd.Series,
+    start_params: Union[np.ndarray, None] = None,
+    maxiter: Union[int, None] = None,
+) -> SARIMAXResultsWrapper:
+    """
+    Fit a SARIMAX statsmodels model to a
+    training dataset (time series).
+    The model parameters are specified through the
+    `arima_order`, `seasonal_order` and `trend`
+    settings in config.ini.
+
+    Parameters:
+        train_data: a pandas Series containing the
+            training data on which to fit the model.
+        start_params: optional initial guess of the
+            model parameters, e.g. the parameters fitted
+            in a previous run. The default is the
+            statsmodels initial guess.
+        maxiter: optional maximum number of iterations
+            of the optimizer. The default is that of
+            statsmodels.
+
+    Returns:
+        model_fit: the fitted model, which can now be
+            used for forecasting.
+    """
+    model = build_arima(train_data)
+    fit_kwargs = {} if maxiter is None else {"maxiter": maxiter}
     model_fit = model.fit(
-        disp=False
+        start_params=start_params, disp=False, **fit_kwargs
     )  # fits the model by maximum likelihood via Kalman filter
     return model_fit
 
 
+def needs_full_refit(data: pd.Series, model_state: Union[dict, None]) -> bool:
+    """
+    Decide whether the model parameters must be fitted from
+    scratch, rather than starting from those of a previous run.
+
+    Parameters:
+        data: the time series on which the model is to be fitted,
+            as a pandas Series indexed by timestamp.
+        model_state: the model state saved by the previous run,
+            see `fit_arima_warm`, or None.
+
+    Returns:
+        full_refit: True if there is no model state, if it was saved
+            for different `arima_order`, `seasonal_order` or `trend`
+            settings, or if the parameters were last fitted from
+            scratch more than `full_refit_hours` hours before the end
+            of `data`.
+    """
+    if model_state is None:
+        return True
+    for setting in ["arima_order", "seasonal_order", "trend"]:
+        if model_state[setting] != arima_config[setting]:
+            return True
+    hours_since_full_fit = (
+        data.index[-1] - model_state["full_fit_timestamp"]
+    ) / pd.Timedelta(hours=1)
+    return hours_since_full_fit >= arima_config["full_refit_hours"]
+
+
+def fit_arima_warm(
+    data: pd.Series, model_state: Union[dict, None], full_refit: bool
+) -> Tuple[SARIMAXResultsWrapper, dict]:
+    """
+    Fit a SARIMAX statsmodels model to a time series,
+    starting from the parameters fitted in a previous run.
+
+    Parameters:
+        data: the time series on which to fit the model,
+            as a pandas Series indexed by timestamp.
+        model_state: the model state returned by this function
+            in the previous run, or None. Other entries of the state,
+            e.g. those of `order_search`, are kept.
+        full_refit: whether to fit the parameters from scratch,
+            see `needs_full_refit`. Otherwise, if the
+            `warm_start_maxiter` setting in config.ini is 0, the
+            stored parameters are used as they are, and the model
+            is only filtered through `data`. If it is greater than
+            0, the parameters are refitted for at most that many
+            iterations, starting from the stored ones.
+
+    Returns:
+        model_fit: the fitted model, which can now be
+            used for forecasting.
+        model_state: the model state to pass to the next run.
+    """
+    maxiter = arima_config["warm_start_maxiter"]
+    if full_refit:
+        model_fit = fit_arima(data)
+        model_state = dict(
+            model_state or {},
+            arima_order=arima_config["arima_order"],
+            seasonal_order=arima_config["seasonal_order"],
+            trend=arima_config["trend"],
+            full_fit_timestamp=data.index[-1],
+        )
+    elif maxiter > 0:
+        model_fit = fit_arima(data, start_params=model_state["params"], maxiter=maxiter)
+    else:
+        model_fit = build_arima(data).filter(model_state["params"])
+    model_state = dict(model_state, params=np.asarray(model_fit.params))
+    return model_fit, model_state
+
+
 def forecast_arima(
     model_fit: SARIMAXResultsWrapper, forecast_timestamp: pd.Timestamp
 ) -> Tuple[pd.Series, pd.DataFrame]:
@@ -144,8 +286,49 @@ def construct_cross_validator(
     return tscv
 
 
+def fold_metrics(cv_test: pd.Series, forecast: pd.Series) -> Tuple[float, float]:
+    """
+    Compute the model metrics of one cross-validation fold.
+
+    Arguments:
+        cv_test: the test sample of the fold, as a pandas Series.
+        forecast: the forecast of the test sample.
+    Returns:
+        rmse: the root-mean-squared-error of the forecast.
+        mape: the mean-absolute-percentage-error of the forecast.
+    """
+    rmse = mean_squared_error(cv_test.values, forecast.values, squared=False)
+    mape = mean_absolute_percentage_error(cv_test.values, forecast.values)
+    return rmse, mape
+
+
+def cross_validate_fold(
+    cv_train: pd.Series, cv_test: pd.Series, config_overrides: Union[dict, None] = None
+) -> Tuple[float, float]:
+    """
+    Fit a SARIMAX statsmodel model to the training sample of
+    one cross-validation fold, from scratch, and compute the
+    metrics of its forecast of the test sample.
+
+    Arguments:
+        cv_train: the training sample of the fold, as a pandas Series.
+        cv_test: the test sample of the fold, as a pandas Series.
+        config_overrides: optional settings to update `arima_config`
+            with first, so that a worker process uses the settings
+            of the calling process.
+    Returns:
+        rmse: the root-mean-squared-error of the forecast.
+        mape: the mean-absolute-percentage-error of the forecast.
+    """
+    if config_overrides is not None:
+        arima_config.update(config_overrides)
+    model_fit = fit_arima(cv_train)
+    forecast = model_fit.forecast(steps=len(cv_test))
+    return fold_metrics(cv_test, forecast)
+
+
 def cross_validate_arima(
-    data: pd.Series, tscv: TimeSeriesSplit, refit: bool = False
+    data: pd.Series, tscv: TimeSeriesSplit, refit: bool = False, num_workers: int = 1
 ) -> dict:
     """
     Cross-validate a SARIMAX statsmodel model.
@@ -161,6 +344,15 @@ def cross_validate_arima(
             validation folds (True) or not (False).
             The default is False, as this is faster for
             large datasets.
+        num_workers: number of processes in which to fit
+            the folds when `refit` is True. With more than
+            one, each fold is fitted from scratch and
+            independently of the others, in a pool of
+            processes, rather than starting from the fit of
+            the previous fold. 0 means one process per CPU.
+            The default is 1. Not used if `refit` is False,
+            as the folds then carry the fit of the first one
+            forward.
     Returns:
         metrics: a dict containing two model metrics:
             "RMSE": the cross-validated root-mean-squared-error.
@@ -171,6 +363,27 @@ def cross_validate_arima(
     metrics = dict.fromkeys(["RMSE", "MAPE"])
     rmse = []  # this will hold the RMSE at each fold
     mape = []  # this will hold the MAPE score at each fold
+    num_workers = get_num_workers(num_workers)
+    if refit and num_workers > 1:
+        # fit every fold independently, in a pool of processes
+        folds = [
+            (data.iloc[train_index], data.iloc[test_index])
+            for train_index, test_index in tscv.split(data)
+        ]
+        with spawn_executor(min(num_workers, len(folds))) as executor:
+            futures = [
+                executor.submit(
+                    cross_validate_fold, cv_train, cv_test, dict(arima_config)
+                )
+                for cv_train, cv_test in folds
+            ]
+            for future in futures:
+                rmse_fold, mape_fold = future.result()
+                rmse.append(rmse_fold)
+                mape.append(mape_fold)
+        metrics["RMSE"] = np.mean(rmse)
+        metrics["MAPE"] = np.mean(mape)
+        return metrics
     # loop through all folds
     for fold, (train_index, test_index) in enumerate(tscv.split(data)):
         cv_train, cv_test = (
@@ -192,12 +405,11 @@ def cross_validate_arima(
         forecast = model_fit.forecast(
             steps=len(test_index)
         )  # compute the forecast for the test sample of the current fold
-        rmse.append(
-            mean_squared_error(cv_test.values, forecast.values, squared=False)
-        )  # compute the RMSE for the current fold
-        mape.append(
-            mean_absolute_percentage_error(cv_test.values, forecast.values)
-        )  # compute the MAPE for the current fold
+        rmse_fold, mape_fold = fold_metrics(
+            cv_test, forecast
+        )  # compute the RMSE and MAPE for the current fold
+        rmse.append(rmse_fold)
+        mape.append(mape_fold)
         cv_test_old = deepcopy(cv_test)
 
     metrics["RMSE"] = np.mean(
@@ -210,7 +422,7 @@ def cross_validate_arima(
 
 
 def arima_pipeline(
-    data: pd.Series,
+    data: pd.Series, sensor_name: Union[str, None] = None
 ) -> Tuple[pd.Series, pd.DataFrame, Union[dict, None]]:
     """
     Run the ARIMA model pipeline, using the SARIMAX model provided
@@ -222,6 +434,14 @@ def arima_pipeline(
     Arguments:
         data: the time series on which to train the SARIMAX model,
             as a pandas Series indexed by timestamp.
+        sensor_name: optional name of the sensor that `data` comes
+            from. If given, and the `warm_start` setting in config.ini
+            is True, the model parameters are kept between runs for
+            the sensor, see `fit_arima_warm`, and cross-validation is
+            only performed when they are fitted from scratch. If the
+            `use_selected_order` setting is True, the model orders
+            selected for the sensor by `order_search` are used in
+            place of `arima_order` and `seasonal_order`.
     Returns:
         mean_forecast: a pandas Series, indexed by timestamp,
             containing the forecast mean. The number of hours to
@@ -240,6 +460,36 @@ def arima_pipeline(
             "The time series on which to train the ARIMA model must be indexed by timestamp."
         )
         raise ValueError
+    if sensor_name is None:
+        model_state = None
+    else:
+        model_state = load_model_state(sensor_name)
+    overrides = None
+    if (
+        arima_config["use_selected_order"]
+        and model_state is not None
+        and "selected_order" in model_state
+    ):
+        overrides = {
+            setting: model_state["selected_order"][setting]
+            for setting in ["arima_order", "seasonal_order"]
+        }
+        logger.info(
+            "Using the model orders selected for sensor {0}: {1} {2}".format(
+                sensor_name, overrides["arima_order"], overrides["seasonal_order"]
+            )
+        )
+    with arima_config_overrides(overrides):
+        return _arima_pipeline(data, sensor_name, model_state)
+
+
+def _arima_pipeline(
+    data: pd.Series, sensor_name: Union[str, None], model_state: Union[dict, None]
+) -> Tuple[pd.Series, pd.DataFrame, Union[dict, None]]:
+    """
+    The body of `arima_pipeline`, with `arima_config` set up for
+    the sensor, and its model state loaded.
+    """
     if arima_config["arima_order"] != (4, 1, 2):
         logger.warning(
             "The 'arima_order' setting in config.ini has been set to something different than (4, 1, 2)."
@@ -252,8 +502,14 @@ def arima_pipeline(
         logger.warning(
             "The 'hours_forecast' setting in config.ini has been set to something different than 48."
         )
+    # start from the model of the previous run for the sensor, if requested
+    warm_start = sensor_name is not None and arima_config["warm_start"]
+    if warm_start:
+        full_refit = needs_full_refit(data, model_state)
+    else:
+        full_refit = True
     # perform time series cross-validation if requested by the user
-    cross_validation = arima_config["perform_cv"]
+    cross_validation = arima_config["perform_cv"] and full_refit
     if cross_validation:
         refit = arima_config["cv_refit"]
         if refit:
@@ -265,7 +521,9 @@ def arima_pipeline(
         try:
             tscv = construct_cross_validator(data)
             try:
-                metrics = cross_validate_arima(data, tscv, refit=refit)
+                metrics = cross_validate_arima(
+                    data, tscv, refit=refit, num_workers=arima_config["cv_num_workers"]
+                )
             except:
                 logger.warning(
                     "Could not perform cross-validation. Continuing without ARIMA model testing."
@@ -285,8 +543,27 @@ def arima_pipeline(
     else:
         metrics = None
     # fit the model and compute the forecast
-    logger.info("Fitting the model...")
-    model_fit = fit_arima(data)
+    if warm_start and not full_refit:
+        logger.info("Fitting the model, starting from the previous run...")
+    else:
+        logger.info("Fitting the model...")
+    if warm_start:
+        model_fit, model_state = fit_arima_warm(data, model_state, full_refit)
+        # only store the entries of the state that the fit set, in case others,
+        # e.g. those of `order_search`, were saved while it ran. Failing to store
+        # them only means fitting from scratch next run
+        try:
+            update_model_state(
+                sensor_name, {key: model_state[key] for key in WARM_START_ENTRIES}
+            )
+        except Exception as e:
+            logger.warning(
+                "Could not save the model state of sensor {0}: {1!r}".format(
+                    sensor_name, e
+                )
+            )
+    else:
+        model_fit = fit_arima(data)
     logger.info("Done fitting the model.")
     forecast_timestamp = get_forecast_timestamp(data)
     logger.info("Computing forecast...")
@@ -74,25 +74,25 @@ def hourly_average_sensor(env_data, col_names, time_vector):
     hour_averages = dict.fromkeys(
         sensors_list
     )  # creates empty dict with specified keys (requested sensors)
-    keys = list(hour_averages.keys())
-    grouped = env_data.groupby("name")  # group by sensor name
-    for ii in range(len(hour_averages)):
-        sensor = grouped.get_group(keys[ii])
-        # group by column "timestamp_hour_plus_minus" and perform
-        # averaging on the requested columns
-        hour_averages[keys[ii]] = sensor.groupby(
-            "timestamp_hour_plus_minus", as_index=False
-        )[col_names].mean()
-        # rename the column to "timestamp"
-        hour_averages[keys[ii]].rename(
+    # group by sensor name and column "timestamp_hour_plus_minus" at once,
+    # and perform averaging on the requested columns
+    averages = (
+        env_data[env_data["name"].isin(sensors_list)]
+        .groupby(["name", "timestamp_hour_plus_minus"])[col_names]
+        .mean()
+    )
+    for sensor in hour_averages.keys():
+        # rename the column "timestamp_hour_plus_minus" to "timestamp"
+        sensor_averages = averages.xs(sensor, level="name").reset_index()
+        sensor_averages.rename(
             columns={"timestamp_hour_plus_minus": "timestamp"},
             inplace=True,
         )
         # perform a left merge with "time_vector" so that only
         # timestamps contained in "time_vector" are retained
-        hour_averages[keys[ii]] = pd.merge(
+        hour_averages[sensor] = pd.merge(
             time_vector,
-            hour_averages[keys[ii]],
+            sensor_averages,
             how="left",
         )
     return hour_averages
@@ -162,20 +162,18 @@ def clean_env_data(env_data: pd.DataFrame):
     # create a new column, named "timedelta_in_secs", that expresses
     # the time difference, in seconds, between a timestamp and
     # itself rounded to the hour
-    env_data["timedelta_in_secs"] = env_data["timestamp"].apply(
-        lambda x: abs((x - x.round(freq="H")).total_seconds())
+    timestamp_hour_round = env_data["timestamp"].dt.round(freq="H")
+    env_data["timedelta_in_secs"] = (
+        (env_data["timestamp"] - timestamp_hour_round).abs().dt.total_seconds()
     )
     # create a new column, named "timestamp_hour_plus_minus", where any
     # timestamp "mins_from_the_hour" (minutes) before or after the hour is given
-    # the timestamp of the rounded hour. Times outside this range are assigned None.
-    env_data["timestamp_hour_plus_minus"] = env_data.apply(
-        lambda x: x["timestamp"].round(freq="H")
-        if x["timedelta_in_secs"]
+    # the timestamp of the rounded hour. Times outside this range are assigned NaT.
+    env_data["timestamp_hour_plus_minus"] = timestamp_hour_round.where(
+        env_data["timedelta_in_secs"]
         <= processing_params["mins_from_the_hour"] * constants["secs_per_min"]
-        else None,
-        axis=1,
     )
-    # remove row entries that have been assigned None above
+    # remove row entries that have been assigned NaT above
     env_data = env_data.dropna(subset="timestamp_hour_plus_minus")
     # create the time vector for which hourly-averaged data will be returned
     # first, parse the `time_delta` parameter of `config.ini` into total seconds.
@@ -0,0 +1,101 @@
+"""
+Store the state of the ARIMA model of each sensor between runs of the pipeline.
+
+The state of a sensor is a dict, pickled to a file named after the sensor in the
+`model_dir` directory of the [paths] section of config.ini. It holds what a run needs
+to start from the previous one, such as the fitted SARIMAX parameters.
+"""
+import logging
+import os
+import pickle
+import re
+from pathlib import Path
+from typing import Union
+
+from .config import config
+
+logger = logging.getLogger(__name__)
+
+paths_config = config(section="paths")
+
+# the directory of config.ini, which a relative `model_dir` is relative to
+CONFIG_DIR = Path(os.path.dirname(os.path.realpath(__file__))) / ".."
+
+
+def get_state_path(sensor_name: str) -> Path:
+    """
+    Return the path of the file holding the model state of a sensor.
+
+    Parameters:
+        sensor_name: name of the sensor. Characters that are not
+            allowed in file names, e.g. "/", are replaced by "_".
+
+    Returns:
+        state_path: path of the pickle file in `model_dir`. If
+            `model_dir` is a relative path, it is relative to the
+            directory of config.ini, not to the working directory.
+    """
+    file_name = re.sub(r"[^A-Za-z0-9_.-]", "_", sensor_name) + ".pkl"
+    return CONFIG_DIR / paths_config["model_dir"] / file_name
+
+
+def load_model_state(sensor_name: str) -> Union[dict, None]:
+    """
+    Load the model state of a sensor.
+
+    Parameters:
+        sensor_name: name of the sensor.
+
+    Returns:
+        state: the dict saved by `save_model_state` for the sensor,
+            or None if there is none or it cannot be read.
+    """
+    state_path = get_state_path(sensor_name)
+    if not state_path.is_file():
+        return None
+    try:
+        with open(state_path, "rb") as handle:
+            return pickle.load(handle)
+    except Exception:
+        logger.warning(
+            "Could not read the model state of sensor {0} from {1}.".format(
+                sensor_name, state_path
+            )
+        )
+        return None
+
+
+def save_model_state(sensor_name: str, state: dict) -> None:
+    """
+    Save the model state of a sensor, replacing any previous one.
+
+    The state is written to a temporary file first, so that a run
+    interrupted while writing does not leave a corrupted state behind.
+
+    Parameters:
+        sensor_name: name of the sensor.
+        state: the model state, a dict that can be pickled.
+    """
+    state_path = get_state_path(sensor_name)
+    os.makedirs(state_path.parent, exist_ok=True)
+    temp_path = state_path.with_suffix(".tmp")
+    with open(temp_path, "wb") as handle:
+        pickle.dump(state, handle, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, state_path)
+
+
+def update_model_state(sensor_name: str, entries: dict) -> None:
+    """
+    Update some entries of the model state of a sensor, keeping the others.
+
+    The state is read again just before it is saved, so that entries saved
+    by another process since, e.g. by `order_search` while `arima_pipeline`
+    runs, are not overwritten with the values read at the start of the run.
+
+    Parameters:
+        sensor_name: name of the sensor.
+        entries: the entries of the model state to set.
+    """
+    state = load_model_state(sensor_name) or {}
+    state.update(entries)
+    save_model_state(sensor_name, state)
@@ -0,0 +1,273 @@
+"""
+Search for the (p, d, q) and (P, D, Q, s) orders of the SARIMAX model of a sensor.
+
+Candidate orders are compared by the Akaike information criterion of their fit, or
+by their cross-validated metrics, and evaluated in a pool of worker processes. The
+score of every candidate is memoised in the model state of the sensor (see
+`model_store`) together with the data window it was computed on, so that searching
+the same window again, e.g. with a different method, only evaluates new candidates.
+The winning orders are stored in the model state as well, for `arima_pipeline` to
+use in place of the `arima_order` and `seasonal_order` settings of config.ini.
+"""
+import hashlib
+import itertools
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from .config import config
+from . import arima_pipeline
+from .model_store import load_model_state, update_model_state
+from .process_pool import get_num_workers, spawn_executor
+
+logger = logging.getLogger(__name__)
+
+search_config = config(section="order_search")
+
+# A candidate: ((p, d, q), (P, D, Q, s)).
+Orders = Tuple[Tuple[int, int, int], Tuple[int, int, int, int]]
+
+
+def get_data_window(data: pd.Series) -> Tuple[str, str, str]:
+    """
+    Identify the data window on which candidate orders are evaluated.
+
+    Parameters:
+        data: the time series, as a pandas Series indexed by timestamp.
+
+    Returns:
+        window: the first and last timestamps of `data`, and a digest
+            of its timestamps and values, so that windows with the same
+            ends but revised data differ.
+    """
+    digest = hashlib.sha1(
+        pd.util.hash_pandas_object(data, index=True).values.tobytes()
+    ).hexdigest()
+    return (str(data.index[0]), str(data.index[-1]), digest)
+
+
+def grid_candidates() -> List[Orders]:
+    """
+    Return every combination of the candidate orders
+    of the [order_search] section of config.ini.
+    """
+    s = search_config["seasonal_period"]
+    return [
+        ((p, d, q), (P, D, Q, s))
+        for p, d, q, P, D, Q in itertools.product(
+            search_config["p_values"],
+            search_config["d_values"],
+            search_config["q_values"],
+            search_config["seasonal_p_values"],
+            search_config["seasonal_d_values"],
+            search_config["seasonal_q_values"],
+        )
+    ]
+
+
+def stepwise_neighbours(orders: Orders) -> List[Orders]:
+    """
+    Return the orders that differ from `orders` in one of
+    p, d, q, P, D or Q, which takes the next smaller or next
+    larger of its candidate values in config.ini.
+    """
+    values = [
+        search_config["p_values"],
+        search_config["d_values"],
+        search_config["q_values"],
+        search_config["seasonal_p_values"],
+        search_config["seasonal_d_values"],
+        search_config["seasonal_q_values"],
+    ]
+    current = list(orders[0]) + list(orders[1][:3])
+    neighbours = []
+    for k, candidates in enumerate(values):
+        smaller = [v for v in candidates if v < current[k]]
+        larger = [v for v in candidates if v > current[k]]
+        for value in ([max(smaller)] if smaller else []) + (
+            [min(larger)] if larger else []
+        ):
+            new = list(current)
+            new[k] = value
+            neighbours.append(
+                (tuple(new[:3]), tuple(new[3:]) + (search_config["seasonal_period"],))
+            )
+    return neighbours
+
+
+def evaluate_orders(
+    data: pd.Series, orders: Orders, criterion: str, arima_config: dict
+) -> float:
+    """
+    Score a candidate by fitting the SARIMAX model with its orders.
+
+    Parameters:
+        data: the time series, as a pandas Series indexed by timestamp.
+        orders: the candidate ((p, d, q), (P, D, Q, s)).
+        criterion: "aic", "rmse" or "mape", see config.ini.
+        arima_config: the [arima] settings of the calling process,
+            which may differ from config.ini in a spawned worker.
+
+    Returns:
+        score: the value of the criterion, lower is better. It is
+            infinite if the model cannot be fitted.
+    """
+    arima_pipeline.arima_config.update(arima_config)
+    overrides = {"arima_order": orders[0], "seasonal_order": orders[1]}
+    try:
+        with arima_pipeline.arima_config_overrides(overrides):
+            if criterion == "aic":
+                return float(arima_pipeline.fit_arima(data).aic)
+            tscv = arima_pipeline.construct_cross_validator(data)
+            metrics = arima_pipeline.cross_validate_arima(
+                data, tscv, refit=arima_config["cv_refit"]
+            )
+            return float(metrics[criterion.upper()])
+    except Exception as e:
+        logger.warning("Could not evaluate orders {0}: {1!r}".format(orders, e))
+        return np.inf
+
+
+def _evaluate_all(
+    data: pd.Series,
+    candidates: List[Orders],
+    criterion: str,
+    scores: Dict[Orders, float],
+    executor: Union[ProcessPoolExecutor, None],
+) -> None:
+    """
+    Add the scores of the candidates that are not in `scores` yet to it.
+    """
+    new = [orders for orders in dict.fromkeys(candidates) if orders not in scores]
+    if not new:
+        return
+    logger.info("Evaluating {0} candidate orders...".format(len(new)))
+    arima_config = dict(arima_pipeline.arima_config)
+    if executor is None:
+        for orders in new:
+            scores[orders] = evaluate_orders(data, orders, criterion, arima_config)
+        return
+    futures = {
+        orders: executor.submit(evaluate_orders, data, orders, criterion, arima_config)
+        for orders in new
+    }
+    for orders, future in futures.items():
+        scores[orders] = future.result()
+
+
+def search_orders(
+    data: pd.Series,
+    sensor_name: str,
+    method: Union[str, None] = None,
+    criterion: Union[str, None] = None,
+    num_workers: Union[int, None] = None,
+) -> Tuple[Orders, float]:
+    """
+    Search for the best orders of the SARIMAX model of a sensor,
+    and store them in its model state for `arima_pipeline` to use.
+
+    Parameters:
+        data: the time series on which to evaluate the orders,
+            as a pandas Series indexed by timestamp.
+        sensor_name: name of the sensor that `data` comes from.
+        method: "grid" or "stepwise". The default is the `method`
+            setting of the [order_search] section of config.ini.
+        criterion: "aic", "rmse" or "mape". The default is the
+            `criterion` setting.
+        num_workers: number of processes in which to evaluate
+            candidates. 0 means one per CPU, and with 1 they are
+            evaluated in the calling process. The default is the
+            `num_workers` setting.
+
+    Returns:
+        best_orders: the winning ((p, d, q), (P, D, Q, s)).
+        best_score: its value of the criterion.
+    """
+    method = method or search_config["method"]
+    criterion = (criterion or search_config["criterion"]).lower()
+    if method not in ["grid", "stepwise"]:
+        logger.error("The order search method must be 'grid' or 'stepwise'.")
+        raise ValueError
+    if criterion not in ["aic", "rmse", "mape"]:
+        logger.error("The order search criterion must be 'aic', 'rmse' or 'mape'.")
+        raise ValueError
+    if num_workers is None:
+        num_workers = search_config["num_workers"]
+    num_workers = get_num_workers(num_workers)
+
+    # the scores memoised for this sensor, data window and criterion
+    model_state = load_model_state(sensor_name) or {}
+    window = get_data_window(data)
+    cache = model_state.get("order_search")
+    if cache is None or cache["window"] != window:
+        cache = {"window": window, "scores": {}}
+    scores = cache["scores"].setdefault(criterion, {})
+    num_cached = len(scores)
+
+    if "selected_order" in model_state:
+        start = (
+            model_state["selected_order"]["arima_order"],
+            model_state["selected_order"]["seasonal_order"],
+        )
+    else:
+        start = (
+            arima_pipeline.arima_config["arima_order"],
+            arima_pipeline.arima_config["seasonal_order"],
+        )
+
+    executor = None
+    if num_workers > 1:
+        executor = spawn_executor(num_workers)
+    try:
+        if method == "grid":
+            _evaluate_all(data, grid_candidates(), criterion, scores, executor)
+            best = min(scores, key=scores.get)
+        else:
+            best = start
+            _evaluate_all(data, [start], criterion, scores, executor)
+            for _ in range(search_config["max_steps"]):
+                neighbours = stepwise_neighbours(best)
+                _evaluate_all(data, neighbours, criterion, scores, executor)
+                best_neighbour = min(neighbours, key=scores.get, default=best)
+                if scores[best_neighbour] >= scores[best]:
+                    break
+                best = best_neighbour
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    logger.info(
+        "Evaluated {0} candidate orders for sensor {1}, {2} of them memoised.".format(
+            len(scores), sensor_name, num_cached
+        )
+    )
+    if not np.isfinite(scores[best]):
+        logger.error(
+            "None of the candidate orders could be fitted for sensor {0}.".format(
+                sensor_name
+            )
+        )
+        raise Exception
+
+    # store the winning orders and the memoised scores, keeping the rest of the
+    # model state, which may have changed while the search ran
+    update_model_state(
+        sensor_name,
+        {
+            "selected_order": {
+                "arima_order": best[0],
+                "seasonal_order": best[1],
+                "criterion": criterion,
+                "score": scores[best],
+            },
+            "order_search": cache,
+        },
+    )
+    logger.info(
+        "Selected orders {0} {1} for sensor {2}, with {3} {4:.3f}.".format(
+            best[0], best[1], sensor_name, criterion, scores[best]
+        )
+    )
+    return best, scores[best]
@@ -0,0 +1,42 @@
+"""
+Pools of worker processes in which to run parts of the ARIMA model in parallel.
+
+The worker processes are started with "spawn" rather than forked, so that they start
+from a clean interpreter rather than a copy of the calling process, which may hold
+open database connections or locks of other threads.
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Union
+
+from .config import config
+
+parallel_config = config(section="parallel")
+
+
+def get_num_workers(num_workers: Union[int, None] = None) -> int:
+    """
+    The number of worker processes to use.
+
+    Arguments:
+        num_workers: int or None. If None, it is read from the `num_workers`
+            parameter of the [parallel] section of config.ini. 0 means one
+            worker per CPU.
+    Returns:
+        num_workers: int, at least 1
+    """
+    if num_workers is None:
+        num_workers = int(parallel_config["num_workers"])
+    if num_workers <= 0:
+        num_workers = os.cpu_count() or 1
+    return num_workers
+
+
+def spawn_executor(num_workers: int) -> ProcessPoolExecutor:
+    """
+    Return a pool of `num_workers` spawned worker processes.
+    """
+    return ProcessPoolExecutor(
+        max_workers=num_workers, mp_context=multiprocessing.get_context("spawn")
+    )
@@ -0,0 +1,88 @@
+"""
+Run the ARIMA pipeline for several sensors in parallel.
+
+Each sensor's time series is fitted and forecast independently, in a pool of worker
+processes. Only the results come back to the calling process, so that database
+writes stay there. A sensor whose pipeline fails is reported with its exception
+rather than stopping the others.
+"""
+import logging
+from typing import Dict, Tuple, Union
+
+import pandas as pd
+
+from . import arima_pipeline, model_store
+from .process_pool import get_num_workers, spawn_executor
+
+logger = logging.getLogger(__name__)
+
+
+def _run_sensor(
+    sensor: str, data: pd.Series, arima_config: dict, paths_config: dict
+) -> Tuple[pd.Series, pd.DataFrame, Union[dict, None]]:
+    """
+    Run the ARIMA pipeline for one sensor, with the ARIMA settings and model
+    directory of the calling process, which may differ from config.ini in a spawned
+    worker.
+    """
+    arima_pipeline.arima_config.update(arima_config)
+    model_store.paths_config.update(paths_config)
+    return arima_pipeline.arima_pipeline(data, sensor_name=sensor)
+
+
+def run_sensors(
+    sensor_data: Dict[str, pd.Series], num_workers: Union[int, None] = None
+) -> Dict[str, Union[Tuple[pd.Series, pd.DataFrame, Union[dict, None]], Exception]]:
+    """
+    Run the ARIMA pipeline for every sensor, in a pool of processes.
+
+    Arguments:
+        sensor_data: dict with sensor names as keys and the time series on which to
+            train the SARIMAX model of each sensor, as pandas Series indexed by
+            timestamp, as values.
+        num_workers: number of processes, see `get_num_workers`. With 1, the
+            sensors are run one after another in the calling process.
+    Returns:
+        results: dict with the same keys as `sensor_data`. The values are the
+            (mean_forecast, conf_int, metrics) returned by `arima_pipeline` for
+            the sensor, or the exception raised by it if it failed.
+    """
+    results = dict.fromkeys(sensor_data)
+    num_workers = min(get_num_workers(num_workers), max(len(sensor_data), 1))
+    if num_workers <= 1:
+        for sensor, data in sensor_data.items():
+            logger.info("Running the ARIMA pipeline for sensor {0}...".format(sensor))
+            try:
+                results[sensor] = arima_pipeline.arima_pipeline(
+                    data, sensor_name=sensor
+                )
+            except Exception as e:
+                logger.exception(
+                    "The ARIMA pipeline failed for sensor {0}.".format(sensor)
+                )
+                results[sensor] = e
+        return results
+
+    logger.info(
+        "Running the ARIMA pipeline for {0} sensors in {1} worker processes...".format(
+            len(sensor_data), num_workers
+        )
+    )
+    arima_config = dict(arima_pipeline.arima_config)
+    paths_config = dict(model_store.paths_config)
+    with spawn_executor(num_workers) as executor:
+        futures = {
+            sensor: executor.submit(
+                _run_sensor, sensor, data, arima_config, paths_config
+            )
+            for sensor, data in sensor_data.items()
+        }
+        for sensor, future in futures.items():
+            try:
+                results[sensor] = future.result()
+            except Exception as e:
+                logger.error(
+                    "The ARIMA pipeline failed for sensor {0}: {1!r}".format(sensor, e)
+                )
+                results[sensor] = e
+    return results
@@ -0,0 +1,47 @@
+from cropcore.model_data_access import get_training_data
+from arima.clean_data import clean_data
+from arima.prepare_data import prepare_data
+from arima.order_search import search_orders
+from arima.config import config
+import logging, coloredlogs
+import sys
+
+
+def run_order_search() -> None:
+    """
+    Select the SARIMAX model orders of every sensor, for run_pipeline to use.
+    Meant to be run periodically, e.g. weekly, rather than for every forecast.
+    """
+    # set up logging
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+    field_styles = coloredlogs.DEFAULT_FIELD_STYLES
+    coloredlogs.ColoredFormatter(field_styles=field_styles)
+    coloredlogs.install(level="INFO")
+
+    # fetch training data from the database
+    env_data, energy_data = get_training_data(num_rows=40000, arima_config=config)
+
+    # clean the training data
+    env_data, energy_data = clean_data(env_data, energy_data)
+
+    # prepare the clean data for the ARIMA model
+    env_data, energy_data = prepare_data(env_data, energy_data)
+
+    # search the orders of every sensor, evaluating the candidates in parallel
+    failed_sensors = []
+    for sensor in env_data.keys():
+        try:
+            search_orders(env_data[sensor]["temperature"], sensor)
+        except Exception:
+            logging.exception(f"The order search failed for sensor {sensor}.")
+            failed_sensors.append(sensor)
+    if failed_sensors:
+        raise RuntimeError(f"The order search failed for sensors {failed_sensors}")
+
+
+def main() -> None:
+    run_order_search()
+
+
+if __name__ == "__main__":
+    main()
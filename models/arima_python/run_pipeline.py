@@ -7,7 +7,7 @@ from cropcore.model_data_access import (
 )
 from arima.clean_data import clean_data
 from arima.prepare_data import prepare_data
-from arima.arima_pipeline import arima_pipeline
+from arima.sensor_executor import run_sensors
 from arima.arima_utils import (
     get_model_id,
     get_measure_id,
@@ -40,6 +40,14 @@ def run_pipeline() -> None:
     # note that in this implementation, energy data is not used at all
     sensor_names = list(env_data.keys())
 
+    # fit and forecast every sensor, in parallel worker processes
+    results = run_sensors(
+        {sensor: env_data[sensor]["temperature"] for sensor in sensor_names}
+    )
+    failed_sensors = [
+        sensor for sensor, result in results.items() if isinstance(result, Exception)
+    ]
+
     session = get_sqlalchemy_session()
     model_id = get_model_id(session=session)
 
@@ -55,12 +63,13 @@ def run_pipeline() -> None:
         "Upper Bound Temperature (Degree Celcius)",
     ]
     session.commit()
-    # loop through every sensor
+    # write the forecasts of every sensor to the database
     for sensor in sensor_names:
+        if isinstance(results[sensor], Exception):
+            continue
+        mean_forecast, conf_int, metrics = results[sensor]
         session.begin()
         sensor_id = get_sensor_id(sensor_name=sensor, session=session)
-        temperature = env_data[sensor]["temperature"]
-        mean_forecast, conf_int, metrics = arima_pipeline(temperature)
         try:
             run_id = insert_model_run(
                 sensor_id=sensor_id,
@@ -82,10 +91,15 @@ def run_pipeline() -> None:
                 insert_model_predictions(predictions=result, session=session)
                 session.commit()
                 session.close()
-        except:
+        except Exception:
             session.rollback()
             session.close()
-            raise
+            logging.exception(
+                f"Could not write the forecasts of sensor {sensor} to the database."
+            )
+            failed_sensors.append(sensor)
+    if failed_sensors:
+        raise RuntimeError(f"The ARIMA pipeline failed for sensors {failed_sensors}")
 
 
 def main() -> None:
@@ -5,7 +5,13 @@ Created on Mon Jun 14 09:32:23 2021
 @author: rmw61
 """
 import os
-from ges.functionsV2 import derivatives, priorPPF, sat_conc
+from ges.climate import ClimateSeries
+from ges.functionsV2 import (
+    IncrementalSimulation,
+    derivatives,
+    priorPPF,
+    sat_conc,
+)
 from cropcore.model_data_access import (
     get_days_weather,
     get_days_weather_forecast,
@@ -164,7 +170,12 @@ def main():
     # initialize calibration class
     sigmaY = float(cal_conf["sigma_y"])  # std measurement error GASP lambda_e
     nugget = float(cal_conf["nugget"])  # same as mean GASP parameter 1/lambda_en
-    cal = calibration.calibrate(priorPPF, sigmaY, nugget)
+    cal = calibration.calibrate(
+        priorPPF,
+        sigmaY,
+        nugget,
+        batched=cal_conf["batched_likelihood"].lower() in ("true", "yes", "1"),
+    )
 
     ### Time period for calibration
     # To be run every 12 hours ideally 3am, 3pm but for now every 12 hours from
@@ -180,6 +191,23 @@ def main():
 
     seq = np.linspace(p1, p2, ndp)
 
+    # Interpolate the weather once, for all the windows of the data points.
+    WeatherSeries = ClimateSeries.from_dataframe(Weather)
+
+    Parameters = np.genfromtxt(
+        cal_conf["ach_ias_pairs"].split(";"), delimiter=","
+    )  # ACH,IAS pairs
+    NP = np.shape(Parameters)[0]
+
+    incremental = cal_conf["incremental"].lower() in ("true", "yes", "1")
+    if incremental:
+        simulation = IncrementalSimulation(
+            Parameters,
+            WeatherSeries,
+            LatestTimeHourValue,
+            respin_steps=int(cal_conf["respin_steps"]),
+        )
+
     # Step through each data point
 
     LastDataPoint = pd.DataFrame()
@@ -192,17 +220,15 @@ def main():
         # TODO Why the -1?
         h1 = int(seq[ii] - (calibration_window_days * 24 - 1))
 
-        Parameters = np.genfromtxt(
-            cal_conf["ach_ias_pairs"].split(";"), delimiter=","
-        )  # ACH,IAS pairs
-        NP = np.shape(Parameters)[0]
-
         start = time.time()
         logging.info(f"Running model ... useDataBase is {useDataBase}")
 
-        if useDataBase:
+        if useDataBase and incremental:
+            # runs GES model over ACH,IAS pairs, continuing from the last data point
+            results = simulation.run(h1, h2)
+        elif useDataBase:
             results = derivatives(
-                h1, h2, Parameters, Weather, LatestTimeHourValue
+                h1, h2, Parameters, WeatherSeries, LatestTimeHourValue
             )  # runs GES model over ACH,IAS pairs
         else:
             results = derivatives(
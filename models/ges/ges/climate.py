@@ -0,0 +1,183 @@
+"""
+External weather for the GES model, interpolated to the time step deltaT of the model.
+
+A ClimateSeries loads an hourly weather series, from a csv file, a DataFrame, or the
+database, and interpolates the whole of it once. The climate arrays for windows of
+hours [h1, h2] are then views into the interpolated series, so running the model over
+many overlapping windows, as the calibration does, costs no further interpolation.
+
+Series loaded from files are memoised on the path and modification time of the file,
+see load_climate_series, and scenario_climate memoises the combined historical and
+forecast climate on the sources and the window.
+"""
+import functools
+import os
+
+import numpy as np
+import pandas as pd
+
+from cropcore.model_data_access import get_days_weather, get_days_weather_forecast
+from .parameters import deltaT
+
+# Columns of the weather csv files, which have no header.
+WEATHER_COLUMNS = ["DateTime", "T_e", "RH_e"]
+WEATHER_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+SECONDS_IN_HOUR = 3600
+SAMPLES_IN_HOUR = int(SECONDS_IN_HOUR / deltaT)
+
+
+def _fill_nans(values):
+    """values with NaNs replaced by linear interpolation between the other values."""
+    values = np.array(values, dtype=np.float64)
+    nans = np.isnan(values)
+    if nans.any() and not nans.all():
+        index = np.arange(len(values))
+        values[nans] = np.interp(index[nans], index[~nans], values[~nans])
+    return values
+
+
+class ClimateSeries:
+    """
+    An hourly weather series, and its linear interpolation at every deltaT seconds.
+
+    As in the model so far, the rows of the series are taken to be consecutive hours,
+    and the timestamps of the samples are interpolated between those of the rows.
+
+    Attributes:
+        timestamps: numpy datetime64 array, the times of the interpolated samples
+        climate: numpy array of shape (len(timestamps), 2), with the external
+            temperature in Celsius and relative humidity in percent, read-only
+    """
+
+    def __init__(self, timestamps, temperature, relative_humidity):
+        """
+        Arguments:
+            timestamps: the times of the hourly readings, anything pd.to_datetime
+                accepts. Time zones are dropped, keeping the local time.
+            temperature: array of external temperatures, may contain NaNs
+            relative_humidity: array of external relative humidities, may contain NaNs
+        """
+        timestamps = pd.to_datetime(pd.Series(timestamps))
+        if timestamps.dt.tz is not None:
+            timestamps = timestamps.dt.tz_localize(None)
+        timestamps = timestamps.to_numpy(dtype="datetime64[us]").astype(np.int64)
+        hours = np.arange(len(timestamps), dtype=np.float64)
+        sample_hours = np.arange((len(timestamps) - 1) * SAMPLES_IN_HOUR + 1) / (
+            SAMPLES_IN_HOUR
+        )
+
+        self.timestamps = (
+            np.interp(sample_hours, hours, timestamps.astype(np.float64))
+            .round()
+            .astype("datetime64[us]")
+        )
+        self.climate = np.column_stack(
+            (
+                np.interp(sample_hours, hours, _fill_nans(temperature)),
+                np.interp(sample_hours, hours, _fill_nans(relative_humidity)),
+            )
+        )
+        self.climate.flags.writeable = False
+
+    @classmethod
+    def from_dataframe(cls, weather):
+        """A ClimateSeries from a DataFrame with columns DateTime, T_e and RH_e."""
+        return cls(weather["DateTime"], weather["T_e"], weather["RH_e"])
+
+    @classmethod
+    def from_csv(cls, filepath):
+        """A ClimateSeries from a csv file of DateTime, T_e and RH_e, with no header."""
+        weather = pd.read_csv(filepath, delimiter=",", names=WEATHER_COLUMNS)
+        weather["DateTime"] = pd.to_datetime(
+            weather["DateTime"], format=WEATHER_TIMESTAMP_FORMAT
+        )
+        return cls.from_dataframe(weather)
+
+    def window(self, h1, h2):
+        """
+        The climate from hour h1 to hour h2 after the start of the series, inclusive,
+        as a view of self.climate. The readings stay an hour apart whatever the length
+        of the window.
+        """
+        return self.climate[h1 * SAMPLES_IN_HOUR : h2 * SAMPLES_IN_HOUR + 1]
+
+    def last_hours(self, num_hours):
+        """
+        The climate over the last num_hours hours of the series, as a view of
+        self.climate, together with its timestamps.
+        """
+        start = len(self.climate) - num_hours * SAMPLES_IN_HOUR - 1
+        return self.climate[start:], self.timestamps[start:]
+
+
+@functools.lru_cache(maxsize=16)
+def _load_csv(filepath, mtime):
+    return ClimateSeries.from_csv(filepath)
+
+
+def load_climate_series(filepath=None, num_days=None, forecast=False):
+    """
+    Load the weather, or the weather forecast, as a ClimateSeries.
+
+    Arguments:
+        filepath: path of a csv file of weather data. If None, the data is read from
+            the database, and not memoised, as it may change between calls.
+        num_days: int, number of days of weather to get from the database
+        forecast: bool, whether to get the weather forecast from the database
+    Returns:
+        climate_series: ClimateSeries
+    """
+    if filepath:
+        filepath = os.path.abspath(filepath)
+        return _load_csv(filepath, os.path.getmtime(filepath))
+    if forecast:
+        weather = get_days_weather_forecast(num_days)
+    else:
+        weather = get_days_weather(num_days, numRows=num_days * 24)
+    return ClimateSeries.from_dataframe(pd.DataFrame(weather, columns=WEATHER_COLUMNS))
+
+
+def _combine(weather_series, forecast_series, num_hours):
+    """The last num_hours hours of weather_series followed by the forecast."""
+    historical, historical_timestamps = weather_series.last_hours(num_hours)
+    # Where the historical weather and the forecast overlap, keep the historical.
+    is_new = ~np.isin(forecast_series.timestamps, historical_timestamps)
+    return np.concatenate((historical, forecast_series.climate[is_new]))
+
+
+@functools.lru_cache(maxsize=16)
+def _scenario_climate(weather_key, forecast_key, num_hours):
+    climate = _combine(_load_csv(*weather_key), _load_csv(*forecast_key), num_hours)
+    climate.flags.writeable = False
+    return climate
+
+
+def scenario_climate(h1, h2, num_days, filepath_weather=None, filepath_forecast=None):
+    """
+    The climate for a scenario run: the last h2 - h1 hours of the historical weather,
+    followed by the weather forecast for the next two days.
+
+    Arguments:
+        h1, h2: int, the hours of the historical weather to use
+        num_days: int, number of days of weather to get from the database, if
+            filepath_weather is None
+        filepath_weather: path of the csv file of historical weather, or None
+        filepath_forecast: path of the csv file of the weather forecast, or None
+    Returns:
+        climate: numpy array of shape (number of samples, 2), with the external
+            temperature and relative humidity every deltaT seconds. It is read-only
+            if both sources are files, as it is then shared between calls.
+    """
+    num_hours = h2 - h1
+    if filepath_weather and filepath_forecast:
+        keys = []
+        for filepath in (filepath_weather, filepath_forecast):
+            filepath = os.path.abspath(filepath)
+            keys.append((filepath, os.path.getmtime(filepath)))
+        return _scenario_climate(*keys, num_hours)
+    return _combine(
+        load_climate_series(filepath_weather, num_days=num_days + 1),
+        load_climate_series(filepath_forecast, num_days=2, forecast=True),
+        num_hours,
+    )
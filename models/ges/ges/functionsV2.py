@@ -26,7 +26,9 @@ from pathlib import Path
 
 from inversion import *
 from cropcore.model_data_access import get_days_weather
+from .climate import ClimateSeries
 from .config import config
+from .scenario_executor import solve_scenarios
 
 path_conf = config(section="paths")
 cal_conf = config(section="calibration")
@@ -34,50 +36,6 @@ cal_conf = config(section="calibration")
 lighting_factor = float(cal_conf["lighting_factor"])
 
 
-def climterp_linear(h1, h2, ExternalWeather):
-    temp_in = None
-    rh_in = None
-    # if (filepath_weather):
-    #    ExternalWeather = np.genfromtxt(filepath_weather, delimiter=',')
-    #    temp_in = ExternalWeather[h1:h2+1,1] # +1 to ensure correct end point
-    #    rh_in = ExternalWeather[h1:h2+1,2] # +1 to ensure correct end point
-    # else:
-    #    ExternalWeather = np.asarray(get_days_weather(numDays, numRows=numDays*24))
-    #    temp_in = ExternalWeather[h1:h2+1,1].astype(np.float64) # +1 to ensure correct end point
-    #    rh_in = ExternalWeather[h1:h2+1,2].astype(np.float64) # +1 to ensure correct end point
-
-    temp_in = (
-        ExternalWeather.T_e[h1 : h2 + 1]
-    ).to_numpy()  # +1 to ensure correct end point
-    rh_in = (
-        ExternalWeather.RH_e[h1 : h2 + 1]
-    ).to_numpy()  # +1 to ensure correct end point
-
-    # # remove nans
-    nans, x = nan_helper(temp_in)
-    temp_in[nans] = np.interp(x(nans), x(~nans), temp_in[~nans])
-
-    nans, x = nan_helper(rh_in)
-    rh_in[nans] = np.interp(x(nans), x(~nans), rh_in[~nans])
-
-    t = np.linspace(0, 864000 - 3600, (h2 - h1 + 1))  # 864000 = 240 hours i.e. 10 days
-    deltaT = 600  # 10 minutes
-    mult = np.linspace(0, 864000, int(1 + 864000 / deltaT))
-    # logging.info("t: {0}, mult:{1}, input:{2}".format(t.shape,mult.shape,temp_in.shape))
-
-    # ind = h2-h1+1
-
-    # clim_t = np.interp(mult,t,temp_in[-ind:])
-    # clim_rh = np.interp(mult,t,rh_in[-ind:])
-    logging.info(f"Interpolating temperature {len(t)} {len(temp_in)}")
-    clim_t = np.interp(mult, t, temp_in)
-    clim_rh = np.interp(mult, t, rh_in)
-
-    climate = np.vstack((clim_t, clim_rh))
-
-    return climate
-
-
 def lamorturb(Gr, Re):
 
     Le = 0.819
@@ -163,7 +121,11 @@ def day(t):
     return day_new
 
 
-def model(t, z, climate, ACHvec, iasvec, daynum, h1, h2, LatestTimeHourValue):
+def model(t, z, climate, ACHvec, iasvec, h1, h2, LatestTimeHourValue):
+    """
+    The right-hand side of the GES model, with constant ACH and IAS. It only depends
+    on t and z, and not on the history of calls.
+    """
 
     T_c = z[0]
     T_i = z[1]
@@ -188,8 +150,6 @@ def model(t, z, climate, ACHvec, iasvec, daynum, h1, h2, LatestTimeHourValue):
     RH_e = climate[n, 1] / 100
     Cw_ext = RH_e * sat_conc(T_ext)
 
-    daynum.append(day(t))
-
     ## Set ACH,ias
     hour = np.floor(t / 3600)  # + 1?
 
@@ -390,20 +350,30 @@ def model(t, z, climate, ACHvec, iasvec, daynum, h1, h2, LatestTimeHourValue):
     )
 
 
-def derivatives(h1, h2, paramsinput, Weather, LatestTimeHourValue):
+def derivatives(
+    h1, h2, paramsinput, Weather, LatestTimeHourValue, num_workers=None, z0=None
+):
     """
     Parameters:
     ===========
     h1: int
     h2: int
-    Weather: pandas DataFrame
+    Weather: climate.ClimateSeries, or pandas DataFrame with columns DateTime, T_e and
+        RH_e. Pass a ClimateSeries when calling this repeatedly with the same weather,
+        so that it is only interpolated once.
+    num_workers: int, number of processes to run the ACH/IAS pairs in, see
+        scenario_executor.get_num_workers
+    z0: optional numpy array of shape (12, NP), the state of each ACH/IAS pair at h1.
+        If None, the runs start from fixed initial conditions.
     """
+    if not isinstance(Weather, ClimateSeries):
+        Weather = ClimateSeries.from_dataframe(Weather)
 
     logging.info(
-        f"In derivatives, NP: {np.shape(paramsinput)[0]} h1:{h1} h2:{h2} len(Weather):{len(Weather)}"
+        f"In derivatives, NP: {np.shape(paramsinput)[0]} h1:{h1} h2:{h2} len(Weather):{len(Weather.climate)}"
     )
     # Get weather data
-    climate = np.transpose(climterp_linear(h1, h2, Weather))
+    climate = Weather.window(h1, h2)
 
     # Get parameter values
 
@@ -411,8 +381,6 @@ def derivatives(h1, h2, paramsinput, Weather, LatestTimeHourValue):
 
     NOut = 2
 
-    results = np.zeros((12, NOut, NP))
-
     # Initial conditions
     T_i_0 = 295
     T_c_0 = 293
@@ -441,29 +409,108 @@ def derivatives(h1, h2, paramsinput, Weather, LatestTimeHourValue):
         T_c5_0,
         C_w_0,
     ]
-
-    daynum = [0]
-    # count = [0]
+    if z0 is not None:
+        z = z0
 
     t = [h1 * 3600, h2 * 3600]
     tval = np.linspace(h1 * 3600, h2 * 3600, NOut)
 
+    scenario_args = []
     for i in range(NP):
-        logging.info(
-            f"in derivatives, step {i + 1} LatestTimeHourValue is {LatestTimeHourValue} "
-        )
         AirChangeHour = paramsinput[i, 0]
         IntAirSpeed = paramsinput[i, 1]
         ACH = AirChangeHour / 3600
         ias = IntAirSpeed
-        params = [climate, ACH, ias, daynum, h1, h2, LatestTimeHourValue]
-        output = solve_ivp(
-            model, t, z, method="BDF", t_eval=tval, rtol=1e-5, args=params
-        )
-        results[:, :, i] = output.y
+        scenario_args.append((ACH, ias, h1, h2, LatestTimeHourValue))
+    solver_options = None
+    if z0 is not None:
+        # Near equilibrium the solver would probe for its first step far beyond the
+        # end of a short window, and of the climate array.
+        solver_options = {"first_step": deltaT}
+    results = solve_scenarios(
+        model,
+        climate,
+        t,
+        z,
+        tval,
+        scenario_args,
+        num_workers=num_workers,
+        solver_options=solver_options,
+    )
     return results
 
 
+class IncrementalSimulation:
+    """
+    Runs derivatives for a sequence of calibration windows that move forward in time,
+    continuing each ACH/IAS pair from its state at the end of the previous window.
+    Only the hours since the previous window are simulated, instead of the whole
+    window from fixed initial conditions.
+
+    Every respin_steps windows the whole window is simulated again from the fixed
+    initial conditions, so that the results cannot drift far from those of
+    derivatives. respin_steps = 0 never does this after the first window.
+    """
+
+    def __init__(
+        self,
+        paramsinput,
+        Weather,
+        LatestTimeHourValue,
+        respin_steps=0,
+        num_workers=None,
+    ):
+        if not isinstance(Weather, ClimateSeries):
+            Weather = ClimateSeries.from_dataframe(Weather)
+        self.paramsinput = paramsinput
+        self.Weather = Weather
+        self.LatestTimeHourValue = LatestTimeHourValue
+        self.respin_steps = respin_steps
+        self.num_workers = num_workers
+        # The state of each ACH/IAS pair at the end of each window, keyed by its h2.
+        self.checkpoints = {}
+        self._last_h2 = None
+        self._steps_since_spin_up = 0
+
+    def run(self, h1, h2):
+        """
+        Results for the window h1..h2, as returned by derivatives, except that when
+        the run continues from the previous window results[:, 0, :] is the state at
+        the end of the previous window, rather than at h1.
+        """
+        continue_run = (
+            self._last_h2 is not None
+            and h1 <= self._last_h2 < h2
+            and (
+                self.respin_steps <= 0 or self._steps_since_spin_up < self.respin_steps
+            )
+        )
+        if continue_run:
+            results = derivatives(
+                self._last_h2,
+                h2,
+                self.paramsinput,
+                self.Weather,
+                self.LatestTimeHourValue,
+                num_workers=self.num_workers,
+                z0=self.checkpoints[self._last_h2],
+            )
+            self._steps_since_spin_up += 1
+        else:
+            results = derivatives(
+                h1,
+                h2,
+                self.paramsinput,
+                self.Weather,
+                self.LatestTimeHourValue,
+                num_workers=self.num_workers,
+            )
+            self._steps_since_spin_up = 0
+        self.checkpoints[h2] = results[:, -1, :]
+        self._last_h2 = h2
+        return results
+
+
 def loadDistributions():
     # if (filePath_ACH and filePath_IAS and filePath_Length):
     #     df_ACH = pd.read_csv(filePath_ACH)
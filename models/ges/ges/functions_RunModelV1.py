@@ -179,14 +179,20 @@ def model(
     climate,
     ACHvec,
     iasvec,
-    daynum,
-    count,
+    slot_starts,
     h1,
     h2,
     ndh,
     lshift,
     LatestTimeHourValue,
 ):
+    """
+    The right-hand side of the GES model. It only depends on t and z, and not on the
+    history of calls, so that solver steps can be rejected and retried.
+
+    ACHvec and iasvec hold the parameters for each slot of the schedule, and
+    slot_starts the hours at which each slot after the first starts.
+    """
 
     T_c = z[0]
     T_i = z[1]
@@ -215,34 +221,13 @@ def model(
     RH_e = climate[n, 1] / 100
     Cw_ext = RH_e * sat_conc(T_ext)
 
-    daynum.append(day(t))
-    # if daynum[(len(daynum)-1)] > daynum[(len(daynum)-2)]:
-    #    logging.info(daynum[len(daynum)-1])
-
     ## Set ACH,ias
     hour = np.floor(t / 3600)
-    # logging.info(hour)
-    # logging.info(n)
-    # if hour == 480:
-    #    logging.info('debug here')
+    slot = np.searchsorted(slot_starts, hour, side="right")
 
-    delta_h = int(cal_conf["delta_h"])
-    calibration_hours = int(cal_conf["num_data_points"]) * delta_h
-    seq = range(h1 + calibration_hours, h2 + delta_h, delta_h)
-
-    if hour >= seq[count[-1]]:
-        count_new = count[-1] + 1
-        count.append(count_new)
-        # logging.info(n)
-        # logging.info(hour)
-        # logging.info(count[-1])
-        # logging.info(n)
-        # if count[-1] == 61:
-        #    logging.info('debug')
-
-    ACH = ACHvec[count[-1]]
-    ias = iasvec[count[-1]]
-    # ndh = ndhvec[count[-1]]
+    ACH = ACHvec[slot]
+    ias = iasvec[slot]
+    # ndh = ndhvec[slot]
     # lshift = 0
 
     ## Lights
@@ -463,6 +448,11 @@ def derivatives(h1, h2, paramsinput, ndp, Weather, LatestTimeHourValue):
 
     results = np.zeros((12, NOut, NP))
 
+    # The hours at which the ACH and IAS parameters change, after calibration.
+    delta_h = int(cal_conf["delta_h"])
+    calibration_hours = int(cal_conf["num_data_points"]) * delta_h
+    slot_starts = np.arange(h1 + calibration_hours, h2 + delta_h, delta_h)
+
     for i in range(NP):
         # tic = time.time()
 
@@ -503,9 +493,6 @@ def derivatives(h1, h2, paramsinput, ndp, Weather, LatestTimeHourValue):
             C_w_0,
         ]
 
-        daynum = [0]
-        count = [0]
-
         ACH = AirChangeHour / 3600
         ias = IntAirSpeed
 
@@ -516,8 +503,7 @@ def derivatives(h1, h2, paramsinput, ndp, Weather, LatestTimeHourValue):
             clim,
             ACH,
             ias,
-            daynum,
-            count,
+            slot_starts,
             h1,
             h2,
             ndh,
@@ -24,8 +24,9 @@ from .parameters import T_ss, T_al
 from .parameters import f_heat, f_light, P_al, P_ambient_al, P_dh
 from .parameters import c_v, msd_v, d_v, AF_g, LAI, dsat
 from scipy.integrate import solve_ivp
+from .climate import scenario_climate
 from .config import config
-from cropcore.model_data_access import get_days_weather, get_days_weather_forecast
+from .scenario_executor import solve_scenarios, solve_scenarios_batched
 
 # import will be different depending on where we run from
 try:
@@ -43,6 +44,7 @@ FILEPATH_IAS = DATA_DIR / path_conf["filename_ias"]
 FILEPATH_LEN = DATA_DIR / path_conf["filename_length"]
 
 CAL_CONF = config(section="calibration")
+SOLVER_CONF = config(section="solver")
 
 lighting_factor = float(CAL_CONF["lighting_factor"])
 
@@ -69,136 +71,6 @@ def StringToDatetime(d):
     return datetime.datetime.strptime(d, "%Y-%m-%d %H:%M:%S")
 
 
-def climterp_linear(h1, h2, numDays, filepath_weather=None):
-    temp_in = None
-    rh_in = None
-    if filepath_weather:
-        header_list = ["DateTime", "T_e", "RH_e"]
-        ExternalWeather = pd.read_csv(
-            filepath_weather, delimiter=",", names=header_list
-        )
-        # ExternalWeather = np.genfromtxt(filepath_weather, delimiter=',')
-        # temp_in = ExternalWeather[h1:h2+1,1] # +1 to ensure correct end point
-        # rh_in = ExternalWeather[h1:h2+1,2] # +1 to ensure correct end point
-        timestamp = ExternalWeather.DateTime
-        timestamp = timestamp.to_numpy()
-        timestamp = np.array(
-            [StringToDatetime(timestamp[d]) for d in range(0, timestamp.shape[0])]
-        )
-        temp_in = ExternalWeather.T_e
-        temp_in = temp_in.to_numpy().astype(np.float64)
-        rh_in = ExternalWeather.RH_e
-        rh_in = rh_in.to_numpy().astype(np.float64)
-    else:
-        ExternalWeather = np.asarray(
-            get_days_weather(numDays + 1, numRows=(numDays + 1) * 24)
-        )
-        timestamp = ExternalWeather[:, 0]
-        temp_in = ExternalWeather[:, 1].astype(
-            np.float64
-        )  # +1 to ensure correct end point
-        rh_in = ExternalWeather[:, 2].astype(
-            np.float64
-        )  # +1 to ensure correct end point
-
-    # remove nans
-    # nans, x= nan_helper(temp_in)
-    # temp_in[nans]= np.interp(x(nans), x(~nans), temp_in[~nans])
-
-    # nans, x= nan_helper(rh_in)
-    # rh_in[nans]= np.interp(x(nans), x(~nans), rh_in[~nans])
-
-    # convert Python datetime to epoch - this allows for linear interpolation of time
-    timestamp = np.array(
-        [DatetimeToTimestamp(timestamp[d]) for d in range(0, timestamp.shape[0])]
-    )
-    ind = h2 - h1 + 1
-    seconds_in_hour = 3600
-    seconds_in_hspan = (h2 - h1) * seconds_in_hour
-    # `t` corresponds to the time vector for the hourly weather data pulled from the DB
-    t = np.linspace(0, seconds_in_hspan, ind)  # TODO This is really just a range.
-    # `mult` corresponds to the resampling time vector (at frequency corresponding to period `deltaT`)
-    mult = np.linspace(0, seconds_in_hspan, int(1 + seconds_in_hspan / deltaT))
-    # perform linear interpolation
-    clim_timestamp = np.interp(mult, t, timestamp[-ind:])
-    clim_timestamp = np.array(
-        [
-            TimestampToDatetime(clim_timestamp[d])
-            for d in range(0, clim_timestamp.shape[0])
-        ]
-    )  # convert back to datetime
-    clim_t = np.interp(mult, t, temp_in[-ind:])
-    clim_rh = np.interp(mult, t, rh_in[-ind:])
-    climate = np.vstack((clim_timestamp, clim_t, clim_rh))
-    return climate
-
-
-def climterp_forecast_linear(numDays=2, filepath_weather_forecast=None):
-    """
-    Perform linear interpolation of weather forecast data.
-
-    Arguments:
-        numDays: number of days into the future for which to retrieve weather forecasts.
-            Default value is 2. Weather forecasts are available for a maximum of 2 days
-            into the future.
-        filepath_weather_forecast: path of csv file containing weather forecasts.
-            If no path is provided, the function retrieves weather forecast data from the DB.
-    Returns:
-        climate: numpy array containing the linearly interpolated weather forecasts.
-        The first row contains the timestamps, the second row contains temperature
-        and the third row contains relative humidity.
-    """
-    timestamp = None
-    temp_in = None
-    rh_in = None
-    if filepath_weather_forecast:
-        header_list = ["DateTime", "T_e", "RH_e"]
-        ExternalWeather = pd.read_csv(
-            filepath_weather_forecast, delimiter=",", names=header_list
-        )
-        timestamp = ExternalWeather.DateTime
-        timestamp = timestamp.to_numpy()
-        timestamp = np.array(
-            [StringToDatetime(timestamp[d]) for d in range(0, timestamp.shape[0])]
-        )
-        temp_in = ExternalWeather.T_e
-        temp_in = temp_in.to_numpy().astype(np.float64)
-        rh_in = ExternalWeather.RH_e
-        rh_in = rh_in.to_numpy().astype(np.float64)
-    else:
-        ExternalWeather = get_days_weather_forecast(numDays)
-        ExternalWeather = np.asarray(ExternalWeather)
-        timestamp = ExternalWeather[:, 0]
-        temp_in = ExternalWeather[:, 1].astype(
-            np.float64
-        )  # +1 to ensure correct end point
-        rh_in = ExternalWeather[:, 2].astype(
-            np.float64
-        )  # +1 to ensure correct end point
-    delta_in_secs = timestamp[-1] - timestamp[0]
-    delta_in_secs = delta_in_secs.total_seconds()
-    # `t` corresponds to the time vector for the hourly weather data pulled from the DB
-    t = np.linspace(0, delta_in_secs, len(timestamp))
-    # `mult` corresponds to the resampling time vector (at frequency corresponding to period `deltaT`)
-    mult = np.linspace(0, delta_in_secs, int(1 + delta_in_secs / deltaT))
-    # convert Python datetime to epoch - this allows for linear interpolation of time
-    timestamp = np.array(
-        [DatetimeToTimestamp(timestamp[d]) for d in range(0, timestamp.shape[0])]
-    )
-    # perform linear interpolation
-    clim_timestamp = np.interp(mult, t, timestamp)
-    clim_timestamp = np.array(
-        [
-            TimestampToDatetime(clim_timestamp[d])
-            for d in range(0, clim_timestamp.shape[0])
-        ]
-    )
-    clim_t = np.interp(mult, t, temp_in)
-    clim_rh = np.interp(mult, t, rh_in)
-    climate = np.vstack((clim_timestamp, clim_t, clim_rh))
-    return climate
-
-
 def lamorturb(Gr, Re):
 
     Le = 0.819
@@ -314,16 +186,25 @@ def model(
     climate,
     ACHvec,
     iasvec,
-    daynum,
-    count,
+    slot_starts,
     h1,
     h2,
     ndhvec,
     lshiftvec,
     LatestTimeHourValue,
 ):
-    delta_h = int(CAL_CONF["delta_h"])
+    """
+    The right-hand side of the GES model. It only depends on t and z, and not on the
+    history of calls, so that solver steps can be rejected and retried.
 
+    ACHvec, iasvec, ndhvec and lshiftvec hold the parameters for each slot of the
+    schedule, and slot_starts the hours at which each slot after the first starts.
+
+    Several scenarios can be evaluated at once, see solve_scenarios_batched and
+    _batched_rhs in scenario_executor. z is then an array of shape (12, NP), and
+    ACHvec, iasvec, ndhvec and lshiftvec of shape (number of slots, NP), with one
+    column per scenario.
+    """
     T_c = z[0]
     T_i = z[1]
     T_v = z[2]
@@ -347,32 +228,23 @@ def model(
     RH_e = climate[n, 1] / 100
     Cw_ext = RH_e * sat_conc(T_ext)
 
-    daynum.append(day(t))
-    # if daynum[(len(daynum)-1)] > daynum[(len(daynum)-2)]:
-    #    logging.info(daynum[len(daynum)-1])
-
     # Set ACH,ias
     hour = np.floor(t / 3600) + 1
-    # TODO What are these bounds? Should they depend on delta_h in this way?
-    seq = range(h1 + delta_h, h2 + 24, delta_h)
+    slot = np.searchsorted(slot_starts, hour, side="right")
 
-    if hour >= seq[count[-1]]:
-        count_new = count[-1] + 1
-        count.append(count_new)
-
-    ACH = ACHvec[count[-1]]
-    ias = iasvec[count[-1]]
-    ndh = ndhvec[count[-1]]
-    lshift = lshiftvec[count[-1]]
+    ACH = ACHvec[slot]
+    ias = iasvec[slot]
+    ndh = ndhvec[slot]
+    lshift = lshiftvec[slot]
 
     ## Lights
     day_hour = (
         (hour + LatestTimeHourValue) / 24 - np.floor((hour + LatestTimeHourValue) / 24)
     ) * 24
-    L_on = (day_hour > -0.01 and day_hour < (08.01 + lshift)) or day_hour > (
-        15.01 + lshift
+    L_on = ((day_hour > -0.01) & (day_hour < (08.01 + lshift))) | (
+        day_hour > (15.01 + lshift)
     )
-    AL_on = day_hour > 08.01 and day_hour < 16.01
+    AL_on = (day_hour > 08.01) & (day_hour < 16.01)
 
     T_l = L_on * T_al + (1 - L_on) * T_i
 
@@ -561,6 +433,53 @@ def model(
     )
 
 
+def get_model(backend=None):
+    """
+    The right-hand side of the GES model, in the given implementation.
+
+    Arguments:
+        backend: str or None, "python" for model, or "numba" for the compiled
+            model_kernel.model_rhs. If None, it is read from the configuration file.
+    Returns:
+        model: function with the same arguments as model
+    """
+    if backend is None:
+        backend = SOLVER_CONF["model_backend"]
+    if backend == "python":
+        return model
+    if backend == "numba":
+        from .model_kernel import NUMBA_AVAILABLE, model_rhs
+
+        if not NUMBA_AVAILABLE:
+            raise ImportError("The numba package is needed for the numba backend.")
+        return model_rhs
+    raise ValueError(f"Unknown model backend: {backend}")
+
+
+def get_solver_options(jac_sparsity=None):
+    """
+    Extra keyword arguments for solve_ivp.
+
+    Arguments:
+        jac_sparsity: bool or None, whether to pass the sparsity pattern of the Jacobian
+            to the solver. If None, it is read from the configuration file.
+    Returns:
+        solver_options: dict
+    """
+    if not _solver_flag("jac_sparsity", jac_sparsity):
+        return {}
+    from .model_kernel import JAC_SPARSITY
+
+    return {"jac_sparsity": JAC_SPARSITY}
+
+
+def _solver_flag(key, value=None):
+    """value if it is not None, otherwise the boolean key of the solver configuration."""
+    if value is None:
+        value = SOLVER_CONF[key].lower() in ("true", "yes", "1")
+    return value
+
+
 def derivatives(
     h1,
     h2,
@@ -570,26 +489,15 @@ def derivatives(
     filePathWeather,
     filePathWeatherForecast,
     LatestTimeHourValue,
+    num_workers=None,
+    backend=None,
+    jac_sparsity=None,
+    batched=None,
 ):
 
-    # Get historical weather data
-    clim_historical = np.transpose(climterp_linear(h1, h2, numDays, filePathWeather))
-    # Get forecast weather data for the next two days
-    clim_forecast = np.transpose(
-        climterp_forecast_linear(
-            numDays=2, filepath_weather_forecast=filePathWeatherForecast
-        )
-    )
-    # Concatenate into single array - organised in ascending order of timestamp
-    clim = np.concatenate((clim_historical, clim_forecast), axis=0)
-    # Convert to pandas DataFrame
-    clim = pd.DataFrame(clim, columns=["timestamp", "temperature", "relative_humidity"])
-    # find duplicated timestamps. If two duplicated timestamps are found, keep historical over forecast
-    is_duplicate = clim.duplicated("timestamp", keep="first")
-    clim = clim[~is_duplicate]
-    # drop the "timestamp" column
-    clim = clim.drop("timestamp", axis=1)
-    clim = clim.to_numpy()
+    # Historical weather followed by the forecast for the next two days, where they
+    # don't overlap.
+    clim = scenario_climate(h1, h2, numDays, filePathWeather, filePathWeatherForecast)
 
     # Add extra weather if scenario evaluation
 
@@ -611,75 +519,90 @@ def derivatives(
 
     NOut = 1 + h2 - h1
 
-    results = np.zeros((12, NOut, NP))
+    # Initial conditions
+    T_i_0 = 295
+    T_c_0 = 293
+    T_f_0 = 293
+    T_v_0 = 297
+    T_m_0 = 297
+    T_p_0 = 297
+    T_c1_0 = 295
+    T_c2_0 = 292
+    T_c3_0 = 291
+    T_c4_0 = 289
+    T_c5_0 = 287
+    C_w_0 = 0.012
+
+    z = [
+        T_c_0,
+        T_i_0,
+        T_v_0,
+        T_m_0,
+        T_p_0,
+        T_f_0,
+        T_c1_0,
+        T_c2_0,
+        T_c3_0,
+        T_c4_0,
+        T_c5_0,
+        C_w_0,
+    ]
 
-    # Loop over mean, upper quantile, lower quantile, and scenario.
-    for i in range(NP):
-        # tic = time.time()
+    t = [h1 * 3600, h2 * 3600]
+    tval = np.linspace(h1 * 3600, h2 * 3600, NOut)
 
-        logging.info(i + 1)
+    # The hours at which the ACH, IAS, dehumidifier and lighting parameters change.
+    # TODO What are these bounds? Should they depend on delta_h in this way?
+    delta_h = int(CAL_CONF["delta_h"])
+    slot_starts = np.arange(h1 + delta_h, h2 + 24, delta_h)
+
+    if _solver_flag("batched", batched):
+        if backend not in (None, "python"):
+            raise ValueError("Batched scenarios can only use the python backend.")
+        # One column of parameters per scenario.
+        ACH = paramsinput[:, 0, :] / 3600
+        ias = paramsinput[:, 1, :]
+        ndh = paramsinput[:, 2, :]
+        lshift = paramsinput[:, 3, :]
+        batched_args = (ACH, ias, slot_starts, h1, h2, ndh, lshift, LatestTimeHourValue)
+        solver_options = get_solver_options(jac_sparsity)
+        return solve_scenarios_batched(
+            model,
+            climate,
+            t,
+            z,
+            tval,
+            batched_args,
+            NP,
+            jac_sparsity=solver_options.get("jac_sparsity"),
+        )
 
+    # Arguments of the model for the mean, upper quantile, lower quantile, and each
+    # scenario, after the climate array that they all share.
+    scenario_args = []
+    for i in range(NP):
         AirChangeHour = paramsinput[:, 0, i]
         IntAirSpeed = paramsinput[:, 1, i]
         ndh = paramsinput[:, 2, i]
         lshift = paramsinput[:, 3, i]
 
-        # Initial conditions
-        T_i_0 = 295
-        T_c_0 = 293
-        T_f_0 = 293
-        T_v_0 = 297
-        T_m_0 = 297
-        T_p_0 = 297
-        T_c1_0 = 295
-        T_c2_0 = 292
-        T_c3_0 = 291
-        T_c4_0 = 289
-        T_c5_0 = 287
-        C_w_0 = 0.012
-
-        z = [
-            T_c_0,
-            T_i_0,
-            T_v_0,
-            T_m_0,
-            T_p_0,
-            T_f_0,
-            T_c1_0,
-            T_c2_0,
-            T_c3_0,
-            T_c4_0,
-            T_c5_0,
-            C_w_0,
-        ]
-
-        daynum = [0]
-        count = [0]
-
         ACH = AirChangeHour / 3600
         ias = IntAirSpeed
 
-        t = [h1 * 3600, h2 * 3600]
-        tval = np.linspace(h1 * 3600, h2 * 3600, NOut)
-
-        params = [
-            climate,
-            ACH,
-            ias,
-            daynum,
-            count,
-            h1,
-            h2,
-            ndh,
-            lshift,
-            LatestTimeHourValue,
-        ]
-
-        output = solve_ivp(
-            model, t, z, method="BDF", t_eval=tval, rtol=1e-5, args=params
+        scenario_args.append(
+            (ACH, ias, slot_starts, h1, h2, ndh, lshift, LatestTimeHourValue)
         )
 
-        results[:, :, i] = output.y
+    results = solve_scenarios(
+        get_model(backend),
+        climate,
+        t,
+        z,
+        tval,
+        scenario_args,
+        num_workers=num_workers,
+        solver_options=get_solver_options(jac_sparsity),
+    )
 
     return results
 
@@ -0,0 +1,300 @@
+"""
+A compiled version of the right-hand side of the GES model, functions_scenarioV1.model.
+
+The functions here are written in the subset of Python that Numba can compile, and are
+compiled with numba.njit if Numba is installed. Without Numba they run as plain Python,
+which is slower than the reference implementation, so model_rhs should only be used
+when NUMBA_AVAILABLE is True. functions_scenarioV1.model remains the reference, and
+the two should agree to within solver tolerance.
+
+JAC_SPARSITY is the sparsity pattern of the Jacobian of the model, which can be passed
+to solve_ivp to reduce the number of evaluations needed to estimate it.
+"""
+import math
+
+import numpy as np
+
+from .config import config
+from .parameters import T_k, deltaT
+from .parameters import R, M_w, M_a, atm, H_fg, N_A, heat_phot, Le
+from .parameters import V, A_c, A_f, A_v, A_m, A_p, A_l
+from .parameters import d_c, d_f, d_m, d_p, cd_c, c_i, c_f, c_m, c_p
+from .parameters import F_c_f, F_f_c, F_c_v, F_c_m, F_l_c, F_l_v, F_l_m, F_l_p
+from .parameters import F_m_l, F_f_p, F_c_l, F_m_v, F_v_l, F_p_l
+from .parameters import F_p_f, F_p_v, F_p_m, F_v_c, F_v_p, F_v_m, F_m_c, F_m_p
+from .parameters import eps_c, eps_f, eps_v, eps_m, eps_p, eps_l
+from .parameters import rho_c, rho_f, rho_v, rho_m, rho_p, rho_l
+from .parameters import lam_f, l_f, lam_p, l_m
+from .parameters import T_ss, T_al
+from .parameters import f_heat, f_light, P_al, P_ambient_al, P_dh
+from .parameters import c_v, msd_v, d_v, AF_g, LAI, dsat
+from .parameters import lam_c as _lam_c, l_c as _l_c, rhod_c as _rhod_c, c_c as _c_c
+
+try:
+    from numba import njit
+
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        """Stand-in for numba.njit that leaves the function as it is."""
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda function: function
+
+
+lighting_factor = float(config(section="calibration")["lighting_factor"])
+
+# Numba can use global arrays, but not lists.
+lam_c = np.array(_lam_c)
+l_c = np.array(_l_c)
+rhod_c = np.array(_rhod_c)
+c_c = np.array(_c_c)
+
+# The order of the state variables is
+# T_c, T_i, T_v, T_m, T_p, T_f, T_c1, T_c2, T_c3, T_c4, T_c5, C_w
+# and row i lists the state variables that the derivative of variable i depends on.
+_DEPENDENCIES = [
+    [0, 1, 2, 3, 5, 6],  # T_c
+    [0, 1, 2, 3, 4, 5, 11],  # T_i
+    [0, 1, 2, 3, 4, 11],  # T_v
+    [0, 1, 2, 3, 4, 11],  # T_m
+    [1, 2, 3, 4, 5],  # T_p
+    [0, 1, 4, 5],  # T_f
+    [0, 6, 7],  # T_c1
+    [6, 7, 8],  # T_c2
+    [7, 8, 9],  # T_c3
+    [8, 9, 10],  # T_c4
+    [9, 10],  # T_c5
+    [1, 2, 3, 11],  # C_w
+]
+JAC_SPARSITY = np.zeros((12, 12), dtype=bool)
+for _i, _columns in enumerate(_DEPENDENCIES):
+    JAC_SPARSITY[_i, _columns] = True
+
+
+@njit(cache=True)
+def lamorturb(Gr, Re):
+    Le = 0.819
+
+    if Gr < 1e5:
+        Nu_G = 0.5 * Gr**0.25
+    else:
+        Nu_G = 0.13 * Gr**0.33
+
+    if Re < 2e4:
+        Nu_R = 0.6 * Re**0.5
+    else:
+        Nu_R = 0.032 * Re**0.8
+
+    if Nu_G > Nu_R:
+        Nu = Nu_G
+        Sh = Nu * Le**0.25
+    else:
+        Nu = Nu_R
+        Sh = Nu * Le**0.33
+
+    return Nu, Sh
+
+
+@njit(cache=True)
+def convection(d, A, T1, T2, ias):
+    g = 9.81
+    nu = 15.1e-6
+    lam = 0.025
+
+    Gr = (g * d**3) / (T1 * nu**2) * abs(T1 - T2)
+    Re = ias * d / nu
+    Nu, Sh = lamorturb(Gr, Re)
+
+    return A * Nu * lam * (T1 - T2) / d
+
+
+@njit(cache=True)
+def radiation(eps_1, eps_2, rho_1, rho_2, F_1_2, F_2_1, A_1, T_1, T_2):
+    sigm = 5.67e-8
+
+    k = eps_1 * eps_2 / (1 - rho_1 * rho_2 * F_1_2 * F_2_1)
+    return k * sigm * A_1 * F_1_2 * (T_1**4 - T_2**4)
+
+
+@njit(cache=True)
+def conduction(A, lam, l, T1, T2):
+    return (A * lam / l) * (T1 - T2)
+
+
+@njit(cache=True)
+def sat_conc(T):
+    TC = T - T_k
+    spec_hum = math.exp(11.56 - 4030 / (TC + 235))
+    air_dens = -0.0046 * TC + 1.2978
+    return spec_hum * air_dens
+
+
+@njit(cache=True)
+def model_rhs(
+    t,
+    z,
+    climate,
+    ACHvec,
+    iasvec,
+    slot_starts,
+    h1,
+    h2,
+    ndhvec,
+    lshiftvec,
+    LatestTimeHourValue,
+):
+    """
+    The right-hand side of the GES model, with the same arguments and result as
+    functions_scenarioV1.model.
+    """
+    T_c = z[0]
+    T_i = z[1]
+    T_v = z[2]
+    T_m = z[3]
+    T_p = z[4]
+    T_f = z[5]
+    T_c1 = z[6]
+    T_c2 = z[7]
+    T_c3 = z[8]
+    T_c4 = z[9]
+    T_c5 = z[10]
+    C_w = z[11]
+
+    p_w = C_w * R * T_i / M_w
+    rho_i = ((atm - p_w) * M_a + p_w * M_w) / (R * T_i)
+
+    t_init = h1 * 3600
+
+    n = int(math.ceil((t - t_init) / deltaT))
+    T_ext = climate[n, 0] + T_k
+    RH_e = climate[n, 1] / 100
+    Cw_ext = RH_e * sat_conc(T_ext)
+
+    # Set ACH,ias
+    hour = math.floor(t / 3600) + 1
+    slot = np.searchsorted(slot_starts, hour, side="right")
+
+    ACH = ACHvec[slot]
+    ias = iasvec[slot]
+    ndh = ndhvec[slot]
+    lshift = lshiftvec[slot]
+
+    ## Lights
+    day_hour = (
+        (hour + LatestTimeHourValue) / 24
+        - math.floor((hour + LatestTimeHourValue) / 24)
+    ) * 24
+    L_on = 0.0
+    if (day_hour > -0.01 and day_hour < (8.01 + lshift)) or day_hour > (15.01 + lshift):
+        L_on = 1.0
+    AL_on = 0.0
+    if day_hour > 8.01 and day_hour < 16.01:
+        AL_on = 1.0
+
+    T_l = L_on * T_al + (1 - L_on) * T_i
+
+    QV_l_i = f_heat * P_al * lighting_factor * L_on + P_ambient_al * AL_on + ndh * P_dh
+
+    ## Convection
+    QV_i_c = convection(d_c, A_c, T_i, T_c, ias)
+    QV_i_f = convection(d_f, A_f, T_i, T_f, ias)
+    A_v_exp = LAI * A_v
+    QV_i_v = convection(d_v, A_v_exp, T_i, T_v, ias)
+    A_m_exp = A_m * (1 - AF_g)
+    QV_i_m = convection(d_m, A_m_exp * 0.6, T_i, T_m, ias)
+
+    g = 9.81
+    nu = 15.1e-6
+    lam = 0.025
+    Gr = (g * d_m**3) / (T_i * nu**2) * abs(T_i - T_m)
+    Re = ias * d_m / nu
+    Nu, Sh = lamorturb(Gr, Re)
+
+    QP_i_m = (
+        A_m_exp
+        * 0.4
+        * dsat
+        * H_fg
+        / (rho_i * c_i)
+        * (Sh / Le)
+        * (lam / d_m)
+        * (C_w - sat_conc(T_m))
+    )
+
+    QV_i_p = convection(d_p, A_p, T_i, T_p, ias)
+
+    ## Radiation
+    QR_c_f = radiation(eps_c, eps_f, rho_c, rho_f, F_c_f, F_f_c, A_c, T_c, T_f)
+    QR_c_v = radiation(eps_c, eps_v, rho_c, rho_v, F_c_v, F_v_c, A_c, T_c, T_v)
+    QR_c_m = radiation(eps_c, eps_m, rho_c, rho_m, F_c_m, F_m_c, A_c, T_c, T_m)
+    QR_l_c = radiation(eps_l, eps_c, rho_l, rho_c, F_l_c, F_c_l, A_l, T_l, T_c)
+    QR_l_v = radiation(eps_l, eps_v, rho_l, rho_v, F_l_v, F_v_l, A_l, T_l, T_v)
+    QR_l_m = radiation(eps_l, eps_m, rho_l, rho_m, F_l_m, F_m_l, A_l, T_l, T_m)
+    QR_l_p = radiation(eps_l, eps_p, rho_l, rho_p, F_l_p, F_p_l, A_l, T_l, T_p)
+    QR_v_c = radiation(eps_v, eps_c, rho_v, rho_c, F_v_c, F_c_v, A_v, T_v, T_c)
+    QR_v_m = radiation(eps_v, eps_m, rho_v, rho_m, F_v_m, F_m_v, A_v, T_v, T_m)
+    QR_v_p = radiation(eps_v, eps_p, rho_v, rho_p, F_v_p, F_p_v, A_v, T_v, T_p)
+    QR_m_c = radiation(eps_m, eps_c, rho_m, rho_c, F_m_c, F_c_m, A_m, T_m, T_c)
+    QR_m_v = radiation(eps_m, eps_v, rho_m, rho_v, F_m_v, F_v_m, A_m, T_m, T_v)
+    QR_m_p = radiation(eps_m, eps_p, rho_m, rho_p, F_m_p, F_p_m, A_m, T_m, T_p)
+    QR_p_v = radiation(eps_p, eps_v, rho_p, rho_v, F_p_v, F_v_p, A_p, T_p, T_v)
+    QR_p_m = radiation(eps_p, eps_m, rho_p, rho_m, F_p_m, F_m_p, A_p, T_p, T_m)
+    QR_p_f = radiation(eps_p, eps_f, rho_p, rho_f, F_p_f, F_f_p, A_p, T_p, T_f)
+    QR_f_c = radiation(eps_f, eps_c, rho_f, rho_c, F_f_c, F_c_f, A_f, T_f, T_c)
+    QR_f_p = radiation(eps_f, eps_p, rho_f, rho_p, F_f_p, F_p_f, A_f, T_f, T_p)
+
+    ## Conduction
+    QD_c12 = conduction(A_c, lam_c[0], l_c[0], T_c, T_c1)
+    QD_c23 = conduction(A_c, lam_c[1], l_c[1], T_c1, T_c2)
+    QD_c34 = conduction(A_c, lam_c[2], l_c[2], T_c2, T_c3)
+    QD_c45 = conduction(A_c, lam_c[3], l_c[3], T_c3, T_c4)
+    QD_c56 = conduction(A_c, lam_c[4], l_c[4], T_c4, T_c5)
+    QD_c67 = conduction(A_c, lam_c[5], l_c[5], T_c5, T_ss)
+
+    T_fl = (0.435 * (T_ext - T_k) + 12) + T_k
+    QD_f12 = conduction(A_f, lam_f, l_f, T_f, T_fl)
+
+    QD_m_p = (A_m * lam_p / l_m) * (T_m - T_p)
+
+    ## Transpiration
+    QS_int = f_light * P_al * lighting_factor * L_on / A_p
+
+    PPFD = QS_int / 1e-6 / N_A / heat_phot
+    r_aG = 100
+    r_sG = 60 * (1500 + PPFD) / (200 + PPFD)
+    QT_v_i = A_v * (1 * LAI * H_fg * (1 / (r_aG + r_sG)) * (sat_conc(T_v) - C_w))
+
+    ## Ventilation
+    QV_i_e = ACH * V * rho_i * c_i * (T_i - T_ext)
+    MW_i_e = ACH * (C_w - Cw_ext)
+
+    ## Dehumidification
+    RH = C_w / sat_conc(T_i)
+    dehumidify = ndh * (0.07 * T_i + 5 * RH - 21.8) / V
+    MW_cc_i = -1 * dehumidify / 3600
+
+    # ODE equations. Convection only adds to the moisture balance through the mat, so
+    # the other QP terms of the reference implementation are left out.
+    dzdt = np.empty(12)
+    dzdt[0] = (1 / (A_c * cd_c)) * (QV_i_c - QR_c_f - QR_c_v - QR_c_m + QR_l_c - QD_c12)
+    dzdt[1] = (1 / (V * rho_i * c_i)) * (
+        -QV_i_c - QV_i_f - QV_i_e + QV_l_i - QV_i_m - QV_i_v - QV_i_p
+    )
+    dzdt[2] = (1 / (c_v * A_v * msd_v)) * (
+        QV_i_v - QR_v_c - QR_v_m + QR_l_v - QR_v_p - QT_v_i
+    )
+    dzdt[3] = (1 / (A_m * c_m)) * (
+        QV_i_m + QP_i_m - QR_m_v - QR_m_c + QR_l_m - QR_m_p - QD_m_p
+    )
+    dzdt[4] = (1 / (A_p * c_p)) * (QD_m_p + QV_i_p - QR_p_f + QR_l_p - QR_p_v - QR_p_m)
+    dzdt[5] = (1 / (A_f * c_f)) * (QV_i_f - QR_f_c - QR_f_p - QD_f12)
+    dzdt[6] = (1 / (rhod_c[1] * c_c[1] * l_c[1] * A_c)) * (QD_c12 - QD_c23)
+    dzdt[7] = (1 / (rhod_c[2] * c_c[2] * l_c[2] * A_c)) * (QD_c23 - QD_c34)
+    dzdt[8] = (1 / (rhod_c[3] * c_c[3] * l_c[3] * A_c)) * (QD_c34 - QD_c45)
+    dzdt[9] = (1 / (rhod_c[4] * c_c[4] * l_c[4] * A_c)) * (QD_c45 - QD_c56)
+    dzdt[10] = (1 / (rhod_c[5] * c_c[5] * l_c[5] * A_c)) * (QD_c56 - QD_c67)
+    dzdt[11] = (1 / (V * H_fg)) * (QT_v_i - QP_i_m) - MW_i_e + MW_cc_i
+    return dzdt
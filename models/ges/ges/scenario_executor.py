@@ -0,0 +1,236 @@
+"""
+Run the GES model for several scenarios (sets of parameters) in parallel, or as one
+batched system of ODEs.
+
+Each scenario is an independent solve_ivp run of the same model, over the same
+climate array. The scenarios are spread over a pool of processes, and the climate
+array is placed in shared memory, so that it is not copied to every process.
+
+Alternatively, solve_scenarios_batched integrates all the scenarios at once, with a
+model that evaluates the right-hand side for every scenario with array operations.
+The Jacobian of the combined system is block diagonal, so it is cheap to estimate
+and factorise, and each extra scenario adds little to the cost.
+
+The worker processes are started with "spawn" rather than forked, so that they don't
+inherit open database connections, and are kept for later calls.
+"""
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+from scipy import sparse
+from scipy.integrate import solve_ivp
+
+from .config import config
+
+PARALLEL_CONF = config(section="parallel")
+
+# The pool of worker processes, and the number of workers in it.
+_executor = None
+_executor_workers = None
+
+# The shared memory last attached to in a worker process, and the climate array in it.
+_climate_memory = None
+_climate = None
+
+
+def get_num_workers(num_workers=None):
+    """
+    The number of worker processes to use.
+
+    Arguments:
+        num_workers: int or None. If None, it is read from the configuration file.
+            0 means one worker per CPU.
+    Returns:
+        num_workers: int, at least 1
+    """
+    if num_workers is None:
+        num_workers = int(PARALLEL_CONF["num_workers"])
+    if num_workers <= 0:
+        num_workers = os.cpu_count() or 1
+    return num_workers
+
+
+def _get_executor(num_workers):
+    """The pool of num_workers worker processes, created on first use."""
+    global _executor, _executor_workers
+    if _executor is None or _executor_workers != num_workers:
+        if _executor is not None:
+            _executor.shutdown()
+        _executor = ProcessPoolExecutor(
+            max_workers=num_workers, mp_context=multiprocessing.get_context("spawn")
+        )
+        _executor_workers = num_workers
+    return _executor
+
+
+def _attach_climate(memory_name, shape, dtype):
+    """The climate array in the shared memory called memory_name, in a worker."""
+    global _climate, _climate_memory
+    if _climate_memory is None or _climate_memory.name != memory_name:
+        if _climate_memory is not None:
+            _climate = None
+            _climate_memory.close()
+        _climate_memory = shared_memory.SharedMemory(name=memory_name)
+        _climate = np.ndarray(shape, dtype=dtype, buffer=_climate_memory.buf)
+    return _climate
+
+
+def _solve(model, climate, t_span, z0, t_eval, args, solver_options=None):
+    """Solve the model for one scenario, with the extra arguments args after climate."""
+    output = solve_ivp(
+        model,
+        t_span,
+        z0,
+        method="BDF",
+        t_eval=t_eval,
+        rtol=1e-5,
+        args=(climate, *args),
+        **(solver_options or {}),
+    )
+    return output.y
+
+
+def _solve_in_worker(task):
+    model, climate_spec, t_span, z0, t_eval, args, solver_options = task
+    climate = _attach_climate(*climate_spec)
+    return _solve(model, climate, t_span, z0, t_eval, args, solver_options)
+
+
+def solve_scenarios(
+    model,
+    climate,
+    t_span,
+    z0,
+    t_eval,
+    scenario_args,
+    num_workers=None,
+    solver_options=None,
+):
+    """
+    Solve the model for each scenario, using a pool of processes.
+
+    Arguments:
+        model: function model(t, z, climate, *args) giving the derivatives of the state
+            z. It must be defined at module level, so that it can be pickled.
+        climate: numpy array of floats, the weather data passed to every run
+        t_span: (t0, t1), the interval of integration
+        z0: list, initial state, or array of shape (number of states,
+            len(scenario_args)) with the initial state of each scenario
+        t_eval: numpy array, the times at which to store the solution
+        scenario_args: list of tuples, the arguments after climate for each scenario
+        num_workers: int, number of processes, see get_num_workers
+        solver_options: dict, optional extra keyword arguments for solve_ivp, e.g.
+            jac_sparsity
+    Returns:
+        results: numpy array of shape (len(z0), len(t_eval), len(scenario_args))
+    """
+    num_scenarios = len(scenario_args)
+    if np.ndim(z0) == 2:
+        scenario_z0 = list(np.transpose(z0))
+    else:
+        scenario_z0 = [z0] * num_scenarios
+    results = np.zeros((len(z0), len(t_eval), num_scenarios))
+    num_workers = min(get_num_workers(num_workers), num_scenarios)
+    if num_workers <= 1:
+        for i, args in enumerate(scenario_args):
+            logging.info(f"Solving scenario {i + 1} of {num_scenarios}")
+            results[:, :, i] = _solve(
+                model, climate, t_span, scenario_z0[i], t_eval, args, solver_options
+            )
+        return results
+
+    climate = np.ascontiguousarray(climate, dtype=np.float64)
+    climate_memory = shared_memory.SharedMemory(create=True, size=climate.nbytes)
+    try:
+        shared_climate = np.ndarray(
+            climate.shape, dtype=climate.dtype, buffer=climate_memory.buf
+        )
+        shared_climate[:] = climate
+        # The workers attach to the shared memory by name, so our view of it can go.
+        del shared_climate
+        climate_spec = (climate_memory.name, climate.shape, climate.dtype)
+        logging.info(
+            f"Solving {num_scenarios} scenarios in {num_workers} worker processes"
+        )
+        tasks = [
+            (model, climate_spec, t_span, z0, t_eval, args, solver_options)
+            for z0, args in zip(scenario_z0, scenario_args)
+        ]
+        executor = _get_executor(num_workers)
+        for i, y in enumerate(executor.map(_solve_in_worker, tasks)):
+            results[:, :, i] = y
+    finally:
+        climate_memory.close()
+        climate_memory.unlink()
+    return results
+
+
+def _batched_rhs(t, y, model, num_states, num_scenarios, climate, *args):
+    """
+    The right-hand side of the batched system, where y holds the state of each
+    scenario in turn, so that the Jacobian is block diagonal.
+    """
+    z = y.reshape(num_scenarios, num_states).T
+    return np.asarray(model(t, z, climate, *args)).T.ravel()
+
+
+def solve_scenarios_batched(
+    model,
+    climate,
+    t_span,
+    z0,
+    t_eval,
+    batched_args,
+    num_scenarios,
+    jac_sparsity=None,
+    solver_options=None,
+):
+    """
+    Solve the model for all scenarios as a single system of ODEs.
+
+    The solver takes the same steps for all scenarios, so the results differ from
+    those of solve_scenarios by up to the tolerance of the solver.
+
+    Arguments:
+        model: function model(t, z, climate, *batched_args) giving the derivatives of
+            the states z, an array of shape (len(z0), num_scenarios), as an array of
+            the same shape.
+        climate: numpy array of floats, the weather data shared by all scenarios
+        t_span: (t0, t1), the interval of integration
+        z0: list, initial state, the same for every scenario
+        t_eval: numpy array, the times at which to store the solution
+        batched_args: tuple, the arguments after climate, with the values for all
+            scenarios
+        num_scenarios: int, number of scenarios
+        jac_sparsity: optional boolean array of shape (len(z0), len(z0)), the sparsity
+            pattern of the Jacobian of one scenario. If None, it is taken to be dense.
+        solver_options: dict, optional extra keyword arguments for solve_ivp
+    Returns:
+        results: numpy array of shape (len(z0), len(t_eval), num_scenarios)
+    """
+    num_states = len(z0)
+    if jac_sparsity is None:
+        jac_sparsity = np.ones((num_states, num_states), dtype=bool)
+    block_sparsity = sparse.kron(
+        sparse.identity(num_scenarios, dtype=bool, format="csr"),
+        sparse.csr_matrix(jac_sparsity),
+        format="csc",
+    )
+    logging.info(f"Solving {num_scenarios} scenarios as one batched system")
+    output = solve_ivp(
+        _batched_rhs,
+        t_span,
+        np.tile(np.asarray(z0, dtype=np.float64), num_scenarios),
+        method="BDF",
+        t_eval=t_eval,
+        rtol=1e-5,
+        args=(model, num_states, num_scenarios, climate, *batched_args),
+        jac_sparsity=block_sparsity,
+        **(solver_options or {}),
+    )
+    y = output.y.reshape(num_scenarios, num_states, len(t_eval))
+    return np.transpose(y, (1, 2, 0))
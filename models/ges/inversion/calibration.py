@@ -1,17 +1,22 @@
 import os
 import sys
+import logging
 import numpy as np
 import math
 import matplotlib.pyplot as plot
 from sklearn.gaussian_process import GaussianProcessRegressor
 from sklearn.gaussian_process.kernels import RBF
 from scipy.stats import norm
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 
 from . import utils
 
 
 class calibrate:
-    def __init__(self, priorPPF, sigmaY, nugget=0, lambda_e=1):
+    def __init__(
+        self, priorPPF, sigmaY, nugget=0, lambda_e=1, batched=False, num_workers=1
+    ):
 
         # prior quantile functions - returns N draws of theta from prior
         self.priorPPF = priorPPF
@@ -25,6 +30,12 @@ class calibrate:
         # model bias scaling
         self.lambda_e = lambda_e
 
+        # whether sequentialUpdate evaluates the marginal likelihoods of all particles
+        # at once, at each particle's lengthscale, see utils.batchLogMarginalLikelihood,
+        # and the number of processes to spread them over
+        self.batched = batched
+        self.num_workers = num_workers
+
     def normal_prior(self, means, sds):
 
         # demo of prior quantile function
@@ -47,101 +58,184 @@ class calibrate:
 
         self.posteriorSamples = self.simAnnealing(0, niter, beta, logConstraint, burn)
 
-    def simAnnealing(self, T, niter, beta, logConstraint=None, burn=1):
+    def parallelMetropolisHastings(
+        self,
+        nchains,
+        maxiter,
+        beta,
+        logConstraint=None,
+        burn=1,
+        check_every=100,
+        rhat_threshold=1.01,
+        min_ess=400,
+        num_workers=None,
+        seed=None,
+    ):
+
+        # nchains independent metropolis hastings chains, run in num_workers processes
+        # (one per chain if None), each with its own random number stream spawned from
+        # seed. The chains are advanced check_every iterations at a time, and stop once
+        # the split R-hat of every component of theta is at most rhat_threshold and its
+        # effective sample size is at least min_ess, or after maxiter iterations.
+        #
+        # The first burn iterations of each chain are discarded before the diagnostics
+        # are computed. self.posteriorSamples holds the pooled samples of all chains,
+        # self.chains the (nchains, n, d) samples of each, and self.rhat and self.ess
+        # the diagnostics of the last check.
+
+        if num_workers is None:
+            num_workers = nchains
+        num_workers = min(num_workers, nchains)
+
+        # the moments of the prior are estimated once, here, and shared by all chains
+        if logConstraint is None or len(logConstraint) == 0:
+            logConstraint = np.zeros(np.size(self.priorPPF()), dtype=int)
+        self.priorMoments(logConstraint)
+
+        rngStates = []
+        for seedSequence in np.random.SeedSequence(seed).spawn(nchains):
+            rng = np.random.RandomState(np.random.MT19937(seedSequence))
+            rngStates.append(rng.get_state())
+        states = [None] * nchains
+
+        if num_workers > 1:
+            executor = ProcessPoolExecutor(
+                max_workers=num_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_initChainWorker,
+                initargs=(self,),
+            )
+        else:
+            executor = None
+            _initChainWorker(self)
+
+        chains = [np.zeros((0, np.size(logConstraint))) for _ in range(nchains)]
+        niter = 0
+        try:
+            while niter < maxiter:
+                segment = min(check_every, maxiter - niter)
+                args = [
+                    (states[c], segment, beta, logConstraint, rngStates[c])
+                    for c in range(nchains)
+                ]
+                if executor is not None:
+                    results = list(executor.map(_runChainSegment, *zip(*args)))
+                else:
+                    results = [_runChainSegment(*a) for a in args]
+                for c, (samples, rngState) in enumerate(results):
+                    chains[c] = np.vstack((chains[c], samples))
+                    states[c] = samples[-1, :]
+                    rngStates[c] = rngState
+                niter += segment
+
+                kept = np.array([chain[burn:, :] for chain in chains])
+                if np.shape(kept)[1] < 4:
+                    continue
+                self.rhat = utils.splitRhat(kept)
+                self.ess = utils.effectiveSampleSize(kept)
+                logging.info(
+                    f"{niter} iterations of {nchains} chains, R-hat {self.rhat}, "
+                    f"effective sample size {self.ess}"
+                )
+                if np.all(self.rhat <= rhat_threshold) and np.all(self.ess >= min_ess):
+                    break
+        finally:
+            if executor is not None:
+                executor.shutdown()
 
-        # simulated annealing with temperature plan alpha^(T * i)
-        # log constraint can be array of booleans, signalling a component of theta (e.g. lengthscale) needs to be lnorm
+        self.chains = np.array([chain[burn:, :] for chain in chains])
+        self.posteriorSamples = np.reshape(self.chains, (-1, np.shape(self.chains)[2]))
 
-        theta = np.zeros((niter + 1, np.shape(self.__drawFromPrior())[1]))
-        theta[0, :] = self.__drawFromPrior()
+    def priorMoments(self, logConstraint=None, N=100000):
 
-        for i in range(1, (niter + 1)):
+        # means and standard deviations of the prior of each component of theta, of its
+        # log for the components flagged in logConstraint, estimated from N draws from
+        # the prior. The draws are made once per calibrate object and kept.
+        if not hasattr(self, "priorSamples") or np.shape(self.priorSamples)[0] != N:
+            self.priorSamples = self.__drawFromPrior(N)
 
-            if len(logConstraint) == 0:
-                prop = theta[i - 1, :] + np.random.normal(0, beta, len(theta[i - 1, :]))
-            else:
-                prop = np.zeros(len(logConstraint))
-                prop[np.where(logConstraint == 1)[0].astype(int)] = np.exp(
-                    np.log(theta[i - 1, np.where(logConstraint == 1)[0].astype(int)])
-                    + np.random.normal(
-                        0,
-                        beta,
-                        len(theta[i - 1, np.where(logConstraint == 1)[0].astype(int)]),
-                    )
-                )
-                prop[np.where(logConstraint == 0)[0].astype(int)] = theta[
-                    i - 1, np.where(logConstraint == 0)[0].astype(int)
-                ] + np.random.normal(
-                    0,
-                    beta,
-                    len(theta[i - 1, np.where(logConstraint == 0)[0].astype(int)]),
-                )
+        samples = np.array(self.priorSamples, dtype=float)
+        if logConstraint is not None and len(logConstraint) > 0:
+            logMask = np.asarray(logConstraint) == 1
+            samples[:, logMask] = np.log(samples[:, logMask])
 
-            alpha = utils.LikelihoodRatio(
+        return np.mean(samples, axis=0), np.std(samples, axis=0)
+
+    def simAnnealing(self, T, niter, beta, logConstraint=None, burn=1, theta0=None):
+
+        # simulated annealing with temperature plan alpha^(T * i)
+        # log constraint can be array of booleans, signalling a component of theta (e.g. lengthscale) needs to be lnorm
+        # the chain starts from theta0 if given, otherwise from a draw from the prior
+
+        if theta0 is None:
+            theta0 = self.__drawFromPrior()
+        theta = np.zeros((niter + 1, np.size(theta0)))
+        theta[0, :] = theta0
+
+        # components of theta proposed, and given a normal prior, on a log scale
+        if logConstraint is None or len(logConstraint) == 0:
+            logMask = np.zeros(np.shape(theta)[1], dtype=bool)
+        else:
+            logMask = np.asarray(logConstraint) == 1
+        # order the proposal steps as the log components first, then the others
+        stepOrder = np.concatenate((np.where(logMask)[0], np.where(~logMask)[0]))
+        priorMeans, priorSds = self.priorMoments(logMask.astype(int))
+
+        def logPrior(theta):
+            theta = np.array(theta, dtype=float)
+            theta[logMask] = np.log(theta[logMask])
+            return np.sum(norm.logpdf(theta, priorMeans, priorSds))
+
+        # training data of the GPs, filled with each theta in turn
+        training = utils.mogpTrainingTemplate(
+            self.xModel, self.xData, self.yModel, self.yData, self.tModel
+        )
+
+        def logMarginalLikelihood(theta):
+            return utils.fitGP(
                 self.xModel,
                 self.xData,
                 self.yModel,
                 self.yData,
                 self.tModel,
-                theta[i - 1, :],
-                prop,
+                theta,
                 self.sigmaY,
                 self.nugget,
                 self.lambda_e,
+                training=training,
+            ).log_marginal_likelihood_value_
+
+        # log marginal likelihood and log prior density of the current state
+        H_theta = logMarginalLikelihood(theta[0, :])
+        logPriorTheta = logPrior(theta[0, :])
+
+        for i in range(1, (niter + 1)):
+
+            step = np.zeros(np.shape(theta)[1])
+            step[stepOrder] = np.random.normal(
+                0, np.broadcast_to(beta, np.shape(step))[stepOrder]
             )
-            priortheta = np.zeros(len(theta[i - 1, :]))
-            priorprop = np.zeros(len(theta[i - 1, :]))
-            for j in range(len(theta[i - 1, :])):
-                if len(logConstraint) == 0:
-                    priortheta[j] = norm.pdf(
-                        theta[i - 1, j],
-                        np.mean(self.__drawFromPrior(100000)[:, j]),
-                        np.std(self.__drawFromPrior(100000)[:, j]),
-                    )
-                    priorprop[j] = norm.pdf(
-                        prop[j],
-                        np.mean(self.__drawFromPrior(100000)[:, j]),
-                        np.std(self.__drawFromPrior(100000)[:, j]),
-                    )
-                else:
-                    if logConstraint[j] == 1:
-                        priortheta[j] = norm.pdf(
-                            np.log(theta[i - 1, j]),
-                            np.mean(np.log(self.__drawFromPrior(100000)[:, j])),
-                            np.std(np.log(self.__drawFromPrior(100000)[:, j])),
-                        )
-                        priorprop[j] = norm.pdf(
-                            np.log(prop[j]),
-                            np.mean(np.log(self.__drawFromPrior(100000)[:, j])),
-                            np.std(np.log(self.__drawFromPrior(100000)[:, j])),
-                        )
-                    else:
-                        priortheta[j] = norm.pdf(
-                            theta[i - 1, j],
-                            np.mean(self.__drawFromPrior(100000)[:, j]),
-                            np.std(self.__drawFromPrior(100000)[:, j]),
-                        )
-                        priorprop[j] = norm.pdf(
-                            prop[j],
-                            np.mean(self.__drawFromPrior(100000)[:, j]),
-                            np.std(self.__drawFromPrior(100000)[:, j]),
-                        )
+            prop = theta[i - 1, :] + step
+            prop[logMask] = np.exp(np.log(theta[i - 1, logMask]) + step[logMask])
+
+            H_prop = logMarginalLikelihood(prop)
+            logPriorProp = logPrior(prop)
+            alpha = H_prop - H_theta
 
             accept = np.log(np.random.uniform(0, 1)) <= np.min(
                 [
                     0,
                     (
                         (1 / np.exp(-(T * ((i + 1) / niter))))
-                        * (
-                            alpha
-                            + (np.sum(np.log(priorprop)) - np.sum(np.log(priortheta)))
-                        )
+                        * (alpha + (logPriorProp - logPriorTheta))
                     ),
                 ]
             )
 
             if accept:
                 theta[i, :] = prop
+                H_theta = H_prop
+                logPriorTheta = logPriorProp
             else:
                 theta[i, :] = theta[i - 1, :]
 
@@ -235,21 +329,42 @@ class calibrate:
         self.mlS = np.zeros(np.shape(particles)[0])
         self.wS = np.zeros(np.shape(particles)[0])
 
-        for i in range(np.shape(particles)[0]):
-
-            gp = utils.fitGP(
-                self.xModel,
-                self.xData,
-                self.yModel,
-                self.yData,
-                self.tModel,
-                particles[i, :],
-                self.sigmaY,
-                self.nugget,
-                self.lambda_e,
+        if self.batched:
+            self.__ml = np.exp(
+                utils.batchLogMarginalLikelihood(
+                    self.xModel,
+                    self.xData,
+                    self.yModel,
+                    self.yData,
+                    self.tModel,
+                    particles,
+                    self.sigmaY,
+                    self.nugget,
+                    self.lambda_e,
+                    num_workers=self.num_workers,
+                )
+            )
+            self.mlS = self.__ml.copy()
+        else:
+            training = utils.mogpTrainingTemplate(
+                self.xModel, self.xData, self.yModel, self.yData, self.tModel
             )
-            self.__ml[i] = np.exp(gp.log_marginal_likelihood_value_)
-            self.mlS[i] = self.__ml[i]
+            for i in range(np.shape(particles)[0]):
+
+                gp = utils.fitGP(
+                    self.xModel,
+                    self.xData,
+                    self.yModel,
+                    self.yData,
+                    self.tModel,
+                    particles[i, :],
+                    self.sigmaY,
+                    self.nugget,
+                    self.lambda_e,
+                    training=training,
+                )
+                self.__ml[i] = np.exp(gp.log_marginal_likelihood_value_)
+                self.mlS[i] = self.__ml[i]
 
         # resample
         self.__w = self.__ml / np.sum(self.__ml)
@@ -280,3 +395,34 @@ class calibrate:
 #        else:
 #            self.posteriorSamples[:, np.where(logConstraint == 1)[0].astype(int)] = np.exp(np.log(self.posteriorSamples[:, np.where(logConstraint == 1)[0].astype(int)]) + np.random.normal(0, beta[np.where(logConstraint == 1)[0].astype(int)], np.shape(self.posteriorSamples[:, np.where(logConstraint == 1)[0].astype(int)])))
 #            self.posteriorSamples[:, np.where(logConstraint == 0)[0].astype(int)] = self.posteriorSamples[:, np.where(logConstraint == 0)[0].astype(int)] + np.random.normal(0, beta[np.where(logConstraint == 0)[0].astype(int)], np.shape(self.posteriorSamples[:, np.where(logConstraint == 0)[0].astype(int)]))
+
+
+# the calibrate object of a worker process of calibrate.parallelMetropolisHastings
+_chainCalibrate = None
+
+
+def _initChainWorker(cal):
+
+    global _chainCalibrate
+    _chainCalibrate = cal
+
+
+def _runChainSegment(theta0, niter, beta, logConstraint, rngState):
+
+    # advances a metropolis hastings chain of _chainCalibrate by niter iterations from
+    # theta0 (a draw from the prior if None), using and returning the state of the
+    # chain's random number stream. The global stream of the process is left as it was.
+    globalState = np.random.get_state()
+    np.random.set_state(rngState)
+    try:
+        samples = _chainCalibrate.simAnnealing(
+            0,
+            niter,
+            beta,
+            logConstraint,
+            burn=0 if theta0 is None else 1,
+            theta0=theta0,
+        )
+        return samples, np.random.get_state()
+    finally:
+        np.random.set_state(globalState)
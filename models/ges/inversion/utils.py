@@ -6,6 +6,8 @@ import matplotlib.pyplot as plot
 from sklearn.gaussian_process import GaussianProcessRegressor
 from sklearn.gaussian_process.kernels import RBF
 from scipy.stats import norm
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 
 from . import kernels
 
@@ -39,9 +41,13 @@ def LikelihoodRatio(
     return alpha
 
 
-def fitGP(xModel, xData, yModel, yData, tModel, tData, sigmaY, nugget, lambda_e):
+def fitGP(
+    xModel, xData, yModel, yData, tModel, tData, sigmaY, nugget, lambda_e, training=None
+):
 
     # initialize and fit multi output gaussian process
+    # training can be the (xTrain, yTrain) of mogpTrainingTemplate for the same data, to
+    # be filled with tData rather than built again
 
     # multioutput gp noise vector
     noiseVector = np.concatenate(
@@ -58,7 +64,11 @@ def fitGP(xModel, xData, yModel, yData, tModel, tData, sigmaY, nugget, lambda_e)
     )
 
     # structure training data
-    xTraining, yTraining = mogpTraining(xModel, xData, yModel, yData, tModel, tData)
+    if training is None:
+        xTraining, yTraining = mogpTraining(xModel, xData, yModel, yData, tModel, tData)
+    else:
+        xTraining, yTraining = training
+        fillMogpTraining(xTraining, tData, np.shape(yModel)[0] * len(xModel))
 
     # fit gps
     gp.fit(xTraining, yTraining)
@@ -71,47 +81,201 @@ def mogpTraining(xModel, xData, yModel, yData, tModel, tData):
     # structures training data for mogp
     # dimensions: xModel (d1), xData (d2), yModel (N x d1), yData (M x d2), tModel (N x e1), tData (e1 + 1)
 
-    # convert tData to M samples - only one 'true' parameter for all observation sets
-    tDatas = np.repeat(
-        np.reshape(tData, ((1, len(tData)))), np.shape(yData)[0] * len(xData), axis=0
-    )
+    xTrain, yTrain = mogpTrainingTemplate(xModel, xData, yModel, yData, tModel)
+    fillMogpTraining(xTrain, tData, np.shape(yModel)[0] * len(xModel))
 
-    # append exact lengthscale in tModel - last component of tData
-    tModels = np.zeros((0, np.shape(tModel)[1] + 1))
-    yModels = np.zeros(0)
-    yDatas = np.zeros(0)
-    for i in range(np.shape(tModel)[0]):
-        tModels = np.vstack(
-            (
-                tModels,
-                np.hstack(
-                    (
-                        np.repeat(
-                            np.reshape(tModel[i, :], ((1, np.shape(tModel)[1]))),
-                            len(xModel),
-                            axis=0,
-                        ),
-                        np.repeat(np.reshape(tData[-1], ((1, 1))), len(xModel), axis=0),
-                    )
-                ),
-            )
-        )
-        yModels = np.concatenate((yModels, yModel[i, :]))
-    for i in range(np.shape(yData)[0]):
-        yDatas = np.concatenate((yDatas, yData[i, :]))
+    return (xTrain, yTrain)
+
+
+def mogpTrainingTemplate(xModel, xData, yModel, yData, tModel):
+
+    # the parts of the mogp training data of mogpTraining that do not depend on tData,
+    # in preallocated arrays. The calibration parameters of the data rows and the
+    # lengthscale column are left to fillMogpTraining, so that the arrays can be reused
+    # for many values of tData.
+    #
+    # rows: N * d1 model rows, each tModel row with exact lengthscale appended, then
+    # M * d2 data rows, each with tData. columns: coordinate, e1 calibration parameters,
+    # lengthscale.
+
+    nModel = np.shape(yModel)[0] * len(xModel)
+    nData = np.shape(yData)[0] * len(xData)
+    e1 = np.shape(tModel)[1]
+
+    xTrain = np.empty((nModel + nData, e1 + 2))
 
     # repeat coordinates for all parameter values
-    # xModels = np.repeat(np.reshape(xModel, ((1, len(xModel)))), np.shape(yModel)[0], axis=0)
-    # xDatas = np.repeat(np.reshape(xData, ((1, len(xData)))), np.shape(yData)[0], axis=0)
-    xModels = np.reshape(
-        np.repeat(xModel, np.shape(yModel)[0]), ((len(xModel) * np.shape(yModel)[0], 1))
+    xTrain[:nModel, 0] = np.repeat(xModel, np.shape(yModel)[0])
+    xTrain[nModel:, 0] = np.repeat(xData, np.shape(yData)[0])
+
+    # repeat each set of model calibration parameters for all coordinates
+    xTrain[:nModel, 1 : e1 + 1] = np.repeat(tModel, len(xModel), axis=0)
+
+    yTrain = np.concatenate((np.ravel(yModel), np.ravel(yData)))
+
+    return (xTrain, yTrain)
+
+
+def fillMogpTraining(xTrain, tData, nModel):
+
+    # writes tData into mogp training data from mogpTrainingTemplate, in place: the
+    # lengthscale (last component of tData) of the nModel model rows, and all of tData
+    # for the data rows - only one 'true' parameter for all observation sets
+
+    xTrain[:nModel, -1] = tData[-1]
+    xTrain[nModel:, 1:] = tData
+
+    return xTrain
+
+
+def splitRhat(chains):
+
+    # split R-hat (Gelman et al., Bayesian Data Analysis, 3rd edition, section 11.4) of
+    # each component of the samples of chains, a (m, n, d) array of m chains of n
+    # samples of d components, as a (d,) array. Each chain is split in two halves,
+    # so that drifts within a chain show up as differences between chains.
+
+    chains = np.asarray(chains, dtype=float)
+    n = np.shape(chains)[1] // 2
+    halves = np.concatenate((chains[:, :n, :], chains[:, -n:, :]), axis=0)
+
+    W = np.mean(np.var(halves, axis=1, ddof=1), axis=0)
+    B = n * np.var(np.mean(halves, axis=1), axis=0, ddof=1)
+    varPlus = (n - 1) / n * W + B / n
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rhat = np.sqrt(varPlus / W)
+    # chains that do not move have no within-chain variance to compare against
+    return np.where(W > 0, rhat, np.inf)
+
+
+def effectiveSampleSize(chains):
+
+    # effective sample size (Gelman et al., Bayesian Data Analysis, 3rd edition, section
+    # 11.5) of each component of the samples of chains, a (m, n, d) array, as a (d,)
+    # array. The autocorrelations are combined over the chains, and summed in pairs up
+    # to the first pair whose sum is negative (Geyer's initial positive sequence).
+
+    chains = np.asarray(chains, dtype=float)
+    m, n, d = np.shape(chains)
+
+    # autocovariances of each chain at all lags, by fft, zero padded against wrapping
+    centred = chains - np.mean(chains, axis=1, keepdims=True)
+    nfft = 2 ** int(np.ceil(np.log2(2 * n)))
+    f = np.fft.rfft(centred, n=nfft, axis=1)
+    acov = np.fft.irfft(f * np.conjugate(f), n=nfft, axis=1)[:, :n, :] / n
+
+    W = np.mean(acov[:, 0, :] * n / (n - 1), axis=0)
+    B = n * np.var(np.mean(chains, axis=1), axis=0, ddof=1) if m > 1 else 0
+    varPlus = (n - 1) / n * W + B / n
+
+    ess = np.zeros(d)
+    for k in range(d):
+        if varPlus[k] <= 0:
+            ess[k] = 0
+            continue
+        rho = 1 - (W[k] - np.mean(acov[:, :, k], axis=0)) / varPlus[k]
+        tau = -1
+        for t in range(0, n - 1, 2):
+            pair = rho[t] + rho[t + 1]
+            if pair < 0:
+                break
+            tau += 2 * pair
+        ess[k] = m * n / tau
+    return ess
+
+
+def batchLogMarginalLikelihood(
+    xModel,
+    xData,
+    yModel,
+    yData,
+    tModel,
+    tDatas,
+    sigmaY,
+    nugget,
+    lambda_e,
+    chunk_size=1000,
+    num_workers=1,
+):
+
+    # log marginal likelihoods of the multi output gp of fitGP for many calibration
+    # parameter vectors tDatas (P x (e1 + 1)) at once, as a (P,) array.
+    #
+    # Unlike fitGP, which lets sklearn optimise the kernel lengthscale starting from
+    # tData[-1], this evaluates each likelihood at the lengthscale tData[-1].
+    # Particles whose covariance matrix is not positive definite get -inf.
+    #
+    # The covariance matrices of a chunk of chunk_size particles are built as one
+    # (chunk_size, n, n) array and Cholesky factorised together. With num_workers > 1
+    # the chunks are spread over that many processes.
+
+    tDatas = np.atleast_2d(tDatas)
+    chunks = [
+        tDatas[i : i + chunk_size] for i in range(0, np.shape(tDatas)[0], chunk_size)
+    ]
+    args = (xModel, xData, yModel, yData, tModel, sigmaY, nugget, lambda_e)
+    if num_workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(
+            max_workers=num_workers, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            futures = [
+                executor.submit(_chunkLogMarginalLikelihood, chunk, *args)
+                for chunk in chunks
+            ]
+            return np.concatenate([future.result() for future in futures])
+    return np.concatenate(
+        [_chunkLogMarginalLikelihood(chunk, *args) for chunk in chunks]
     )
-    xDatas = np.reshape(
-        np.repeat(xData, np.shape(yData)[0]), ((len(xData) * np.shape(yData)[0], 1))
+
+
+def _chunkLogMarginalLikelihood(
+    tDatas, xModel, xData, yModel, yData, tModel, sigmaY, nugget, lambda_e
+):
+
+    # training data of the first particle - only the calibration parameters of the
+    # data rows, and the lengthscale, differ between particles
+    xTraining, yTraining = mogpTraining(
+        xModel, xData, yModel, yData, tModel, tDatas[0, :]
     )
+    nModel = np.shape(yModel)[0] * len(xModel)
+    e1 = np.shape(tModel)[1]
 
-    # construct training data sets
-    xTrain = np.hstack((np.vstack((xModels, xDatas)), np.vstack((tModels, tDatas))))
-    yTrain = np.concatenate((yModels, yDatas))
+    # squared distances in coordinates and calibration parameters, before scaling by
+    # the lengthscale; the lengthscale column itself is the same for all rows
+    X = np.repeat(xTraining[np.newaxis, :, : 1 + e1], np.shape(tDatas)[0], axis=0)
+    X[:, nModel:, 1:] = tDatas[:, np.newaxis, :e1]
+    dists = np.sum((X[:, :, np.newaxis, :] - X[:, np.newaxis, :, :]) ** 2, axis=-1)
 
-    return (xTrain, yTrain)
+    # covariance matrices as in kernels.customRBF, plus the noise of fitGP
+    lengthscales = tDatas[:, -1]
+    K = (1 / lambda_e) * np.exp(
+        -0.5 * dists / lengthscales[:, np.newaxis, np.newaxis] ** 2
+    )
+    n = np.shape(K)[1]
+    noiseVector = np.concatenate(
+        (
+            np.ones(nModel) * nugget,
+            np.ones(np.shape(yData)[0] * len(xData)) * (sigmaY**2),
+        )
+    )
+    K[:, np.arange(n), np.arange(n)] = 1 + noiseVector
+
+    logLikelihoods = np.full(np.shape(tDatas)[0], -np.inf)
+    try:
+        L = np.linalg.cholesky(K)
+        ok = np.ones(np.shape(tDatas)[0], dtype=bool)
+    except np.linalg.LinAlgError:
+        # find the particles that fail, and factorise the rest
+        ok = np.array([np.all(np.linalg.eigvalsh(k) > 0) for k in K])
+        L = np.linalg.cholesky(K[ok])
+
+    # y^T K^-1 y = |L^-1 y|^2, and log det K = 2 sum log diag L
+    z = np.linalg.solve(
+        L, np.broadcast_to(yTraining, (np.shape(L)[0], n))[..., np.newaxis]
+    )
+    logLikelihoods[ok] = (
+        -0.5 * np.sum(z[..., 0] ** 2, axis=1)
+        - np.sum(np.log(np.diagonal(L, axis1=1, axis2=2)), axis=1)
+        - 0.5 * n * np.log(2 * np.pi)
+    )
+    return logLikelihoods
@@ -113,3 +113,51 @@ def test_data_clean_data():
     # compare columns
     for column in colnames_energy:
         assert energy_data[column].equals(energy_clean[column])
+
+
+def clean_env_data_rowwise(env_data):
+    """
+    The original, row-by-row implementation of the timestamp
+    snapping of clean_data.clean_env_data and the per-sensor
+    averaging of clean_data.hourly_average_sensor.
+    """
+    env_data = env_data.copy()
+    max_secs_from_the_hour = (
+        clean_data.processing_params["mins_from_the_hour"]
+        * clean_data.constants["secs_per_min"]
+    )
+    env_data["timedelta_in_secs"] = env_data["timestamp"].apply(
+        lambda x: abs((x - x.round(freq="H")).total_seconds())
+    )
+    env_data["timestamp_hour_plus_minus"] = env_data.apply(
+        lambda x: x["timestamp"].round(freq="H")
+        if x["timedelta_in_secs"] <= max_secs_from_the_hour
+        else None,
+        axis=1,
+    )
+    env_data = env_data.dropna(subset="timestamp_hour_plus_minus")
+    hour_averages = dict()
+    grouped = env_data.groupby("name")
+    for sensor in keys_clean:
+        hour_averages[sensor] = (
+            grouped.get_group(sensor)
+            .groupby("timestamp_hour_plus_minus", as_index=False)[
+                ["temperature", "humidity"]
+            ]
+            .mean()
+            .rename(columns={"timestamp_hour_plus_minus": "timestamp"})
+        )
+    return hour_averages
+
+
+def test_clean_env_data_rowwise():
+    """
+    Test that the vectorised timestamp snapping and averaging
+    give the same hourly averages as the row-by-row implementation.
+    """
+    env_raw = pd.read_pickle(data_path / "aranet_trh_raw.pkl")
+    expected = clean_env_data_rowwise(env_raw)
+    env_data, time_vector = clean_data.clean_env_data(env_raw.copy())
+    for sensor in keys_clean:
+        expected_sensor = pd.merge(time_vector, expected[sensor], how="left")
+        pd.testing.assert_frame_equal(env_data[sensor], expected_sensor)
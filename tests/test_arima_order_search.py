@@ -0,0 +1,127 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pathlib import Path
+
+import models.arima_python.arima.arima_pipeline as arima_pipeline
+import models.arima_python.arima.model_store as model_store
+import models.arima_python.arima.order_search as order_search
+
+# data
+data_path = Path(__file__).parent / "data/Models/ARIMA"
+
+# the airline dataset, see data_path / README.md for details
+dataset = pd.read_pickle(data_path / "airline_dataset_arima.pkl")
+airline_data = dataset["dataset"]["lnair"].iloc[dataset["train_index"]]
+
+
+@pytest.fixture()
+def search_settings(tmp_path, monkeypatch):
+    """
+    Search a small grid of orders around those of the airline
+    dataset, and keep the model states in a temporary directory.
+    """
+    monkeypatch.setitem(model_store.paths_config, "model_dir", str(tmp_path))
+    settings = {
+        "p_values": [0, 1, 2],
+        "d_values": [1],
+        "q_values": [0],
+        "seasonal_p_values": [0, 1],
+        "seasonal_d_values": [1],
+        "seasonal_q_values": [0],
+        "seasonal_period": 12,
+        "max_steps": 10,
+    }
+    for key, value in settings.items():
+        monkeypatch.setitem(order_search.search_config, key, value)
+    arima_settings = {
+        "arima_order": (0, 1, 0),
+        "seasonal_order": (0, 1, 0, 12),
+        "trend": [],
+        "alpha": 0.05,
+        "perform_cv": False,
+        "warm_start": False,
+        "use_selected_order": True,
+        "hours_forecast": 24 * 365,
+    }
+    for key, value in arima_settings.items():
+        monkeypatch.setitem(arima_pipeline.arima_config, key, value)
+
+
+def test_stepwise_neighbours(search_settings):
+    """
+    Test that the stepwise neighbours change one order
+    by one step in the candidate values.
+    """
+    neighbours = order_search.stepwise_neighbours(((1, 1, 0), (0, 1, 0, 12)))
+    assert sorted(neighbours) == [
+        ((0, 1, 0), (0, 1, 0, 12)),
+        ((1, 1, 0), (1, 1, 0, 12)),
+        ((2, 1, 0), (0, 1, 0, 12)),
+    ]
+
+
+@pytest.mark.parametrize("method", ["grid", "stepwise"])
+def test_search_orders(search_settings, monkeypatch, method):
+    """
+    Test that the order search finds the orders with the lowest
+    AIC, memoises the scores, and that the pipeline then uses the
+    selected orders for the sensor.
+    """
+    arima_config = dict(arima_pipeline.arima_config)
+    expected = {
+        orders: order_search.evaluate_orders(airline_data, orders, "aic", arima_config)
+        for orders in order_search.grid_candidates()
+    }
+    best, score = order_search.search_orders(
+        airline_data, "sensor", method=method, criterion="aic", num_workers=2
+    )
+    if method == "grid":
+        assert best == min(expected, key=expected.get)
+    assert np.isclose(score, expected[best])
+    state = model_store.load_model_state("sensor")
+    assert state["selected_order"]["arima_order"] == best[0]
+    assert state["selected_order"]["seasonal_order"] == best[1]
+
+    # searching the same data window again evaluates nothing
+    def evaluate_orders(*args):
+        raise AssertionError("the scores should be memoised")
+
+    monkeypatch.setattr(order_search, "evaluate_orders", evaluate_orders)
+    assert order_search.search_orders(
+        airline_data, "sensor", method=method, criterion="aic", num_workers=1
+    ) == (best, score)
+
+    # the pipeline uses the selected orders for the sensor, and only for it
+    mean_forecast = arima_pipeline.arima_pipeline(airline_data, "sensor")[0]
+    with arima_pipeline.arima_config_overrides(
+        {"arima_order": best[0], "seasonal_order": best[1]}
+    ):
+        expected_forecast = arima_pipeline.arima_pipeline(airline_data)[0]
+    assert np.allclose(mean_forecast, expected_forecast)
+    assert arima_pipeline.arima_config["arima_order"] == (0, 1, 0)
+
+
+def test_search_orders_during_pipeline(search_settings, monkeypatch):
+    """
+    Test that the orders selected while the pipeline runs for the
+    same sensor are not overwritten when the pipeline saves the
+    model state it loaded at the start of the run.
+    """
+    monkeypatch.setitem(arima_pipeline.arima_config, "warm_start", True)
+    fit_arima_warm = arima_pipeline.fit_arima_warm
+
+    def fit_arima_warm_during_search(*args):
+        # the order search finishes while the model is being fitted
+        order_search.search_orders(
+            airline_data, "sensor", method="grid", criterion="aic", num_workers=1
+        )
+        return fit_arima_warm(*args)
+
+    monkeypatch.setattr(arima_pipeline, "fit_arima_warm", fit_arima_warm_during_search)
+    arima_pipeline.arima_pipeline(airline_data, "sensor")
+    state = model_store.load_model_state("sensor")
+    assert "selected_order" in state
+    assert "order_search" in state
+    assert state["full_fit_timestamp"] == airline_data.index[-1]
+    assert state["arima_order"] == (0, 1, 0)
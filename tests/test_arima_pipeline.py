@@ -1,5 +1,7 @@
 import pandas as pd
 import models.arima_python.arima.arima_pipeline as arima_pipeline
+import models.arima_python.arima.model_store as model_store
+from models.arima_python.arima.sensor_executor import run_sensors
 from statsmodels.tsa.statespace.sarimax import SARIMAX, SARIMAXResultsWrapper
 import pandas as pd
 from sklearn.model_selection import TimeSeriesSplit
@@ -244,3 +246,115 @@ def test_arima_pipeline():
     with pytest.raises(ValueError):
         train_data.reset_index(drop=True, inplace=True)
         arima_pipeline.arima_pipeline(train_data)
+
+
+@pytest.mark.parametrize("num_workers", [1, 2])
+def test_run_sensors(num_workers, tmp_path, monkeypatch):
+    """
+    Test that running the pipeline for several sensors gives
+    the forecasts of running it for each sensor, and that a
+    sensor for which the pipeline fails does not stop the others.
+    """
+    monkeypatch.setitem(model_store.paths_config, "model_dir", str(tmp_path))
+    arima_pipeline.arima_config["perform_cv"] = False
+    train_data = airline_dataset["lnair"].iloc[train_index]
+    start_timestamp = airline_dataset["lnair"].iloc[train_index].index[-1]
+    end_timestamp = airline_dataset["lnair"].iloc[test_index].index[-1]
+    set_hours_forecast(start_timestamp, end_timestamp)
+    sensor_data = {
+        "sensor_1": train_data,
+        "sensor_2": train_data.reset_index(drop=True),  # not indexed by timestamp
+        "sensor_3": train_data * 2,
+    }
+    results = run_sensors(sensor_data, num_workers=num_workers)
+    assert list(results.keys()) == list(sensor_data.keys())
+    assert isinstance(results["sensor_2"], ValueError)
+    for sensor in ["sensor_1", "sensor_3"]:
+        mean_forecast, conf_int, metrics = results[sensor]
+        expected = arima_pipeline.arima_pipeline(sensor_data[sensor])
+        assert np.isclose(mean_forecast, expected[0]).all()
+        assert np.isclose(conf_int, expected[1]).all()
+        assert metrics is None
+
+
+def test_arima_pipeline_warm_start(tmp_path, monkeypatch):
+    """
+    Test that the model parameters of a sensor are kept
+    between runs of the pipeline, and fitted from scratch
+    again when the stored ones can't be used.
+    """
+    monkeypatch.setitem(model_store.paths_config, "model_dir", str(tmp_path))
+    monkeypatch.setitem(arima_pipeline.arima_config, "perform_cv", False)
+    monkeypatch.setitem(arima_pipeline.arima_config, "warm_start", True)
+    monkeypatch.setitem(arima_pipeline.arima_config, "warm_start_maxiter", 0)
+    monkeypatch.setitem(arima_pipeline.arima_config, "full_refit_hours", 24 * 365)
+    data = airline_dataset["lnair"]
+    first_data = data.iloc[train_index]
+    second_data = data.iloc[np.concatenate((train_index, test_index[:3]))]
+    set_hours_forecast(first_data.index[-1], data.index[-1])
+    # without a sensor name, nothing is stored
+    arima_pipeline.arima_pipeline(first_data)
+    assert model_store.load_model_state("Farm_T/RH_16B1") is None
+    # the first run fits the parameters from scratch
+    mean_forecast = arima_pipeline.arima_pipeline(first_data, "Farm_T/RH_16B1")[0]
+    state = model_store.load_model_state("Farm_T/RH_16B1")
+    model_fit = arima_pipeline.fit_arima(first_data)
+    assert np.allclose(state["params"], model_fit.params)
+    assert state["full_fit_timestamp"] == first_data.index[-1]
+    assert np.allclose(mean_forecast, airline_forecast["mean"], atol=1e-3)
+    # the next run filters the new data with the stored parameters
+    assert not arima_pipeline.needs_full_refit(second_data, state)
+    mean_forecast = arima_pipeline.arima_pipeline(second_data, "Farm_T/RH_16B1")[0]
+    expected = arima_pipeline.build_arima(second_data).filter(model_fit.params)
+    expected = expected.forecast(len(mean_forecast))
+    assert np.allclose(mean_forecast, expected)
+    assert np.allclose(
+        model_store.load_model_state("Farm_T/RH_16B1")["params"], state["params"]
+    )
+    # the parameters are fitted from scratch again when they
+    # are too old, or were fitted for a different model
+    monkeypatch.setitem(arima_pipeline.arima_config, "full_refit_hours", 1)
+    assert arima_pipeline.needs_full_refit(second_data, state)
+    monkeypatch.setitem(arima_pipeline.arima_config, "full_refit_hours", 24 * 365)
+    monkeypatch.setitem(arima_pipeline.arima_config, "arima_order", (1, 1, 0))
+    assert arima_pipeline.needs_full_refit(second_data, state)
+
+
+def test_arima_pipeline_unsaved_state(tmp_path, monkeypatch):
+    """
+    Test that the forecast of a sensor is still returned
+    when its model state cannot be saved.
+    """
+    not_a_dir = tmp_path / "file"
+    not_a_dir.write_text("")
+    monkeypatch.setitem(model_store.paths_config, "model_dir", str(not_a_dir / "dir"))
+    monkeypatch.setitem(arima_pipeline.arima_config, "perform_cv", False)
+    monkeypatch.setitem(arima_pipeline.arima_config, "warm_start", True)
+    data = airline_dataset["lnair"].iloc[train_index]
+    set_hours_forecast(data.index[-1], airline_dataset["lnair"].index[-1])
+    mean_forecast = arima_pipeline.arima_pipeline(data, "Farm_T/RH_16B1")[0]
+    assert np.allclose(mean_forecast, airline_forecast["mean"], atol=1e-3)
+    assert model_store.load_model_state("Farm_T/RH_16B1") is None
+
+
+def test_cross_validate_arima_parallel():
+    """
+    Test that the folds fitted independently in a pool of
+    processes give the metrics of fitting each fold from
+    scratch.
+    """
+    data = airline_dataset["lnair"]
+    tscv = arima_pipeline.construct_cross_validator(
+        data, train_fraction=0.7, n_splits=3
+    )
+    rmse = []
+    mape = []
+    for train_index_fold, test_index_fold in tscv.split(data):
+        rmse_fold, mape_fold = arima_pipeline.cross_validate_fold(
+            data.iloc[train_index_fold], data.iloc[test_index_fold]
+        )
+        rmse.append(rmse_fold)
+        mape.append(mape_fold)
+    metrics = arima_pipeline.cross_validate_arima(data, tscv, refit=True, num_workers=2)
+    assert np.isclose(np.mean(rmse), metrics["RMSE"], atol=1e-04)
+    assert np.isclose(np.mean(mape), metrics["MAPE"], atol=1e-04)
@@ -0,0 +1,203 @@
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+
+from core.batch_stats import (
+    fold_trh_readings_into_batch_stats,
+    rebuild_batch_trh_stats,
+)
+from core.db import session_close
+from core.ingress_hyper import bulk_insert_readings
+from core.lookups import refresh_location_lookups
+from core.queries import (
+    batch_list,
+    batch_trh_stats,
+    closest_trh_sensors,
+    grow_trh_aggregate,
+    latest_trh_locations,
+    propagate_trh_aggregate,
+    trh_with_vpd,
+)
+from core.structure import (
+    BatchTRHStatsClass,
+    LocationClass,
+    ReadingsAranetTRHClass,
+    SensorLocationClass,
+)
+from .conftest import check_for_docker
+
+DOCKER_RUNNING = check_for_docker()
+
+
+def get_live_stats(session):
+    """The grow and propagation T&RH statistics of all batches, computed from the
+    readings table.
+    """
+    batch_list_sq = batch_list(session).subquery("batch_list")
+    trh_q = trh_with_vpd(session)
+    grow_q = grow_trh_aggregate(
+        session,
+        batch_list_sq,
+        trh_q.subquery("trh"),
+        closest_trh_sensors(session).cte("closest_trh_sensors"),
+    )
+    propagate_q = propagate_trh_aggregate(
+        session,
+        batch_list_sq,
+        trh_q,
+        latest_trh_locations(session).cte("latest_trh_locations"),
+    )
+    return [
+        pd.read_sql(q.statement, session.bind).set_index("batch_id").sort_index()
+        for q in (grow_q, propagate_q)
+    ]
+
+
+def assert_stats_match_live(session):
+    for phase, live_df in zip(("grow", "propagate"), get_live_stats(session)):
+        stats_q = batch_trh_stats(session, phase)
+        stats_df = pd.read_sql(stats_q.statement, session.bind).set_index("batch_id")
+        # Batches with no readings have no row in the statistics table.
+        stats_df = stats_df.reindex(live_df.index)
+        pd.testing.assert_frame_equal(
+            stats_df[live_df.columns], live_df, check_dtype=False
+        )
+
+
+@pytest.mark.skipif(not DOCKER_RUNNING, reason="requires docker")
+def test_batch_trh_stats(session):
+    """
+    Test that the statistics table matches aggregating over the readings directly.
+    """
+    rebuild_batch_trh_stats(session)
+    assert_stats_match_live(session)
+    session_close(session)
+
+
+@pytest.mark.skipif(not DOCKER_RUNNING, reason="requires docker")
+def test_fold_trh_readings(session):
+    """
+    Test folding new readings into the statistics table.
+    """
+    rebuild_batch_trh_stats(session)
+    # Add readings during the grow phase of a batch, from its closest sensor.
+    batch_list_sq = batch_list(session).subquery()
+    closest_sq = closest_trh_sensors(session).subquery()
+    batch = session.execute(
+        session.query(batch_list_sq, closest_sq.c.sensor_id)
+        .join(closest_sq, closest_sq.c.location_id == batch_list_sq.c.location_id)
+        .filter(batch_list_sq.c.harvest_time.is_not(None))
+    ).first()
+    readings_df = pd.DataFrame(
+        {
+            "sensor_id": batch.sensor_id,
+            "timestamp": [
+                batch.transfer_time + timedelta(seconds=1),
+                batch.harvest_time - timedelta(seconds=1),
+            ],
+            "temperature": [40.0, -5.0],
+            "humidity": [99.0, 1.0],
+        }
+    )
+    engine = session.get_bind()
+    _, inserted_ids = bulk_insert_readings(
+        engine, ReadingsAranetTRHClass, readings_df, return_ids=True
+    )
+    assert len(inserted_ids) == 2
+    try:
+        fold_trh_readings_into_batch_stats(session, inserted_ids)
+        assert_stats_match_live(session)
+        stats_df = pd.read_sql(
+            batch_trh_stats(session, "grow").statement, session.bind
+        ).set_index("batch_id")
+        assert stats_df.loc[batch.batch_id, "max_temp"] == 40.0
+        assert stats_df.loc[batch.batch_id, "min_rh"] == 1.0
+    finally:
+        session.query(ReadingsAranetTRHClass).filter(
+            ReadingsAranetTRHClass.id.in_(inserted_ids)
+        ).delete(synchronize_session=False)
+        rebuild_batch_trh_stats(session)
+    session_close(session)
+
+
+@pytest.mark.skipif(not DOCKER_RUNNING, reason="requires docker")
+def test_fold_into_empty_stats(session):
+    """
+    Test that folding readings into an empty statistics table, as on a database that
+    predates it, seeds it from all the readings rather than only the new ones.
+    """
+    session.query(BatchTRHStatsClass).delete(synchronize_session=False)
+    session.commit()
+    reading = session.query(ReadingsAranetTRHClass).first()
+    readings_df = pd.DataFrame(
+        {
+            "sensor_id": [reading.sensor_id],
+            "timestamp": [reading.timestamp + timedelta(seconds=1)],
+            "temperature": [20.0],
+            "humidity": [50.0],
+        }
+    )
+    _, inserted_ids = bulk_insert_readings(
+        session.get_bind(), ReadingsAranetTRHClass, readings_df, return_ids=True
+    )
+    try:
+        fold_trh_readings_into_batch_stats(session, inserted_ids)
+        assert_stats_match_live(session)
+    finally:
+        session.query(ReadingsAranetTRHClass).filter(
+            ReadingsAranetTRHClass.id.in_(inserted_ids)
+        ).delete(synchronize_session=False)
+        rebuild_batch_trh_stats(session)
+    session_close(session)
+
+
+@pytest.mark.skipif(not DOCKER_RUNNING, reason="requires docker")
+def test_refresh_location_lookups_stats(session):
+    """
+    Test that refreshing the location lookups after moving a sensor recomputes the
+    statistics of the batches whose closest sensor changed, and only those.
+    """
+    rebuild_batch_trh_stats(session)
+
+    def get_row_ids():
+        return dict(
+            session.query(BatchTRHStatsClass.batch_id, BatchTRHStatsClass.id).filter(
+                BatchTRHStatsClass.phase == "grow"
+            )
+        )
+
+    row_ids = get_row_ids()
+    # Move a T&RH sensor outside the propagation zone to another location outside it,
+    # so that the propagation sensors stay the same.
+    trh_locations_sq = latest_trh_locations(session).subquery()
+    sensor_id, location_id = (
+        session.query(trh_locations_sq.c.sensor_id, trh_locations_sq.c.location_id)
+        .join(LocationClass, LocationClass.id == trh_locations_sq.c.location_id)
+        .filter(LocationClass.zone != "Propagation")
+        .first()
+    )
+    new_location_id = (
+        session.query(LocationClass.id)
+        .filter(LocationClass.zone != "Propagation", LocationClass.id != location_id)
+        .first()[0]
+    )
+    sensor_location = SensorLocationClass(
+        sensor_id=sensor_id,
+        location_id=new_location_id,
+        installation_date=datetime.now(),
+    )
+    session.add(sensor_location)
+    try:
+        refresh_location_lookups(session)
+        assert_stats_match_live(session)
+        new_row_ids = get_row_ids()
+        # The batches far from both locations keep their statistics.
+        assert any(
+            new_row_ids.get(batch_id) == row_id for batch_id, row_id in row_ids.items()
+        )
+    finally:
+        session.delete(sensor_location)
+        refresh_location_lookups(session)
+    assert_stats_match_live(session)
+    session_close(session)
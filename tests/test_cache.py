@@ -0,0 +1,104 @@
+import time
+
+import pytest
+
+from core.cache import BaseCache, FileCache, MemoryCache, RedisCache, make_cache
+
+
+class FakeRedis:
+    """The subset of the redis client interface used by RedisCache, ignoring expiry."""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def scan_iter(self, match):
+        prefix = match.rstrip("*")
+        return [key for key in list(self.data) if key.startswith(prefix)]
+
+
+def check_cache(cache):
+    assert cache.get("a") is None
+    cache.set("a", {"x": [1, 2, 3]})
+    assert cache.get("a") == {"x": [1, 2, 3]}
+    calls = []
+    compute = lambda: calls.append(1) or "computed"
+    assert cache.get_or_set("b", compute) == "computed"
+    assert cache.get_or_set("b", compute) == "computed"
+    assert len(calls) == 1
+    cache.delete("a")
+    assert cache.get("a") is None
+    cache.clear()
+    assert cache.get("b") is None
+
+
+def test_memory_cache():
+    check_cache(MemoryCache())
+
+
+def test_file_cache(tmp_path):
+    check_cache(FileCache(directory=str(tmp_path)))
+    # Entries are shared between instances using the same directory.
+    FileCache(directory=str(tmp_path)).set("shared", 1)
+    assert FileCache(directory=str(tmp_path)).get("shared") == 1
+
+
+def test_redis_cache():
+    client = FakeRedis()
+    check_cache(RedisCache(client=client))
+    RedisCache(client=client, prefix="other:").set("a", 1)
+    RedisCache(client=client).clear()
+    assert RedisCache(client=client, prefix="other:").get("a") == 1
+
+
+def test_cache_expiry(tmp_path):
+    for cache in (MemoryCache(ttl=0.05), FileCache(directory=str(tmp_path), ttl=0.05)):
+        cache.set("a", 1)
+        cache.set("b", 2, ttl=60)
+        assert cache.get("a") == 1
+        time.sleep(0.1)
+        assert cache.get("a") is None
+        assert cache.get("b") == 2
+
+
+def test_memory_cache_eviction():
+    cache = MemoryCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    # Using "a" makes "b" the least recently used entry.
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+
+
+def test_incomplete_backend():
+    """A backend that doesn't implement the whole interface can't be created."""
+
+    class IncompleteCache(BaseCache):
+        def get(self, key):
+            return None
+
+        def set(self, key, value, ttl=None):
+            pass
+
+    with pytest.raises(TypeError):
+        IncompleteCache()
+    with pytest.raises(TypeError):
+        BaseCache()
+
+
+def test_make_cache(tmp_path):
+    assert isinstance(make_cache("memory", max_entries=10), MemoryCache)
+    assert isinstance(make_cache("file", directory=str(tmp_path)), FileCache)
+    with pytest.raises(ValueError):
+        make_cache("nonexistent")
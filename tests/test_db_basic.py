@@ -8,6 +8,9 @@ from core.constants import SQL_TEST_CONNECTION_STRING, SQL_TEST_DBNAME
 from core.db import (
     connect_db,
     check_database_structure,
+    dispose_engine,
+    session_open,
+    session_close,
 )
 
 from .conftest import check_for_docker
@@ -39,3 +42,25 @@ def test_check_database_structure():
 
     good, log = check_database_structure(engine)
     assert good, log
+
+
+@pytest.mark.skipif(not DOCKER_RUNNING, reason="requires docker")
+def test_engine_registry():
+
+    # Connecting twice to the same db gives the same engine, and hence the same pool.
+    status, log, engine1 = connect_db(SQL_TEST_CONNECTION_STRING, SQL_TEST_DBNAME)
+    assert status, log
+    status, log, engine2 = connect_db(SQL_TEST_CONNECTION_STRING, SQL_TEST_DBNAME)
+    assert status, log
+    assert engine1 is engine2
+
+    session = session_open(engine1)
+    assert session.bind is engine1
+    session_close(session)
+
+    # After disposal, a new engine is created on the next connection.
+    assert dispose_engine(SQL_TEST_CONNECTION_STRING, SQL_TEST_DBNAME)
+    assert not dispose_engine(SQL_TEST_CONNECTION_STRING, SQL_TEST_DBNAME)
+    status, log, engine3 = connect_db(SQL_TEST_CONNECTION_STRING, SQL_TEST_DBNAME)
+    assert status, log
+    assert engine3 is not engine1
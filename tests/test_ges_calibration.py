@@ -0,0 +1,208 @@
+import os
+import sys
+
+import numpy as np
+
+# functionsV2 imports the inversion package as a top level package.
+sys.path.append(os.path.join("models", "ges"))
+
+# The following import needs to be 'core' not 'cropcore' in order to
+# find the test data, which is not copied to site-packages.
+from core.constants import CONST_TESTDATA_GES_FOLDER
+from models.ges.ges.climate import ClimateSeries
+from models.ges.ges.functionsV2 import (
+    IncrementalSimulation,
+    derivatives,
+    priorPPF,
+    sat_conc,
+)
+from models.ges.inversion import calibration, utils
+
+PARAMETERS = np.array([[1, 0.1], [4, 0.4], [10, 0.85]])
+
+
+def relative_humidity(results):
+    return results[11, -1] / sat_conc(results[1, -1])
+
+
+def test_incremental_simulation():
+    """
+    The incremental simulation starts with, and respins to, the full simulation of a
+    window, and stays close to it in between.
+    """
+    weather = ClimateSeries.from_csv(
+        os.path.join(CONST_TESTDATA_GES_FOLDER, "WeatherV1.csv")
+    )
+    window_hours = 48
+    simulation = IncrementalSimulation(
+        PARAMETERS, weather, 12.0, respin_steps=3, num_workers=1
+    )
+    for step, h2 in enumerate(range(100, 125, 3)):
+        h1 = h2 - window_hours + 1
+        results = simulation.run(h1, h2)
+        expected = derivatives(h1, h2, PARAMETERS, weather, 12.0, num_workers=1)
+        assert np.array_equal(simulation.checkpoints[h2], results[:, -1, :])
+        if step % 4 == 0:
+            assert np.array_equal(results, expected)
+        else:
+            assert np.allclose(
+                relative_humidity(results), relative_humidity(expected), atol=0.01
+            )
+
+
+def test_batch_log_marginal_likelihood():
+    """
+    The batched log marginal likelihoods are those of the GPs that fitGP fits, at the
+    lengthscale of each particle, also when split into chunks.
+    """
+    np.random.seed(0)
+    xModel = np.array([0.5])
+    xData = np.array([0.0, 0.5, 1.0])
+    tModel = np.random.uniform(0, 1, (12, 2))
+    yModel = np.random.normal(0, 1, (12, 1))
+    yData = np.random.normal(0, 1, (1, 3))
+    particles = np.array([priorPPF() for _ in range(50)])
+    args = (xModel, xData, yModel, yData, tModel)
+
+    batched = utils.batchLogMarginalLikelihood(
+        *args, particles, 0.5, 1e-9, 1, chunk_size=20
+    )
+    expected = [
+        utils.fitGP(*args, particle, 0.5, 1e-9, 1).log_marginal_likelihood(
+            np.log([particle[-1]])
+        )
+        for particle in particles
+    ]
+    assert np.allclose(batched, expected, rtol=0, atol=1e-8)
+
+
+def test_metropolis_hastings_prior_draws():
+    """
+    Metropolis-Hastings draws from the prior once, to estimate its moments, and once
+    for the start of the chain, rather than at every iteration.
+    """
+
+    def run(niter):
+        np.random.seed(0)
+        num_draws = []
+
+        def prior():
+            num_draws.append(1)
+            return np.array(
+                [np.random.normal(0.5, 0.1), np.exp(np.random.normal(0, 0.5))]
+            )
+
+        cal = calibration.calibrate(prior, 0.5, 1e-9)
+        cal.updateCoordinates(np.array([0.5]), np.array([0.0, 0.5, 1.0]))
+        cal.updateTrainingData(
+            np.linspace(0, 1, 6)[:, np.newaxis],
+            np.sin(np.linspace(0, 3, 6))[:, np.newaxis],
+            np.array([[0.2, 0.4, 0.3]]),
+        )
+        cal.metropolisHastings(niter, 0.1, logConstraint=np.array([0, 1]), burn=5)
+        return cal, len(num_draws)
+
+    cal, num_draws = run(20)
+    assert np.shape(cal.posteriorSamples) == (16, 2)
+    assert np.all(cal.posteriorSamples[:, 1] > 0)
+    # the number of draws does not grow with the number of iterations
+    assert num_draws == run(40)[1]
+    means, sds = cal.priorMoments(np.array([0, 1]))
+    assert np.allclose(means, [0.5, 0], atol=0.01)
+    assert np.allclose(sds, [0.1, 0.5], atol=0.01)
+
+
+def test_chain_diagnostics():
+    """
+    Independent draws have an R-hat of about 1 and an effective sample size of about
+    the number of draws, and chains around different means have a large R-hat.
+    """
+    np.random.seed(0)
+    chains = np.random.normal(0, 1, (4, 500, 2))
+    assert np.allclose(utils.splitRhat(chains), 1, atol=0.01)
+    assert np.allclose(utils.effectiveSampleSize(chains), 2000, rtol=0.15)
+
+    chains[0, :, 0] += 5
+    assert utils.splitRhat(chains)[0] > 1.5
+    assert utils.splitRhat(chains)[1] < 1.01
+
+
+def test_parallel_metropolis_hastings():
+    """
+    The chains of the parallel Metropolis-Hastings sampler are independent, can be
+    reproduced from the seed, and stop once the diagnostics pass.
+    """
+
+    def run(maxiter, min_ess):
+        np.random.seed(0)
+        cal = calibration.calibrate(
+            lambda: np.array(
+                [np.random.normal(0.5, 0.1), np.exp(np.random.normal(0, 0.5))]
+            ),
+            0.5,
+            1e-9,
+        )
+        cal.updateCoordinates(np.array([0.5]), np.array([0.0, 0.5, 1.0]))
+        cal.updateTrainingData(
+            np.linspace(0, 1, 6)[:, np.newaxis],
+            np.sin(np.linspace(0, 3, 6))[:, np.newaxis],
+            np.array([[0.2, 0.4, 0.3]]),
+        )
+        cal.parallelMetropolisHastings(
+            3,
+            maxiter,
+            0.1,
+            logConstraint=np.array([0, 1]),
+            burn=5,
+            check_every=10,
+            rhat_threshold=np.inf,
+            min_ess=min_ess,
+            num_workers=1,
+            seed=1,
+        )
+        return cal
+
+    cal = run(30, np.inf)
+    assert np.shape(cal.chains) == (3, 26, 2)
+    assert np.shape(cal.posteriorSamples) == (78, 2)
+    assert not np.array_equal(cal.chains[0], cal.chains[1])
+    assert np.array_equal(cal.chains, run(30, np.inf).chains)
+
+    cal = run(1000, 0)
+    assert np.shape(cal.chains) == (3, 6, 2)
+
+
+def test_mogp_training():
+    """
+    The training data of mogpTraining are those built row by row, and filling a
+    reused template gives the same training data for each tData.
+    """
+    np.random.seed(0)
+    xModel = np.array([0.25, 0.75])
+    xData = np.array([0.0, 0.5, 1.0])
+    tModel = np.random.uniform(0, 1, (5, 2))
+    yModel = np.random.normal(0, 1, (5, 2))
+    yData = np.random.normal(0, 1, (2, 3))
+    template = utils.mogpTrainingTemplate(xModel, xData, yModel, yData, tModel)
+
+    for tData in np.random.uniform(0, 1, (3, 3)):
+        tModels = np.vstack(
+            [np.hstack((row, tData[-1:])) for row in tModel for _ in xModel]
+        )
+        expectedX = np.hstack(
+            (
+                np.concatenate((np.repeat(xModel, 5), np.repeat(xData, 2)))[
+                    :, np.newaxis
+                ],
+                np.vstack((tModels, np.tile(tData, (6, 1)))),
+            )
+        )
+        expectedY = np.concatenate((np.ravel(yModel), np.ravel(yData)))
+
+        xTrain, yTrain = utils.mogpTraining(xModel, xData, yModel, yData, tModel, tData)
+        assert np.array_equal(xTrain, expectedX)
+        assert np.array_equal(yTrain, expectedY)
+
+        utils.fillMogpTraining(template[0], tData, 10)
+        assert np.array_equal(template[0], expectedX)
+        assert np.array_equal(template[1], expectedY)
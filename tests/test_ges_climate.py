@@ -0,0 +1,96 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# The following import needs to be 'core' not 'cropcore' in order to
+# find the test data, which is not copied to site-packages.
+from core.constants import CONST_TESTDATA_GES_FOLDER
+
+from models.ges.ges.climate import ClimateSeries, scenario_climate
+
+
+def hourly_weather(num_hours):
+    hours = np.arange(num_hours)
+    return pd.DataFrame(
+        {
+            "DateTime": pd.date_range("2023-01-01", periods=num_hours, freq="H"),
+            "T_e": 10 + 5 * np.sin(2 * np.pi * hours / 24),
+            "RH_e": 70 + 10 * np.cos(2 * np.pi * hours / 24),
+        }
+    )
+
+
+def test_climate_series_window():
+    """
+    A window is the interpolation of the readings in it at every 10 minutes, and a
+    view of the interpolated series.
+    """
+    weather = hourly_weather(100)
+    weather.loc[50, "T_e"] = np.nan
+    series = ClimateSeries.from_dataframe(weather)
+    h1, h2 = 40, 70
+    window = series.window(h1, h2)
+    assert window.shape == ((h2 - h1) * 6 + 1, 2)
+    assert np.shares_memory(window, series.climate)
+
+    temperature = weather["T_e"].to_numpy()[h1 : h2 + 1]
+    temperature[10] = (temperature[9] + temperature[11]) / 2
+    expected = np.interp(
+        np.arange(len(window)) / 6, np.arange(h2 - h1 + 1), temperature
+    )
+    assert np.allclose(window[:, 0], expected)
+    assert series.timestamps[h1 * 6 + 1] == np.datetime64("2023-01-02T16:10:00")
+
+
+def previous_climterp_linear(h1, h2, weather):
+    """
+    The interpolation of the external temperature in functionsV2 before ClimateSeries,
+    which put rows h1..h2 on a fixed 10 day time axis, whatever h2 - h1.
+    """
+    temperature = np.array(weather["T_e"][h1 : h2 + 1], dtype=np.float64)
+    t = np.linspace(0, 864000 - 3600, h2 - h1 + 1)
+    mult = np.linspace(0, 864000, int(1 + 864000 / 600))
+    return np.interp(mult, t, temperature)
+
+
+def test_calibration_window_matches_previous():
+    """
+    For the 10 day windows of the calibration, h2 - h1 = 239, the previous time axis
+    was hourly too, and the window agrees with it up to hour h2. For other lengths the
+    previous axis was stretched or squashed to 10 days, and the window now keeps the
+    readings an hour apart.
+    """
+    filepath_weather = os.path.join(CONST_TESTDATA_GES_FOLDER, "WeatherV1.csv")
+    weather = pd.read_csv(filepath_weather, names=["DateTime", "T_e", "RH_e"])
+    series = ClimateSeries.from_csv(filepath_weather)
+    for h2 in [239, 300, 480]:
+        h1 = h2 - (10 * 24 - 1)
+        window = series.window(h1, h2)
+        previous = previous_climterp_linear(h1, h2, weather)
+        assert np.allclose(window[:, 0], previous[: len(window)], rtol=0, atol=1e-12)
+
+    h1, h2 = 240, 480
+    window = series.window(h1, h2)
+    previous = previous_climterp_linear(h1, h2, weather)
+    assert len(window) == len(previous)
+    assert not np.allclose(window[:, 0], previous)
+    hourly = weather["T_e"].to_numpy()[h1 : h2 + 1]
+    assert np.allclose(window[::6, 0], hourly)
+
+
+def test_scenario_climate():
+    """
+    The scenario climate is the historical weather followed by the part of the
+    forecast after it, and is memoised.
+    """
+    filepath_weather = os.path.join(CONST_TESTDATA_GES_FOLDER, "WeatherV1.csv")
+    filepath_forecast = os.path.join(CONST_TESTDATA_GES_FOLDER, "WeatherForecastV1.csv")
+    climate = scenario_climate(0, 480, 20, filepath_weather, filepath_forecast)
+    historical = ClimateSeries.from_csv(filepath_weather)
+    forecast = ClimateSeries.from_csv(filepath_forecast)
+    num_new = np.sum(forecast.timestamps > historical.timestamps[-1])
+    assert climate.shape == (480 * 6 + 1 + num_new, 2)
+    assert np.array_equal(climate[: 480 * 6 + 1], historical.climate[-(480 * 6 + 1) :])
+    assert np.array_equal(climate[480 * 6 + 1 :], forecast.climate[-num_new:])
+    assert scenario_climate(0, 480, 20, filepath_weather, filepath_forecast) is climate
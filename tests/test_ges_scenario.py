@@ -5,6 +5,9 @@ import numpy as np
 import pandas as pd
 
 from models.ges.ges.ges_utils import get_latest_time_hour_value, get_scenarios_by_id
+from models.ges.ges.scenario_executor import solve_scenarios, solve_scenarios_batched
+from models.ges.ges.functions_scenarioV1 import model as ges_model, sat_conc
+from models.ges.ges.model_kernel import JAC_SPARSITY, NUMBA_AVAILABLE, model_rhs
 
 from models.ges.TestScenarioV1_1 import (
     getTimeParameters,
@@ -180,3 +183,181 @@ def test_run_scenarios(session):
     assert "T_air" in results.keys()
     # 2nd dim of results array should be 6 (3 BAU + 3 test scenarios)
     assert results["T_air"].shape == (312, 6)
+
+
+def relaxation_model(t, z, climate, rate):
+    """Relax towards the climate temperature, as a cheap stand-in for the GES model."""
+    n = min(int(t // 600), len(climate) - 1)
+    return rate * (climate[n, 0] - z)
+
+
+def test_solve_scenarios_parallel():
+    climate = np.column_stack((np.linspace(280.0, 300.0, 145), np.full(145, 50.0)))
+    t_span = [0, 86400]
+    t_eval = np.linspace(0, 86400, 25)
+    scenario_args = [(rate,) for rate in (1e-5, 1e-4, 1e-3)]
+    results_serial = solve_scenarios(
+        relaxation_model, climate, t_span, [290.0], t_eval, scenario_args, num_workers=1
+    )
+    results_parallel = solve_scenarios(
+        relaxation_model, climate, t_span, [290.0], t_eval, scenario_args, num_workers=2
+    )
+    assert results_serial.shape == (1, 25, 3)
+    assert np.array_equal(results_serial, results_parallel)
+
+
+def ges_model_args(num_slots=20):
+    """Arguments of the GES model after climate, for 48 hours from h1 = 0."""
+    slot_starts = np.arange(3, 3 * num_slots, 3)
+    return (
+        np.linspace(1, 10, num_slots) / 3600,
+        np.linspace(0.1, 0.8, num_slots),
+        slot_starts,
+        0,
+        48,
+        np.arange(num_slots) % 3,
+        np.linspace(-3, 3, num_slots),
+        12.0,
+    )
+
+
+GES_Z0 = [293, 295, 297, 297, 297, 293, 295, 292, 291, 289, 287, 0.012]
+
+
+def test_ges_model_is_stateless():
+    """
+    The right-hand side of the GES model should only depend on t and z, and not on
+    which times it was evaluated at before, e.g. by solver steps that were rejected.
+    """
+    climate = np.column_stack((np.full(1000, 10.0), np.full(1000, 70.0)))
+    args = ges_model_args()
+    z = GES_Z0
+    t_early, t_late = 1.9 * 3600, 2.1 * 3600
+    before = ges_model(t_early, z, climate, *args)
+    after_late = ges_model(t_late, z, climate, *args)
+    after = ges_model(t_early, z, climate, *args)
+    assert np.array_equal(before, after)
+    assert not np.array_equal(before, after_late)
+
+
+def kernel_climate():
+    """A sinusoidal external temperature over 49 hours, for the model kernel tests."""
+    hours = np.arange(49 * 6) / 6
+    return np.column_stack(
+        (10 + 5 * np.sin(2 * np.pi * hours / 24), np.full(len(hours), 70.0))
+    )
+
+
+def assert_model_matches_python(model, climate):
+    """
+    model should give the same right-hand side as the reference implementation, and
+    the same T_air and RH_air when solved over 48 hours.
+    """
+    args = ges_model_args()
+    z = np.array(GES_Z0, dtype=np.float64)
+    for t in (0.0, 3600.5, 40000.0, 100000.0):
+        assert np.allclose(model(t, z, climate, *args), ges_model(t, z, climate, *args))
+
+    t_span = [0, 48 * 3600]
+    t_eval = np.linspace(0, 48 * 3600, 49)
+    results = {
+        name: solve_scenarios(
+            rhs, climate, t_span, GES_Z0, t_eval, [args], num_workers=1
+        )[:, :, 0]
+        for name, rhs in (("python", ges_model), ("kernel", model))
+    }
+    for name, y in results.items():
+        results[name] = {"T_air": y[1], "RH_air": y[11] / sat_conc(y[1])}
+    assert np.allclose(
+        results["kernel"]["T_air"], results["python"]["T_air"], rtol=0, atol=1e-2
+    )
+    assert np.allclose(
+        results["kernel"]["RH_air"], results["python"]["RH_air"], rtol=0, atol=1e-3
+    )
+
+
+def test_model_kernel_logic_matches_python():
+    """
+    The model kernel, run as plain Python, should give the same T_air and RH_air as
+    the reference implementation. This runs with or without Numba.
+    """
+    assert_model_matches_python(
+        getattr(model_rhs, "py_func", model_rhs), kernel_climate()
+    )
+
+
+def test_model_kernel_compiled_matches_python():
+    """
+    The right-hand side compiled with Numba should give the same T_air and RH_air as
+    the reference implementation.
+    """
+    pytest.importorskip("numba")
+    assert NUMBA_AVAILABLE
+    assert hasattr(model_rhs, "py_func")
+    assert_model_matches_python(model_rhs, kernel_climate())
+
+
+def test_model_kernel_jac_sparsity():
+    """Every non-zero entry of a finite difference Jacobian is in JAC_SPARSITY."""
+    climate = np.column_stack((np.full(1000, 10.0), np.full(1000, 70.0)))
+    args = ges_model_args()
+    z = np.array(GES_Z0, dtype=np.float64)
+    t = 5000.0
+    f0 = model_rhs(t, z, climate, *args)
+    for j in range(len(z)):
+        dz = np.zeros(len(z))
+        dz[j] = 1e-6 * max(abs(z[j]), 1e-3)
+        column = model_rhs(t, z + dz, climate, *args) - f0
+        assert not np.any(column[~JAC_SPARSITY[:, j]])
+        assert np.any(column[JAC_SPARSITY[:, j]])
+
+
+def test_solve_scenarios_batched():
+    """
+    Solving the scenarios as one batched system gives the same T_air and RH_air as
+    solving them separately, to within the tolerance of the solver.
+    """
+    hours = np.arange(49 * 6) / 6
+    climate = np.column_stack(
+        (10 + 5 * np.sin(2 * np.pi * hours / 24), np.full(len(hours), 70.0))
+    )
+    ACH, ias, slot_starts, h1, h2, ndh, lshift, latest_hour = ges_model_args()
+    # Three scenarios, with more ventilation and more dehumidifiers in the last two.
+    ACH = np.column_stack((ACH, 2 * ACH, ACH))
+    ias = np.column_stack((ias, ias, ias))
+    ndh = np.column_stack((ndh, ndh, np.full(len(ndh), 2)))
+    lshift = np.column_stack((lshift, lshift, lshift))
+    scenario_args = [
+        (
+            ACH[:, i],
+            ias[:, i],
+            slot_starts,
+            h1,
+            h2,
+            ndh[:, i],
+            lshift[:, i],
+            latest_hour,
+        )
+        for i in range(3)
+    ]
+    batched_args = (ACH, ias, slot_starts, h1, h2, ndh, lshift, latest_hour)
+    t_span = [0, 48 * 3600]
+    t_eval = np.linspace(0, 48 * 3600, 49)
+    results_separate = solve_scenarios(
+        ges_model, climate, t_span, GES_Z0, t_eval, scenario_args, num_workers=1
+    )
+    results_batched = solve_scenarios_batched(
+        ges_model,
+        climate,
+        t_span,
+        GES_Z0,
+        t_eval,
+        batched_args,
+        3,
+        jac_sparsity=JAC_SPARSITY,
+    )
+    assert results_batched.shape == results_separate.shape == (12, 49, 3)
+    T_air = [y[1] for y in (results_batched, results_separate)]
+    RH_air = [y[11] / sat_conc(y[1]) for y in (results_batched, results_separate)]
+    assert np.allclose(*T_air, rtol=0, atol=0.1)
+    assert np.allclose(*RH_air, rtol=0, atol=0.01)
@@ -4,12 +4,43 @@ Test ingress_hyper.py module
 import os
 import json
 import re
+import threading
+import time
 from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
 import pandas as pd
+import pytest
 import requests
 import requests_mock
-from core.ingress_hyper import get_api_sensor_data, READINGS_DICTS
-from core.constants import CONST_TESTDATA_ENVIRONMENT_FOLDER
+from sqlalchemy.exc import IntegrityError
+from core.ingress_hyper import (
+    backfill_hyper_data,
+    bulk_insert_readings,
+    fetch_hyper_metrics,
+    hyper_watermark_name,
+    get_api_sensor_data,
+    import_hyper_data,
+    import_hyper_metric,
+    READINGS_DICTS,
+)
+from core.constants import (
+    CONST_TESTDATA_ENVIRONMENT_FOLDER,
+    SQL_TEST_CONNECTION_STRING,
+    SQL_TEST_DBNAME,
+)
+from core.db import connect_db, session_open, session_close
+from core.structure import (
+    SensorClass,
+    ReadingsAranetTRHClass,
+    ReadingsRollupClass,
+    DataWatermarkClass,
+)
+from core.watermarks import get_watermark
+
+from .conftest import check_for_docker
+
+DOCKER_RUNNING = check_for_docker()
 
 
 DUMMY_API_KEY = "dummy"
@@ -107,3 +138,361 @@ def test_get_irrigation_api_data():
             assert "WaterOxygen" in v.columns
             assert "WaterTurbidity" in v.columns
             assert "WaterPeroxide" in v.columns
+
+
+@pytest.mark.skipif(not DOCKER_RUNNING, reason="requires docker")
+def test_import_trh_bulk():
+    # Register one of the sensors in the mock data with the CROP database.
+    aranet_pro_id = "1052066"
+    status, log, engine = connect_db(SQL_TEST_CONNECTION_STRING, SQL_TEST_DBNAME)
+    assert status, log
+    session = session_open(engine)
+    sensor = SensorClass(
+        type_id=1,
+        device_id="hyper_bulk_test",
+        name="Farm_T/RH_16B2",
+        aranet_pro_id=aranet_pro_id,
+    )
+    session.add(sensor)
+    session.commit()
+    sensor_id = sensor.id
+    session_close(session)
+
+    def count_readings():
+        session = session_open(engine)
+        count = (
+            session.query(ReadingsAranetTRHClass)
+            .filter(ReadingsAranetTRHClass.sensor_id == sensor_id)
+            .count()
+        )
+        session_close(session)
+        return count
+
+    readings_dict = READINGS_DICTS[0]
+    try:
+        with requests_mock.Mocker() as m:
+            m.get(requests_mock.ANY, json=MOCK_TRH_DATA)
+            success, error, dfs = get_api_sensor_data(
+                DUMMY_API_KEY, DT_FROM, DT_TO, readings_dict["columns"]
+            )
+            num_expected = len(dfs[aranet_pro_id].dropna())
+            for _ in range(2):
+                # The second import should only find duplicates.
+                success, error = import_hyper_metric(
+                    engine,
+                    DT_FROM,
+                    DT_TO,
+                    readings_dict["readings_class"],
+                    readings_dict["columns"],
+                    readings_dict["sensor_type"],
+                    SQL_TEST_CONNECTION_STRING,
+                    bulk=True,
+                )
+                assert success, error
+                assert count_readings() == num_expected
+    finally:
+        session = session_open(engine)
+        session.query(ReadingsAranetTRHClass).filter(
+            ReadingsAranetTRHClass.sensor_id == sensor_id
+        ).delete()
+        session.query(ReadingsRollupClass).filter(
+            ReadingsRollupClass.sensor_id == sensor_id
+        ).delete()
+        session.query(SensorClass).filter(SensorClass.id == sensor_id).delete()
+        session_close(session)
+
+
+@pytest.mark.skipif(not DOCKER_RUNNING, reason="requires docker")
+def test_bulk_insert_readings_failed_batch():
+    """
+    Test that no readings are committed if a batch fails, and that the error of the
+    batch is raised.
+    """
+    status, log, engine = connect_db(SQL_TEST_CONNECTION_STRING, SQL_TEST_DBNAME)
+    assert status, log
+    session = session_open(engine)
+    sensor = SensorClass(type_id=1, device_id="hyper_bulk_rollback_test")
+    session.add(sensor)
+    session.commit()
+    sensor_id = sensor.id
+    session_close(session)
+    # The second batch refers to a sensor that doesn't exist.
+    readings_df = pd.DataFrame(
+        {
+            "sensor_id": [sensor_id, -1],
+            "timestamp": [DT_FROM, DT_FROM],
+            "temperature": [20.0, 20.0],
+            "humidity": [50.0, 50.0],
+        }
+    )
+    try:
+        with pytest.raises(IntegrityError):
+            bulk_insert_readings(
+                engine, ReadingsAranetTRHClass, readings_df, batch_size=1
+            )
+        session = session_open(engine)
+        assert (
+            session.query(ReadingsAranetTRHClass)
+            .filter(ReadingsAranetTRHClass.sensor_id == sensor_id)
+            .count()
+            == 0
+        )
+        session_close(session)
+    finally:
+        session = session_open(engine)
+        session.query(ReadingsAranetTRHClass).filter(
+            ReadingsAranetTRHClass.sensor_id == sensor_id
+        ).delete()
+        session.query(SensorClass).filter(SensorClass.id == sensor_id).delete()
+        session_close(session)
+
+
+# Mock data to serve from the stub server, keyed by the first metric in the request.
+STUB_DATA = {
+    "aranet_ambient_temperature": MOCK_TRH_DATA,
+    "aranet_co2": MOCK_CO2_DATA,
+    "aranet_current": MOCK_AIRVELOCITY_DATA,
+    "aegis_ii_temperature": MOCK_IRRIGATION_DATA,
+}
+STUB_DELAY = 0.5
+
+
+@pytest.fixture()
+def hyper_stub_server():
+    """A local HTTP server that serves the mock Hyper data after a delay. The first
+    server.num_failures requests for each metric fail with a 503, as do requests for
+    (metric, start_time) pairs in server.failing_requests. All requests are recorded in
+    server.requests as (metric, start_time) pairs, and the largest number of requests
+    that were being served at once in server.max_in_flight.
+    """
+    num_requests = {}
+    in_flight_lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            params = parse_qs(urlparse(self.path).query)
+            metric = params["metrics"][0].split(",")[0]
+            start_time = params["start_time"][0]
+            self.server.requests.append((metric, start_time))
+            num_requests[metric] = num_requests.get(metric, 0) + 1
+            if (
+                num_requests[metric] <= self.server.num_failures
+                or (metric, start_time) in self.server.failing_requests
+            ):
+                self.send_response(503)
+                self.end_headers()
+                return
+            with in_flight_lock:
+                self.server.in_flight += 1
+                self.server.max_in_flight = max(
+                    self.server.max_in_flight, self.server.in_flight
+                )
+            try:
+                time.sleep(self.server.delay)
+            finally:
+                with in_flight_lock:
+                    self.server.in_flight -= 1
+            body = json.dumps(STUB_DATA[metric]).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.num_failures = 0
+    server.failing_requests = set()
+    server.requests = []
+    server.in_flight = 0
+    server.max_in_flight = 0
+    server.delay = STUB_DELAY
+    server.url = f"http://127.0.0.1:{server.server_port}/device_metrics"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_fetch_hyper_metrics_concurrently(hyper_stub_server):
+    results = list(
+        fetch_hyper_metrics(
+            DUMMY_API_KEY, DT_FROM, DT_TO, READINGS_DICTS, url=hyper_stub_server.url
+        )
+    )
+    assert len(results) == len(READINGS_DICTS)
+    for readings_dict, success, error, dfs in results:
+        assert success, error
+        assert len(dfs) > 0
+        for v in dfs.values():
+            for column in readings_dict["columns"]:
+                assert column["df_name"] in v.columns
+    # The requests run concurrently, so the server was serving several at once.
+    assert hyper_stub_server.max_in_flight > 1
+
+
+def test_fetch_hyper_metrics_retry(hyper_stub_server):
+    hyper_stub_server.num_failures = 1
+    results = list(
+        fetch_hyper_metrics(
+            DUMMY_API_KEY,
+            DT_FROM,
+            DT_TO,
+            READINGS_DICTS,
+            url=hyper_stub_server.url,
+            backoff_factor=0,
+        )
+    )
+    assert all(success for _, success, _, _ in results)
+
+    # Without retries, failures are reported.
+    hyper_stub_server.num_failures = 100
+    results = list(
+        fetch_hyper_metrics(
+            DUMMY_API_KEY,
+            DT_FROM,
+            DT_TO,
+            READINGS_DICTS[:1],
+            url=hyper_stub_server.url,
+            max_retries=0,
+        )
+    )
+    _, success, error, _ = results[0]
+    assert not success
+    assert "503" in error
+
+
+@pytest.mark.skipif(not DOCKER_RUNNING, reason="requires docker")
+def test_import_hyper_data_stub_server(hyper_stub_server):
+    success, error = import_hyper_data(
+        SQL_TEST_CONNECTION_STRING,
+        SQL_TEST_DBNAME,
+        DT_FROM,
+        DT_TO,
+        url=hyper_stub_server.url,
+    )
+    assert success, error
+
+
+@pytest.mark.skipif(not DOCKER_RUNNING, reason="requires docker")
+def test_backfill_hyper_data(hyper_stub_server):
+    hyper_stub_server.delay = 0
+    status, log, engine = connect_db(SQL_TEST_CONNECTION_STRING, SQL_TEST_DBNAME)
+    dt_from = datetime(2022, 7, 12)
+    dt_to = datetime(2022, 7, 15)
+    trh_metric = READINGS_DICTS[0]["columns"][0]["api_name"]
+    fetch_kwargs = {
+        "url": hyper_stub_server.url,
+        "max_retries": 0,
+        "chunk_size": timedelta(days=1),
+    }
+
+    def get_watermarks(job_name):
+        session = session_open(engine)
+        watermarks = [
+            get_watermark(session, hyper_watermark_name(readings_dict, job_name))
+            for readings_dict in READINGS_DICTS
+        ]
+        session_close(session)
+        return watermarks
+
+    def requests_for(metric):
+        return [r for r in hyper_stub_server.requests if r[0] == metric]
+
+    try:
+        # A full backfill requests every day for every metric.
+        success, error = backfill_hyper_data(
+            SQL_TEST_CONNECTION_STRING,
+            SQL_TEST_DBNAME,
+            dt_from=dt_from,
+            dt_to=dt_to,
+            job_name="test_backfill",
+            **fetch_kwargs,
+        )
+        assert success, error
+        assert len(hyper_stub_server.requests) == 3 * len(READINGS_DICTS)
+        assert get_watermarks("test_backfill") == [dt_to] * len(READINGS_DICTS)
+
+        # Running again only requests the overlap before the watermark.
+        hyper_stub_server.requests.clear()
+        success, error = backfill_hyper_data(
+            SQL_TEST_CONNECTION_STRING,
+            SQL_TEST_DBNAME,
+            dt_to=dt_to,
+            job_name="test_backfill",
+            **fetch_kwargs,
+        )
+        assert success, error
+        assert len(hyper_stub_server.requests) == len(READINGS_DICTS)
+
+        # If the second day fails for T&RH, its watermark stays after the first day.
+        hyper_stub_server.requests.clear()
+        hyper_stub_server.failing_requests.add((trh_metric, "2022-07-13T00:00:00Z"))
+        success, error = backfill_hyper_data(
+            SQL_TEST_CONNECTION_STRING,
+            SQL_TEST_DBNAME,
+            dt_from=dt_from,
+            dt_to=dt_to,
+            job_name="test_backfill_fail",
+            **fetch_kwargs,
+        )
+        assert not success
+        assert len(requests_for(trh_metric)) == 2
+        watermarks = get_watermarks("test_backfill_fail")
+        assert watermarks[0] == datetime(2022, 7, 13)
+        assert watermarks[1:] == [dt_to] * (len(READINGS_DICTS) - 1)
+
+        # Resuming continues T&RH from its watermark.
+        hyper_stub_server.requests.clear()
+        hyper_stub_server.failing_requests.clear()
+        success, error = backfill_hyper_data(
+            SQL_TEST_CONNECTION_STRING,
+            SQL_TEST_DBNAME,
+            dt_to=dt_to,
+            job_name="test_backfill_fail",
+            **fetch_kwargs,
+        )
+        assert success, error
+        assert requests_for(trh_metric)[0][1] == "2022-07-12T23:00:00Z"
+        assert len(requests_for(trh_metric)) == 3
+        assert get_watermarks("test_backfill_fail") == [dt_to] * len(READINGS_DICTS)
+
+        # With max_chunks, a run stops after that many chunks, and the next run
+        # continues from the watermarks.
+        hyper_stub_server.requests.clear()
+        success, error = backfill_hyper_data(
+            SQL_TEST_CONNECTION_STRING,
+            SQL_TEST_DBNAME,
+            dt_from=dt_from,
+            dt_to=dt_to,
+            max_chunks=2,
+            job_name="test_backfill_max_chunks",
+            **fetch_kwargs,
+        )
+        assert success, error
+        assert len(hyper_stub_server.requests) == 2 * len(READINGS_DICTS)
+        watermarks = get_watermarks("test_backfill_max_chunks")
+        assert watermarks == [datetime(2022, 7, 14)] * len(READINGS_DICTS)
+        hyper_stub_server.requests.clear()
+        success, error = backfill_hyper_data(
+            SQL_TEST_CONNECTION_STRING,
+            SQL_TEST_DBNAME,
+            dt_to=dt_to,
+            max_chunks=2,
+            job_name="test_backfill_max_chunks",
+            **fetch_kwargs,
+        )
+        assert success, error
+        # From the overlap before the watermark to dt_to is just over a day.
+        assert len(hyper_stub_server.requests) == 2 * len(READINGS_DICTS)
+        watermarks = get_watermarks("test_backfill_max_chunks")
+        assert watermarks == [dt_to] * len(READINGS_DICTS)
+    finally:
+        session = session_open(engine)
+        session.query(DataWatermarkClass).filter(
+            DataWatermarkClass.name.like("test_backfill%")
+        ).delete(synchronize_session=False)
+        session_close(session)
@@ -12,6 +12,8 @@ from core.queries import (
     location_distances,
     sensor_distances,
     closest_trh_sensors,
+    closest_trh_sensors_live,
+    latest_sensor_locations_live,
     first_batch_event_time,
     batch_events_by_type,
     trh_with_vpd,
@@ -24,7 +26,8 @@ from core.queries import (
     batch_list_with_trh,
     batch_list,
 )
-from core.structure import ReadingsAranetTRHClass
+from core.lookups import refresh_location_lookups
+from core.structure import ReadingsAranetTRHClass, SensorLocationClass
 from .conftest import check_for_docker
 
 DOCKER_RUNNING = check_for_docker()
@@ -91,6 +94,53 @@ def test_closest_trh(session):
     session_close(session)
 
 
+@pytest.mark.skipif(not DOCKER_RUNNING, reason="requires docker")
+def test_location_lookups(session):
+    """
+    Test that the materialised location lookups match the live queries, and are
+    updated when they are refreshed after a sensor location is added.
+    """
+
+    def get_rows(query):
+        return sorted(tuple(row) for row in session.execute(query).fetchall())
+
+    def assert_lookups_match():
+        assert get_rows(latest_sensor_locations(session)) == get_rows(
+            latest_sensor_locations_live(session)
+        )
+        assert get_rows(closest_trh_sensors(session)) == get_rows(
+            closest_trh_sensors_live(session)
+        )
+
+    assert_lookups_match()
+    # Move a T&RH sensor to a new location.
+    trh_location = session.execute(latest_trh_locations(session)).first()
+    sensor_id, location_id = trh_location.sensor_id, trh_location.location_id
+    new_location_id = next(
+        row.location_id
+        for row in session.execute(closest_trh_sensors(session)).fetchall()
+        if row.location_id != location_id
+    )
+    sensor_location = SensorLocationClass(
+        sensor_id=sensor_id,
+        location_id=new_location_id,
+        installation_date=datetime.now(),
+    )
+    session.add(sensor_location)
+    session.commit()
+    try:
+        # The lookups don't change before they are refreshed.
+        assert get_rows(latest_sensor_locations(session)) != get_rows(
+            latest_sensor_locations_live(session)
+        )
+        refresh_location_lookups(session)
+        assert_lookups_match()
+    finally:
+        session.delete(sensor_location)
+        refresh_location_lookups(session)
+    session_close(session)
+
+
 @pytest.mark.skipif(not DOCKER_RUNNING, reason="requires docker")
 def test_first_batch_event_time(session):
     """
@@ -0,0 +1,185 @@
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from core.db import session_close
+from core.ingress_hyper import bulk_insert_readings
+from core.queries import readings_rollup, rollup_granularity, trh_with_vpd
+from core.rollups import refresh_rollups, rollup_watermark_name
+from core.structure import (
+    DataWatermarkClass,
+    ReadingsAranetTRHClass,
+    ReadingsRollupClass,
+)
+from core.watermarks import get_watermark
+from .conftest import check_for_docker
+
+DOCKER_RUNNING = check_for_docker()
+
+
+def test_rollup_granularity():
+    assert rollup_granularity(timedelta(days=7)) == "day"
+    assert rollup_granularity(timedelta(days=1)) == "day"
+    assert rollup_granularity(timedelta(hours=6)) == "hour"
+    assert rollup_granularity(timedelta(minutes=10)) is None
+
+
+def get_raw_means(session, dt_from, dt_to, freq):
+    query = trh_with_vpd(session).filter(
+        ReadingsAranetTRHClass.timestamp >= dt_from,
+        ReadingsAranetTRHClass.timestamp <= dt_to,
+    )
+    df = pd.read_sql(query.statement, session.bind)
+    df["timestamp"] = df["timestamp"].dt.floor(freq)
+    return (
+        df.groupby(["sensor_id", "timestamp"])[["temperature", "humidity", "vpd"]]
+        .agg(["mean", "count"])
+        .sort_index()
+    )
+
+
+def get_rollup_means(session, dt_from, dt_to, resolution):
+    query = readings_rollup(
+        session,
+        ReadingsAranetTRHClass,
+        ["temperature", "humidity", "vpd"],
+        dt_from,
+        dt_to,
+        resolution=resolution,
+    )
+    return (
+        pd.read_sql(query.statement, session.bind)
+        .set_index(["sensor_id", "timestamp"])
+        .sort_index()
+    )
+
+
+@pytest.mark.skipif(not DOCKER_RUNNING, reason="requires docker")
+def test_readings_rollup(session):
+    """
+    Test that the hourly and daily rollups match aggregating the readings directly.
+    """
+    refresh_rollups(session, ReadingsAranetTRHClass)
+    latest = session.query(ReadingsAranetTRHClass.timestamp).order_by(
+        ReadingsAranetTRHClass.timestamp.desc()
+    )[0][0]
+    dt_to = latest.replace(hour=0, minute=0, second=0, microsecond=0)
+    dt_from = dt_to - timedelta(days=3)
+    for resolution, freq in ((timedelta(hours=1), "H"), (timedelta(days=1), "D")):
+        # Only compare whole buckets.
+        raw_df = get_raw_means(
+            session, dt_from, dt_to - timedelta(microseconds=1), freq
+        )
+        rollup_df = get_rollup_means(
+            session, dt_from, dt_to - timedelta(microseconds=1), resolution
+        )
+        assert len(rollup_df) > 0
+        assert len(rollup_df) == len(raw_df)
+        for column in ("temperature", "humidity", "vpd"):
+            assert np.allclose(rollup_df[column], raw_df[(column, "mean")])
+            assert (rollup_df[f"{column}_count"] == raw_df[(column, "count")]).all()
+    session_close(session)
+
+
+@pytest.mark.skipif(not DOCKER_RUNNING, reason="requires docker")
+def test_first_refresh_rolls_up_history(session):
+    """
+    Test that the first refresh of a rollup covers the readings from before dt_from,
+    as on a database that has readings from before the rollups.
+    """
+    refresh_rollups(session, ReadingsAranetTRHClass)
+    session.query(ReadingsRollupClass).filter(
+        ReadingsRollupClass.readings_table == ReadingsAranetTRHClass.__tablename__
+    ).delete(synchronize_session=False)
+    session.query(DataWatermarkClass).filter(
+        DataWatermarkClass.name.in_(
+            [
+                rollup_watermark_name(ReadingsAranetTRHClass, granularity)
+                for granularity in ("hour", "day")
+            ]
+        )
+    ).delete(synchronize_session=False)
+    session.commit()
+    latest = session.query(ReadingsAranetTRHClass.timestamp).order_by(
+        ReadingsAranetTRHClass.timestamp.desc()
+    )[0][0]
+    dt_to = latest.replace(hour=0, minute=0, second=0, microsecond=0)
+    # The first refresh after ingesting readings from the last day only.
+    refresh_rollups(session, ReadingsAranetTRHClass, dt_from=dt_to)
+    dt_from = dt_to - timedelta(days=3)
+    for resolution, freq in ((timedelta(hours=1), "H"), (timedelta(days=1), "D")):
+        raw_df = get_raw_means(
+            session, dt_from, dt_to - timedelta(microseconds=1), freq
+        )
+        rollup_df = get_rollup_means(
+            session, dt_from, dt_to - timedelta(microseconds=1), resolution
+        )
+        assert len(rollup_df) > 0
+        assert len(rollup_df) == len(raw_df)
+        assert np.allclose(rollup_df["temperature"], raw_df[("temperature", "mean")])
+    session_close(session)
+
+
+@pytest.mark.skipif(not DOCKER_RUNNING, reason="requires docker")
+def test_refresh_rollups_incremental(session):
+    """
+    Test that new readings, including ones older than the watermark, are rolled up.
+    """
+    refresh_rollups(session, ReadingsAranetTRHClass)
+    watermark = get_watermark(
+        session, rollup_watermark_name(ReadingsAranetTRHClass, "hour")
+    )
+    sensor_id = session.query(ReadingsAranetTRHClass.sensor_id).first()[0]
+    # One reading after the watermark, and one that arrives late, two days before it.
+    readings_df = pd.DataFrame(
+        {
+            "sensor_id": sensor_id,
+            "timestamp": [
+                watermark + timedelta(hours=2, seconds=1),
+                watermark - timedelta(days=2, seconds=1),
+            ],
+            "temperature": [100.0, -100.0],
+            "humidity": [50.0, 50.0],
+        }
+    )
+    engine = session.get_bind()
+    _, inserted_ids = bulk_insert_readings(
+        engine, ReadingsAranetTRHClass, readings_df, return_ids=True
+    )
+    try:
+        refresh_rollups(
+            session, ReadingsAranetTRHClass, dt_from=readings_df["timestamp"].min()
+        )
+        assert (
+            get_watermark(
+                session, rollup_watermark_name(ReadingsAranetTRHClass, "hour")
+            )
+            == readings_df["timestamp"].max().to_pydatetime()
+        )
+        for timestamp in readings_df["timestamp"]:
+            rollup_df = get_rollup_means(
+                session, timestamp, timestamp, timedelta(hours=1)
+            ).loc[sensor_id]
+            raw_df = get_raw_means(
+                session,
+                timestamp.floor("H"),
+                timestamp.floor("H") + timedelta(hours=1, microseconds=-1),
+                "H",
+            ).loc[sensor_id]
+            assert np.allclose(
+                rollup_df["temperature"], raw_df[("temperature", "mean")]
+            )
+            assert (
+                rollup_df["temperature_count"] == raw_df[("temperature", "count")]
+            ).all()
+    finally:
+        session.query(ReadingsAranetTRHClass).filter(
+            ReadingsAranetTRHClass.id.in_(inserted_ids)
+        ).delete(synchronize_session=False)
+        session.commit()
+        refresh_rollups(
+            session, ReadingsAranetTRHClass, dt_from=readings_df["timestamp"].min()
+        )
+    session_close(session)
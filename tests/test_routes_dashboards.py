@@ -2,8 +2,26 @@
 Test the routes that show dashboards
 """
 
+from datetime import datetime, timedelta
+
+import pandas as pd
 import pytest
 
+from app.dashboards.routes import (
+    lights_on_analysis,
+    resample,
+    temperature_range_analysis,
+    ventilation_analysis,
+)
+from util_scripts.benchmark_dashboards import (
+    date_range,
+    energy_readings,
+    lights_on_analysis_loop,
+    temperature_range_analysis_loop,
+    trh_hourly_means,
+    trh_readings,
+    ventilation_analysis_loop,
+)
 from .conftest import check_for_docker
 
 DOCKER_RUNNING = check_for_docker()
@@ -85,3 +103,50 @@ def test_dashboard_timeseries(client):
         '<button style="margin-top: 5px" type="button" onclick="requestTimeSeries(true)">Download</button>'
         in html_content
     )
+
+
+def test_resample():
+    bins = [0.0, 20.0, 25.0, 144.0]
+    dt_from = datetime(2022, 1, 1)
+    dt_to = datetime(2022, 1, 3) + timedelta(days=1, milliseconds=-1)
+    df = pd.DataFrame(
+        {
+            "date": pd.to_datetime(["2022-01-01", "2022-01-01", "2022-01-03"]),
+            "temp_bin": ["(0.0, 20.0]", "(25.0, 144.0]", "(0.0, 20.0]"],
+            "temp_cnt": [3, 21, 24],
+        }
+    )
+    bins_list, df_list = resample(df, bins, dt_from, dt_to)
+    assert bins_list == ["(0.0, 20.0]", "(20.0, 25.0]", "(25.0, 144.0]"]
+    dates = pd.date_range("2022-01-01", "2022-01-03", freq="D")
+    for df_bin, counts in zip(df_list, ([3, 0, 24], [0, 0, 0], [21, 0, 0])):
+        assert list(df_bin.columns) == ["date", "temp_cnt"]
+        assert (df_bin["date"] == dates).all()
+        assert df_bin["temp_cnt"].to_list() == counts
+
+
+def test_energy_analysis_unchanged():
+    """
+    Test that the energy analyses match their previous, row-by-row implementations.
+    """
+    df = energy_readings(60)
+    dt_from, dt_to = date_range(30)
+    pd.testing.assert_frame_equal(
+        lights_on_analysis(df, dt_from, dt_to),
+        lights_on_analysis_loop(df, dt_from, dt_to),
+    )
+    pd.testing.assert_frame_equal(
+        ventilation_analysis(df), ventilation_analysis_loop(df)
+    )
+
+
+def test_temperature_range_analysis_unchanged():
+    """
+    Test that the temperature range analysis of hourly means, as read from the hourly
+    rollups, matches its previous, row-by-row implementation on the readings.
+    """
+    df = trh_readings(30, 4)
+    dt_from, dt_to = date_range(40)
+    assert temperature_range_analysis(
+        trh_hourly_means(df), dt_from, dt_to
+    ) == temperature_range_analysis_loop(df, dt_from, dt_to)
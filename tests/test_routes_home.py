@@ -2,6 +2,7 @@
 Test the homepage renders OK
 """
 
+import datetime as dt
 import re
 import pytest
 
@@ -61,3 +62,27 @@ def test_homepage_logged_in(client):
     assert '<canvas id="horizontal_temp_stratification"></canvas>' in html_content
     # check we have the warnings section
     assert "<h2>Alerts <small></small></h2>" in html_content
+
+
+@pytest.mark.skipif(not DOCKER_RUNNING, reason="requires docker")
+def test_homepage_cached(app, client):
+    from app.home.routes import index_cache_key
+
+    response = client.post(
+        "/login",
+        data={"username": "testuser", "password": "test", "login": "login"},
+    )
+    assert response.status_code == 302
+    cache = app.extensions["crop_cache"]
+    cache.clear()
+    response = client.get("/home/index")
+    assert response.status_code == 200
+    with app.app_context():
+        key = index_cache_key(dt.datetime.now(dt.timezone.utc))
+    data = cache.get(key)
+    assert data is not None
+    assert "temperature_data" in data
+    # A second load renders the same page from the cache.
+    response_cached = client.get("/home/index")
+    assert response_cached.status_code == 200
+    assert response_cached.data == response.data
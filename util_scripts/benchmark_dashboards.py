@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+"""
+Script that times the data processing of the analysis dashboards on synthetic data,
+comparing it with the row-by-row implementations it replaced.
+
+Run from the root of the repository, e.g.
+    python util_scripts/benchmark_dashboards.py --days 90 --sensors 12
+
+The row-by-row implementations are kept here, and tests/test_routes_dashboards.py
+checks the current ones against them.
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+from datetime import datetime, timedelta
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from cropcore.generate_synthetic_data import (
+    generate_energy_readings,
+    generate_trh_readings,
+)
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "webapp"))
+from app.dashboards.routes import (
+    SENSOR_CATEORIES,
+    TEMP_BINS,
+    lights_on_analysis,
+    resample,
+    temperature_range_analysis,
+    ventilation_analysis,
+)
+
+
+def resample_loop(df, bins, dt_from, dt_to):
+    """The previous implementation of dashboards.routes.resample, for comparison, with
+    pd.concat in place of the removed DataFrame.append.
+    """
+    bins_list = []
+    for i in range(len(bins) - 1):
+        bins_list.append("(%.1f, %.1f]" % (bins[i], bins[i + 1]))
+    date_min = min(df["date"].min(), dt_from)
+    date_max = max(df["date"].max(), dt_to)
+    for n in range(int((date_max - date_min).days) + 1):
+        day = date_min + timedelta(n)
+        for temp_range in bins_list:
+            if len(df[(df["date"] == day) & (df["temp_bin"] == temp_range)].index) == 0:
+                df2 = pd.DataFrame(
+                    {"date": [day], "temp_bin": [temp_range], "temp_cnt": [0]}
+                )
+                df = pd.concat([df, df2])
+    df = df.sort_values(by=["date", "temp_bin"], ascending=True)
+    df.reset_index(inplace=True, drop=True)
+    df_list = []
+    for bin_range in bins_list:
+        df_bin = df[df["temp_bin"] == bin_range]
+        del df_bin["temp_bin"]
+        df_bin.reset_index(inplace=True, drop=True)
+        df_list.append(df_bin)
+    return bins_list, df_list
+
+
+def lights_on_analysis_loop(df, dt_from_, dt_to_):
+    """The previous implementation of dashboards.routes.lights_on_analysis, for
+    comparison.
+    """
+    d_from = pd.to_datetime(dt_from_.date())
+    d_to = pd.to_datetime(dt_to_.date())
+    col_ec = "electricity_consumption"
+    lights_on_cols = []
+    if df.empty:
+        return pd.DataFrame({"date": [], "mean_lights_on": []})
+    energy_hour = (
+        df.groupby(
+            by=[
+                df["timestamp"].map(
+                    lambda x: pd.to_datetime(
+                        "%04d-%02d-%02d-%02d" % (x.year, x.month, x.day, x.hour),
+                        format="%Y-%m-%d-%H",
+                    )
+                ),
+            ]
+        )["electricity_consumption"]
+        .sum()
+        .reset_index()
+    )
+    energy_hour.loc[
+        energy_hour["timestamp"].dt.hour < 15, "energy_date"
+    ] = pd.to_datetime((energy_hour["timestamp"] + timedelta(days=-1)).dt.date)
+    energy_hour.loc[
+        energy_hour["timestamp"].dt.hour >= 15, "energy_date"
+    ] = pd.to_datetime(energy_hour["timestamp"].dt.date)
+    energy_hour["lights_on_1"] = energy_hour["timestamp"].apply(
+        lambda x: 1 if (x.hour >= 17 or x.hour < 10) else 0
+    )
+    lights_on_cols.append("lights_on_1")
+    energy_hour["lights_on_3"] = energy_hour[col_ec].apply(
+        lambda x: 1 if (x > 30.0) else 0
+    )
+    lights_on_cols.append("lights_on_3")
+    energy_hour["dE"] = energy_hour[col_ec] - energy_hour[col_ec].shift(1)
+    energy_hour["dE"] = energy_hour["dE"].fillna(0.0)
+    energy_hour["dE_min"] = energy_hour.groupby("energy_date")["dE"].transform("min")
+    energy_hour["dE_max"] = energy_hour.groupby("energy_date")["dE"].transform("max")
+    energy_hour.loc[
+        np.isclose(energy_hour["dE_max"], energy_hour["dE"]), "lights_on_4"
+    ] = 1
+    energy_hour.loc[
+        np.isclose(energy_hour["dE_min"], energy_hour["dE"]), "lights_on_4"
+    ] = 0
+    prev_row_value = None
+    for df_index in energy_hour.index:
+        if df_index > 0:
+            if np.isnan(energy_hour.loc[df_index, "lights_on_4"]) and not np.isnan(
+                prev_row_value
+            ):
+                energy_hour.loc[df_index, "lights_on_4"] = prev_row_value
+        prev_row_value = energy_hour.loc[df_index, "lights_on_4"]
+    lights_on_cols.append("lights_on_4")
+    energy_hour["energy_date_mean"] = energy_hour.groupby("energy_date")[
+        col_ec
+    ].transform("mean")
+    energy_hour["lights_on_5"] = np.where(
+        (energy_hour[col_ec] > 30.0)
+        & (energy_hour[col_ec] > 0.9 * energy_hour["energy_date_mean"]),
+        1,
+        0,
+    )
+    lights_on_cols.append("lights_on_5")
+    energy_date_df = energy_hour.loc[
+        (energy_hour["energy_date"] >= d_from) & (energy_hour["energy_date"] <= d_to)
+    ]
+    energy_date_df = (
+        energy_date_df.groupby(by=["energy_date"])[lights_on_cols].sum().reset_index()
+    )
+    energy_date_df["mean_lights_on"] = energy_date_df[lights_on_cols].sum(axis=1) / len(
+        lights_on_cols
+    )
+    energy_date_df["date"] = energy_date_df["energy_date"].dt.strftime("%Y-%m-%d")
+    return energy_date_df[["date", "mean_lights_on"]]
+
+
+def ventilation_analysis_loop(df):
+    """The previous implementation of dashboards.routes.ventilation_analysis, for
+    comparison.
+    """
+    if df.empty:
+        return pd.DataFrame({"timestamp": [], "ach": []})
+    energy_hour = (
+        df.groupby(
+            by=[
+                df["timestamp"].map(
+                    lambda x: "%04d-%02d-%02d %02d:00"
+                    % (x.year, x.month, x.day, x.hour)
+                ),
+            ]
+        )["electricity_consumption"]
+        .sum()
+        .reset_index()
+    )
+    energy_hour["ach"] = (
+        energy_hour["electricity_consumption"] / 2.39 * 3600.0 / (20337.0 / 2.0)
+    )
+    return energy_hour[["timestamp", "ach"]]
+
+
+def temperature_range_analysis_loop(temp_df, dt_from, dt_to):
+    """The previous implementation of dashboards.routes.temperature_range_analysis,
+    for comparison.
+    """
+    df = temp_df.copy()
+    df_unique_sensors = df[["sensor_id", "name"]].drop_duplicates(["sensor_id", "name"])
+    sensor_ids = df_unique_sensors["sensor_id"].tolist()
+    sensor_names = df_unique_sensors["name"].tolist()
+    df["date"] = pd.to_datetime(df["timestamp"].dt.date)
+    data_by_sensor_id = {}
+    for sensor_name, sensor_id in zip(sensor_names, sensor_ids):
+        df_sensor = df[df["sensor_id"] == sensor_id]
+        sensor_grp = df_sensor.groupby(
+            by=[
+                df_sensor.timestamp.map(
+                    lambda x: "%04d-%02d-%02d-%02d" % (x.year, x.month, x.day, x.hour)
+                ),
+                "date",
+            ]
+        )
+        sensor_grp_temp = sensor_grp["temperature"].mean().reset_index()
+        bins = TEMP_BINS[SENSOR_CATEORIES[sensor_id]]
+        sensor_grp_temp["temp_bin"] = pd.cut(sensor_grp_temp["temperature"], bins)
+        sensor_grp_temp["temp_bin"] = sensor_grp_temp["temp_bin"].astype(str)
+        sensor_grp_date = sensor_grp_temp.groupby(by=["date", "temp_bin"])
+        sensor_cnt = sensor_grp_date["temperature"].count().reset_index()
+        sensor_cnt.rename(columns={"temperature": "temp_cnt"}, inplace=True)
+        bins_list, df_list = resample_loop(sensor_cnt, bins, dt_from, dt_to)
+        data_by_sensor_id[sensor_id] = {
+            "name": sensor_name,
+            "bins": bins_list,
+            "data": [
+                {
+                    "date": df["date"].dt.strftime("%Y-%m-%d").to_list(),
+                    "count": df["temp_cnt"].to_list(),
+                }
+                for df in df_list
+            ],
+        }
+    return len(data_by_sensor_id.keys()), json.dumps(data_by_sensor_id)
+
+
+def energy_readings(num_days):
+    """Synthetic half-hourly energy readings of one sensor."""
+    df = generate_energy_readings(sensor_ids=[1], days=num_days)
+    return df[["timestamp", "electricity_consumption"]].reset_index(drop=True)
+
+
+def trh_readings(num_days, num_sensors):
+    """Synthetic T&RH readings, from sensors that the dashboards know how to bin."""
+    sensor_ids = sorted(SENSOR_CATEORIES)[:num_sensors]
+    df = generate_trh_readings(sensor_ids=sensor_ids)
+    df = df[df["timestamp"] >= df["timestamp"].max() - timedelta(days=num_days)]
+    df["name"] = "sensor " + df["sensor_id"].astype(str)
+    return df.reset_index(drop=True)
+
+
+def trh_hourly_means(df):
+    """Hourly mean temperatures of T&RH readings, as in the hourly rollups that
+    dashboards.routes.aranet_trh_analysis reads.
+    """
+    hourly = df.groupby(["sensor_id", "name", df["timestamp"].dt.floor("H")])
+    return hourly["temperature"].mean().reset_index()
+
+
+def date_range(num_days):
+    """A date range of num_days days up to today, as parsed from dashboard URLs."""
+    dt_to = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    dt_from = dt_to - timedelta(days=num_days)
+    dt_to += timedelta(days=1, milliseconds=-1)
+    return dt_from, dt_to
+
+
+def time_function(function, repeat):
+    """The shortest time in seconds of repeat calls of function."""
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+def trh_bin_counts(num_days, num_sensors, bins):
+    """Daily counts of hourly mean temperatures in each bin, per sensor, as computed in
+    dashboards.routes.aranet_trh_analysis, for synthetic readings.
+    """
+    df = generate_trh_readings(sensor_ids=list(range(1, num_sensors + 1)))
+    df = df[df["timestamp"] >= df["timestamp"].max() - timedelta(days=num_days)]
+    df["date"] = pd.to_datetime(df["timestamp"].dt.date)
+    df["hour"] = df["timestamp"].dt.floor("H")
+    hourly = df.groupby(["sensor_id", "hour", "date"])["temperature"].mean()
+    hourly = hourly.reset_index()
+    hourly["temp_bin"] = pd.cut(hourly["temperature"], bins).astype(str)
+    counts = hourly.groupby(["sensor_id", "date", "temp_bin"])["temperature"].count()
+    counts = counts.rename("temp_cnt").reset_index()
+    return [
+        df_sensor.drop(columns="sensor_id")
+        for _, df_sensor in counts.groupby("sensor_id")
+    ]
+
+
+def benchmark_resample(num_days, num_sensors, repeat):
+    bins = TEMP_BINS["MidFarm"]
+    sensor_counts = trh_bin_counts(num_days, num_sensors, bins)
+    dt_from, dt_to = date_range(num_days)
+    for name, function in (("loop", resample_loop), ("vectorised", resample)):
+        seconds = time_function(
+            lambda: [function(df, bins, dt_from, dt_to) for df in sensor_counts],
+            repeat,
+        )
+        print(f"resample, {name}: {seconds:.4f} s")
+
+
+def benchmark_energy(num_days, repeat):
+    df = energy_readings(num_days)
+    dt_from, dt_to = date_range(num_days)
+    for name, function in (
+        ("loop", lights_on_analysis_loop),
+        ("vectorised", lights_on_analysis),
+    ):
+        seconds = time_function(lambda: function(df, dt_from, dt_to), repeat)
+        print(f"lights_on_analysis, {name}: {seconds:.4f} s")
+    for name, function in (
+        ("loop", ventilation_analysis_loop),
+        ("vectorised", ventilation_analysis),
+    ):
+        seconds = time_function(lambda: function(df), repeat)
+        print(f"ventilation_analysis, {name}: {seconds:.4f} s")
+
+
+def benchmark_temperature_range(num_days, num_sensors, repeat):
+    df = trh_readings(num_days, num_sensors)
+    hourly_df = trh_hourly_means(df)
+    dt_from, dt_to = date_range(num_days)
+    for name, function, function_df in (
+        ("loop", temperature_range_analysis_loop, df),
+        ("vectorised, from hourly means", temperature_range_analysis, hourly_df),
+    ):
+        seconds = time_function(lambda: function(function_df, dt_from, dt_to), repeat)
+        print(f"temperature_range_analysis, {name}: {seconds:.4f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the dashboard data processing")
+    parser.add_argument("--days", type=int, default=90, help="length of date range")
+    parser.add_argument("--sensors", type=int, default=12, help="number of sensors")
+    parser.add_argument(
+        "--energy_days", type=int, default=365, help="length of energy date range"
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="number of repeats")
+    args = parser.parse_args()
+    warnings.simplefilter("ignore", FutureWarning)
+    benchmark_resample(args.days, args.sensors, args.repeat)
+    benchmark_energy(args.energy_days, args.repeat)
+    benchmark_temperature_range(args.days, args.sensors, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
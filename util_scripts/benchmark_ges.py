@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+"""
+Script that times solving the GES model for the BAU and test scenarios of the test
+data, with the pure Python and the compiled (numba) right-hand side, with and
+without the sparsity pattern of the Jacobian, and with all scenarios batched into one
+system of ODEs.
+
+Run from the root of the repository, e.g.
+    python util_scripts/benchmark_ges.py --scenarios 10 --repeat 3
+"""
+import argparse
+import logging
+import os
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from core.constants import CONST_TESTDATA_GES_FOLDER
+from models.ges.ges.functions_scenarioV1 import derivatives
+from models.ges.ges.ges_utils import get_latest_time_hour_value
+from models.ges.ges.model_kernel import NUMBA_AVAILABLE
+from models.ges.TestScenarioV1_1 import (
+    getTimeParameters,
+    setACHParameters,
+    setIASParameters,
+    setModel,
+    setScenarios,
+)
+
+
+def scenario_params(num_test_scenarios):
+    """The BAU and test scenario parameters of the test data, as in runScenarios."""
+    time_parameters = getTimeParameters()
+    ach_params = setACHParameters(
+        os.path.join(CONST_TESTDATA_GES_FOLDER, "ACH_outV1.csv"),
+        time_parameters["ndp"],
+    )
+    ias_params = setIASParameters(
+        os.path.join(CONST_TESTDATA_GES_FOLDER, "IAS_outV1.csv"),
+        time_parameters["ndp"],
+    )
+    model = setModel(
+        time_parameters["ndp"],
+        num_test_scenarios=num_test_scenarios,
+        ach_parameters=ach_params,
+        ias_parameters=ias_params,
+    )
+    scenarios_df = pd.DataFrame(
+        {
+            "ventilation_rate": np.linspace(1, 10, num_test_scenarios),
+            "num_dehumidifiers": np.arange(num_test_scenarios) % 3,
+            "lighting_shift": np.zeros(num_test_scenarios),
+            "scenario_type": "Test",
+        }
+    )
+    scenario = setScenarios(
+        scenarios_df=scenarios_df,
+        ach_parameters=ach_params,
+        ias_parameters=ias_params,
+        delta_h=time_parameters["delta_h"],
+    )
+    return time_parameters, np.concatenate((model, scenario))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the GES model solves")
+    parser.add_argument(
+        "--scenarios", type=int, default=1, help="number of test scenarios"
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="number of repeats")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    time_parameters, params = scenario_params(args.scenarios)
+    num_scenarios = params.shape[2]
+
+    def run(backend, jac_sparsity, batched=False):
+        return derivatives(
+            time_parameters["h1"],
+            time_parameters["h2"],
+            time_parameters["numDays"],
+            params,
+            time_parameters["ndp"],
+            filePathWeather=os.path.join(CONST_TESTDATA_GES_FOLDER, "WeatherV1.csv"),
+            filePathWeatherForecast=os.path.join(
+                CONST_TESTDATA_GES_FOLDER, "WeatherForecastV1.csv"
+            ),
+            LatestTimeHourValue=get_latest_time_hour_value(CONST_TESTDATA_GES_FOLDER),
+            num_workers=1,
+            backend=backend,
+            jac_sparsity=jac_sparsity,
+            batched=batched,
+        )
+
+    configurations = [("python", False, False), ("python", True, False)]
+    if NUMBA_AVAILABLE:
+        configurations += [("numba", False, False), ("numba", True, False)]
+        # Compile the kernel, or load it from numba's cache, before timing.
+        seconds = timeit.timeit(lambda: run("numba", False), number=1)
+        print(f"numba, first run including compilation: {seconds:.2f} s")
+    else:
+        print("numba is not installed, only timing the python backend")
+    configurations += [("python", False, True), ("python", True, True)]
+
+    reference = run("python", False)
+    for backend, jac_sparsity, batched in configurations:
+        results = run(backend, jac_sparsity, batched)
+        seconds = min(
+            timeit.repeat(
+                lambda: run(backend, jac_sparsity, batched),
+                number=1,
+                repeat=args.repeat,
+            )
+        )
+        T_diff = np.abs(results[1] - reference[1]).max()
+        print(
+            f"{backend}, jac_sparsity={jac_sparsity}, batched={batched}: "
+            f"{seconds / num_scenarios:.3f} s per scenario, "
+            f"max |T_air - T_air(python)| = {T_diff:.2e} K"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,7 @@ from sqlalchemy.dialects.postgresql import insert
 
 from cropcore.structure import LocationClass
 from cropcore.utils import get_crop_db_session
+from cropcore.lookups import refresh_location_lookups
 
 TUNNEL_AISLES_DICT = {
     "Tunnel3": ["A", "B"],
@@ -45,6 +46,7 @@ def add_locations(tunnel_dict, aisle_dict, num_shelves):
 
                     rows.append(row)
     df = pd.DataFrame(rows)
+    refresh_location_lookups(session)
     session.close()
     return df
 
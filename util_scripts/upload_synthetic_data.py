@@ -55,6 +55,8 @@ from cropcore.db import (
 )
 
 from cropcore.utils import insert_to_db_from_df
+from cropcore.lookups import refresh_location_lookups
+from cropcore.rollups import refresh_rollups
 
 from cropcore.generate_synthetic_data import (
     generate_trh_readings,
@@ -172,6 +174,11 @@ def main(db_name):
     add_sensor_data(engine)
     add_weather_data(engine)
     add_crop_data(engine)
+    # This also computes the batch T&RH statistics.
+    session = session_open(engine)
+    refresh_location_lookups(session)
+    refresh_rollups(session)
+    session_close(session)
     add_model_data(engine)
     # GES model ID for tests is 2
     add_scenario_data(2, engine)
@@ -11,8 +11,12 @@ from cropcore.constants import (
     DEFAULT_USER_EMAIL,
     DEFAULT_USER_PASS,
 )
+from cropcore.cache import make_cache
 from cropcore.structure import SQLA as db
 from cropcore.structure import UserClass
+from cropcore.lookups import create_location_lookups
+from cropcore.batch_stats import seed_batch_trh_stats
+from cropcore.rollups import seed_rollups
 from cropcore.utils import change_user_password, create_user, delete_user
 
 
@@ -34,6 +38,18 @@ def request_loader(request):
 def register_extensions(app):
     db.init_app(app)
     login_manager.init_app(app)
+    register_cache(app)
+
+
+def register_cache(app):
+    """Create the cache for dashboard data, available as app.extensions["crop_cache"]."""
+    backend = app.config.get("CACHE_BACKEND", "memory")
+    cache_kwargs = {"ttl": app.config.get("CACHE_TTL")}
+    if backend == "file":
+        cache_kwargs["directory"] = app.config.get("CACHE_DIR")
+    elif backend == "redis":
+        cache_kwargs["url"] = app.config.get("CACHE_REDIS_URL")
+    app.extensions["crop_cache"] = make_cache(backend, **cache_kwargs)
 
 
 def register_blueprints(app):
@@ -70,6 +86,13 @@ def configure_database(app):
     @app.before_first_request
     def initialize_database():
         db.create_all()
+        create_location_lookups(db.engine)
+        # An existing database may predate the batch statistics table, so compute
+        # it from all the readings before any new readings are folded into it.
+        seed_batch_trh_stats(db.engine)
+        # Likewise, roll up all the readings that predate the rollups, which the
+        # incremental refreshes after ingesting new readings would leave out.
+        seed_rollups(db.engine)
 
     @app.teardown_request
     def shutdown_session(exception=None):
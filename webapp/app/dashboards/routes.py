@@ -210,36 +210,28 @@ def resample(df, bins, dt_from, dt_to):
     for i in range(len(bins) - 1):
         bins_list.append("(%.1f, %.1f]" % (bins[i], bins[i + 1]))
 
-    date_min = min(df["date"].min(), dt_from)
-    date_max = max(df["date"].max(), dt_to)
-
-    for n in range(int((date_max - date_min).days) + 1):
-        day = date_min + timedelta(n)
-
-        for temp_range in bins_list:
-            if len(df[(df["date"] == day) & (df["temp_bin"] == temp_range)].index) == 0:
-
-                df2 = pd.DataFrame(
-                    {"date": [day], "temp_bin": [temp_range], "temp_cnt": [0]}
-                )
-
-                df = df.append(df2)
-
-    df = df.sort_values(by=["date", "temp_bin"], ascending=True)
-
-    df.reset_index(inplace=True, drop=True)
-
-    df_list = []
-
-    for bin_range in bins_list:
-
-        df_bin = df[df["temp_bin"] == bin_range]
-
-        del df_bin["temp_bin"]
-
-        df_bin.reset_index(inplace=True, drop=True)
+    date_min = pd.Timestamp(dt_from).normalize()
+    date_max = pd.Timestamp(dt_to).normalize()
+    if not df.empty:
+        date_min = min(df["date"].min(), date_min)
+        date_max = max(df["date"].max(), date_max)
+    dates = pd.date_range(date_min, date_max, freq="D")
+
+    # Reindexing over all date/temperature bin combinations fills in the missing ones
+    # with zero counts.
+    full_index = pd.MultiIndex.from_product(
+        [dates, bins_list], names=["date", "temp_bin"]
+    )
+    counts = (
+        df.set_index(["date", "temp_bin"])["temp_cnt"]
+        .reindex(full_index, fill_value=0)
+        .unstack("temp_bin")
+    )
 
-        df_list.append(df_bin)
+    df_list = [
+        pd.DataFrame({"date": counts.index, "temp_cnt": counts[bin_range].to_numpy()})
+        for bin_range in bins_list
+    ]
 
     return bins_list, df_list
 
@@ -258,12 +250,7 @@ def lights_energy_use(dt_from_, dt_to_):
     dt_from = pd.to_datetime(dt_from_.date()) + timedelta(hours=14)
     dt_to = pd.to_datetime(dt_to_.date()) + timedelta(days=1, hours=15)
 
-    d_from = pd.to_datetime(dt_from_.date())
-    d_to = pd.to_datetime(dt_to_.date())
-
-    col_ec = "electricity_consumption"
     sensor_device_id = "Clapham"
-    lights_on_cols = []
 
     # getting eneregy data for the analysis
     query = db.session.query(
@@ -279,46 +266,42 @@ def lights_energy_use(dt_from_, dt_to_):
     )
 
     df = pd.read_sql(query.statement, query.session.bind)
+    return lights_on_analysis(df, dt_from_, dt_to_)
+
+
+def lights_on_analysis(df, dt_from_, dt_to_):
+    """
+    Estimates the fraction of each day that the lights are on, from energy use.
+
+    Arguments:
+        df: dataframe with timestamp and electricity_consumption columns
+        dt_from_: date range from
+        dt_to_: date range to
+    Returns:
+        lights_results_df - a pandas dataframe with mean lights on values
+    """
+    d_from = pd.to_datetime(dt_from_.date())
+    d_to = pd.to_datetime(dt_to_.date())
+
+    col_ec = "electricity_consumption"
+    lights_on_cols = []
 
     if df.empty:
         return pd.DataFrame({"date": [], "mean_lights_on": []})
 
-    # Reseting index
-    df.sort_values(by=["timestamp"], ascending=True).reset_index(inplace=True)
-
     # grouping data by date-hour
-    energy_hour = (
-        df.groupby(
-            by=[
-                df["timestamp"].map(
-                    lambda x: pd.to_datetime(
-                        "%04d-%02d-%02d-%02d" % (x.year, x.month, x.day, x.hour),
-                        format="%Y-%m-%d-%H",
-                    )
-                ),
-            ]
-        )["electricity_consumption"]
-        .sum()
-        .reset_index()
-    )
-
-    # Sorting and reseting index
-    energy_hour.sort_values(by=["timestamp"], ascending=True).reset_index(inplace=True)
+    energy_hour = df.groupby(df["timestamp"].dt.floor("H"))[col_ec].sum().reset_index()
 
     # energy dates. Energy date starts from 4pm each day and lasts for 24 hours
-    energy_hour.loc[
-        energy_hour["timestamp"].dt.hour < 15, "energy_date"
-    ] = pd.to_datetime((energy_hour["timestamp"] + timedelta(days=-1)).dt.date)
-    energy_hour.loc[
-        energy_hour["timestamp"].dt.hour >= 15, "energy_date"
-    ] = pd.to_datetime(energy_hour["timestamp"].dt.date)
+    energy_hour["energy_date"] = (
+        energy_hour["timestamp"] - timedelta(hours=15)
+    ).dt.floor("D")
 
     # Clasification of lights being on
 
     # Lights ON 1: Lights turn on at 4pm and turn off at 9am, as scheduled.
-    energy_hour["lights_on_1"] = energy_hour["timestamp"].apply(
-        lambda x: 1 if (x.hour >= 17 or x.hour < 10) else 0
-    )
+    hour = energy_hour["timestamp"].dt.hour
+    energy_hour["lights_on_1"] = ((hour >= 17) | (hour < 10)).astype(int)
     lights_on_cols.append("lights_on_1")
 
     # Lights ON 2: Lights are calculated by estimating the lighting use as between
@@ -329,9 +312,7 @@ def lights_energy_use(dt_from_, dt_to_):
 
     # Lights ON 3: Lights are assumed to be on if the energy demand is over 30 kW
     #   (max load of the extraction fan)
-    energy_hour["lights_on_3"] = energy_hour[col_ec].apply(
-        lambda x: 1 if (x > 30.0) else 0
-    )
+    energy_hour["lights_on_3"] = (energy_hour[col_ec] > 30.0).astype(int)
     lights_on_cols.append("lights_on_3")
 
     # Lights ON 4: Lights are assumed to turn on at the time of largest energy use
@@ -353,16 +334,8 @@ def lights_energy_use(dt_from_, dt_to_):
         np.isclose(energy_hour["dE_min"], energy_hour["dE"]), "lights_on_4"
     ] = 0
 
-    # repeat last?
-    prev_row_value = None
-    for df_index in energy_hour.index:
-        if df_index > 0:
-            if np.isnan(energy_hour.loc[df_index, "lights_on_4"]) and not np.isnan(
-                prev_row_value
-            ):
-
-                energy_hour.loc[df_index, "lights_on_4"] = prev_row_value
-        prev_row_value = energy_hour.loc[df_index, "lights_on_4"]
+    # the lights stay on or off until the next switch
+    energy_hour["lights_on_4"] = energy_hour["lights_on_4"].ffill()
 
     lights_on_cols.append("lights_on_4")
 
@@ -426,29 +399,28 @@ def ventilation_energy_use(dt_from, dt_to):
     )
 
     df = pd.read_sql(query.statement, query.session.bind)
+    return ventilation_analysis(df)
 
+
+def ventilation_analysis(df):
+    """
+    Estimates the hourly air exchange from the energy use of the extraction fan.
+
+    Arguments:
+        df: dataframe with timestamp and electricity_consumption columns
+    Returns:
+        ventilation_results_df - a pandas dataframe with ventilation analysis results
+    """
     if df.empty:
         return pd.DataFrame({"timestamp": [], "ach": []})
 
-    # Reseting index
-    df.sort_values(by=["timestamp"], ascending=True).reset_index(inplace=True)
-
     # grouping data by date-hour
     energy_hour = (
-        df.groupby(
-            by=[
-                df["timestamp"].map(
-                    lambda x: "%04d-%02d-%02d %02d:00"
-                    % (x.year, x.month, x.day, x.hour)
-                ),
-            ]
-        )["electricity_consumption"]
+        df.groupby(df["timestamp"].dt.floor("H"))["electricity_consumption"]
         .sum()
         .reset_index()
     )
-
-    # Sorting and reseting index
-    energy_hour.sort_values(by=["timestamp"], ascending=True).reset_index(inplace=True)
+    energy_hour["timestamp"] = energy_hour["timestamp"].dt.strftime("%Y-%m-%d %H:00")
 
     # Calculating air exchange per hour
     energy_hour["ach"] = (
@@ -462,7 +434,8 @@ def ventilation_energy_use(dt_from, dt_to):
 
 def aranet_trh_analysis(dt_from, dt_to):
     """
-    Performs data analysis for Aranet Temperature+Relative Humidity sensors.
+    Performs data analysis for Aranet Temperature+Relative Humidity sensors, from the
+    hourly rollups of their readings.
 
     Arguments:
         dt_from_: date range from
@@ -480,32 +453,36 @@ def aranet_trh_analysis(dt_from, dt_to):
         )
     )
 
+    rollup_query = queries.readings_rollup(
+        db.session,
+        ReadingsAranetTRHClass,
+        ["temperature"],
+        dt_from,
+        dt_to,
+        resolution=timedelta(hours=1),
+    ).subquery()
     query = db.session.query(
-        ReadingsAranetTRHClass.timestamp,
-        ReadingsAranetTRHClass.sensor_id,
+        rollup_query.c.timestamp,
+        rollup_query.c.sensor_id,
         SensorClass.name,
-        ReadingsAranetTRHClass.temperature,
-        ReadingsAranetTRHClass.humidity,
-    ).filter(
-        and_(
-            ReadingsAranetTRHClass.sensor_id == SensorClass.id,
-            ReadingsAranetTRHClass.timestamp >= dt_from,
-            ReadingsAranetTRHClass.timestamp <= dt_to,
-        )
-    )
+        rollup_query.c.temperature,
+    ).filter(rollup_query.c.sensor_id == SensorClass.id)
 
     df = pd.read_sql(query.statement, query.session.bind)
+    df["timestamp"] = pd.to_datetime(df["timestamp"])
 
-    logging.info("Total number of records found: %d" % (len(df.index)))
+    logging.info("Total number of hourly records found: %d" % (len(df.index)))
     return temperature_range_analysis(df, dt_from, dt_to)
 
 
 def temperature_range_analysis(temp_df, dt_from, dt_to):
     """
-    Performs temperature range analysis on a given pandas dataframe.
+    Performs temperature range analysis on a given pandas dataframe of hourly mean
+    temperatures.
 
     Arguments:
-        temp_df:
+        temp_df: dataframe with timestamp (the start of the hour), sensor_id, name
+            and temperature (the mean over the hour) columns
         dt_from: date range from
         dt_to: date range to
     Returns:
@@ -522,24 +499,14 @@ def temperature_range_analysis(temp_df, dt_from, dt_to):
     # extracting date from datetime
     df["date"] = pd.to_datetime(df["timestamp"].dt.date)
 
-    # Reseting index
-    df.sort_values(by=["timestamp"], ascending=True).reset_index(inplace=True)
+    hourly_temp_by_sensor = {
+        sensor_id: df_sensor[["date", "temperature"]]
+        for sensor_id, df_sensor in df.groupby("sensor_id")
+    }
 
     data_by_sensor_id = {}
     for sensor_name, sensor_id in zip(sensor_names, sensor_ids):
-        df_sensor = df[df["sensor_id"] == sensor_id]
-        # grouping data by date-hour and sensor id
-        sensor_grp = df_sensor.groupby(
-            by=[
-                df_sensor.timestamp.map(
-                    lambda x: "%04d-%02d-%02d-%02d" % (x.year, x.month, x.day, x.hour)
-                ),
-                "date",
-            ]
-        )
-
-        # estimating hourly temperature mean values
-        sensor_grp_temp = sensor_grp["temperature"].mean().reset_index()
+        sensor_grp_temp = hourly_temp_by_sensor[sensor_id].reset_index(drop=True)
 
         try:
             bins = TEMP_BINS[SENSOR_CATEORIES[sensor_id]]
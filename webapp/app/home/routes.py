@@ -9,16 +9,18 @@ import pandas as pd
 import json
 import pytz
 
-from flask import render_template, request
+from flask import current_app, render_template, request
 from flask_login import login_required
-from sqlalchemy import and_
+from sqlalchemy import and_, func
 
 from app.home import blueprint
 
 from cropcore.constants import CONST_TIMESTAMP_FORMAT
 from cropcore import queries
+from cropcore.rollups import rollup_watermark_name
 from cropcore.structure import SQLA as db
 from cropcore.structure import (
+    DataWatermarkClass,
     LocationClass,
     ReadingsAranetTRHClass,
     SensorClass,
@@ -53,6 +55,13 @@ VPD_BINS = {
     "R&D": [0.0, 300.0, 600.0, 1000.0, 10000.0],
 }
 LOCATION_REGIONS = ["Propagation", "FrontFarm", "MidFarm", "BackFarm", "R&D"]
+TRH_MEASURES = ["temperature", "humidity", "vpd"]
+# Sensors shown in the stratification plots.
+# 18: 16B1, 21: 1B2, 22: 29B2, 23: 16B4
+STRATIFICATION_SENSOR_IDS = (18, 21, 22, 23)
+# The data of the index page is cached, and recomputed when new data arrives or when
+# this much time has passed.
+INDEX_CACHE_INTERVAL = dt.timedelta(minutes=10)
 
 
 def resample(df_, bins):
@@ -79,13 +88,14 @@ def resample(df_, bins):
     return df_out
 
 
-def aranet_query(dt_from, dt_to):
+def aranet_query(dt_from, dt_to, sensor_ids=None):
     """
     Performs a query for Aranet T/RH sensors.
 
     Arguments:
         dt_from_: date range from
         dt_to_: date range to
+        sensor_ids: optional, ids of the sensors to include. By default all are.
     Returns:
         df: a df with the queried data
     """
@@ -117,9 +127,11 @@ def aranet_query(dt_from, dt_to):
             latest_locations_query.c.location_id == locations_query.c.id,
         )
     )
+    if sensor_ids is not None:
+        query = query.filter(trh_query.c.sensor_id.in_(sensor_ids))
 
     df = pd.read_sql(query.statement, query.session.bind)
-    df["timestamp"] = df["timestamp"].dt.tz_localize(dt.timezone.utc)
+    df["timestamp"] = pd.to_datetime(df["timestamp"]).dt.tz_localize(dt.timezone.utc)
 
     logging.info("Total number of records found: %d" % (len(df.index)))
     if df.empty:
@@ -127,35 +139,73 @@ def aranet_query(dt_from, dt_to):
     return df
 
 
+def aranet_hourly_query(dt_from, dt_to):
+    """
+    Performs a query for the hourly means of Aranet T/RH sensors, read from the hourly
+    rollups.
+
+    Arguments:
+        dt_from_: date range from
+        dt_to_: date range to
+    Returns:
+        df: a df with the queried data, with a column "count" for the number of
+            readings in each hour
+    """
+    rollup_query = queries.readings_rollup(
+        db.session,
+        ReadingsAranetTRHClass,
+        TRH_MEASURES,
+        dt_from,
+        dt_to,
+        resolution=dt.timedelta(hours=1),
+    ).subquery()
+    latest_locations_query = queries.latest_sensor_locations(db.session).subquery()
+    locations_query = queries.locations_with_extras(db.session).subquery()
+
+    query = db.session.query(
+        *[rollup_query.c[measure] for measure in TRH_MEASURES],
+        rollup_query.c.temperature_count.label("count"),
+        rollup_query.c.timestamp,
+        rollup_query.c.sensor_id,
+        locations_query.c.region,
+    ).filter(
+        and_(
+            rollup_query.c.sensor_id == latest_locations_query.c.sensor_id,
+            latest_locations_query.c.location_id == locations_query.c.id,
+        )
+    )
+
+    df = pd.read_sql(query.statement, query.session.bind)
+    df["timestamp"] = pd.to_datetime(df["timestamp"]).dt.tz_localize(dt.timezone.utc)
+
+    logging.info("Total number of hourly records found: %d" % (len(df.index)))
+    if df.empty:
+        logging.debug("WARNING: Query returned empty")
+    return df
+
+
 def grp_per_hr_region(df):
     """
-    Compute hourly means of the T&RH dataframe.
+    Compute hourly means per region of the hourly T&RH dataframe returned by
+    aranet_hourly_query.
+
+    The means of the sensors are weighted by their number of readings, so that the
+    result is the mean of all the readings in each region and hour.
     """
-    df = copy.deepcopy(df)
-    # extracting date from datetime
-    if len(df) > 0:
-        df["date"] = pd.to_datetime(df["timestamp"].dt.date)
-    else:
-        df["date"] = []
-    # Reseting index
-    df.sort_values(by=["timestamp"], ascending=True).reset_index(inplace=True)
-    if len(df) > 0:
-        df_grp_region_hr = (
-            df.groupby(
-                by=[
-                    df.timestamp.map(
-                        lambda x: "%04d-%02d-%02d-%02d"
-                        % (x.year, x.month, x.day, x.hour)
-                    ),
-                    "region",
-                    "date",
-                ]
-            )
-            .mean()
-            .reset_index()
+    df = df.copy()
+    for measure in TRH_MEASURES:
+        df[measure] = df[measure] * df["count"]
+    df_grp_region_hr = (
+        df.groupby(["timestamp", "region"])[TRH_MEASURES + ["count"]]
+        .sum()
+        .reset_index()
+    )
+    for measure in TRH_MEASURES:
+        df_grp_region_hr[measure] = (
+            df_grp_region_hr[measure] / df_grp_region_hr["count"]
         )
-    else:
-        df_grp_region_hr = df
+    # extracting date from datetime
+    df_grp_region_hr["date"] = pd.to_datetime(df_grp_region_hr["timestamp"].dt.date)
     return df_grp_region_hr
 
 
@@ -439,29 +489,74 @@ def format_warnings_json(warnings):
     return warnings_json
 
 
-@blueprint.route("/index")
-@login_required
-def index():
+def index_data_version():
     """
-    Index page
+    A value that changes whenever new T&RH readings or warnings have been added.
+
+    The T&RH readings are tracked by the watermark of their hourly rollup, which is
+    updated every time new readings have been rolled up, and the warnings by their
+    latest id.
+
+    Returns:
+        version: str
+    """
+    rollup_updated = (
+        db.session.query(
+            func.coalesce(
+                DataWatermarkClass.time_updated, DataWatermarkClass.time_created
+            )
+        )
+        .filter(
+            DataWatermarkClass.name
+            == rollup_watermark_name(ReadingsAranetTRHClass, "hour")
+        )
+        .scalar_subquery()
+    )
+    latest_warning_id = db.session.query(func.max(WarningClass.id)).scalar_subquery()
+    rollup_updated, latest_warning_id = db.session.query(
+        rollup_updated, latest_warning_id
+    ).one()
+    return f"{rollup_updated}:{latest_warning_id}"
+
+
+def index_cache_key(now):
+    """
+    The cache key for the data of the index page, made of the time interval that now
+    falls in, and the version of the data.
+
+    Arguments:
+        now: datetime
+    Returns:
+        key: str
+    """
+    interval = INDEX_CACHE_INTERVAL.total_seconds()
+    interval_start = int(now.timestamp() // interval * interval)
+    return f"home_index:{interval_start}:{index_data_version()}"
+
+
+def index_data(dt_to):
+    """
+    Compute the data shown on the index page.
+
+    Arguments:
+        dt_to: datetime, the current time
+    Returns:
+        data: dict of the arguments for rendering the index.html template
     """
-    dt_to = dt.datetime.now(dt.timezone.utc)
     dt_from_fortnightly = dt_to - dt.timedelta(days=14)
     dt_from_weekly = dt_to - dt.timedelta(days=7)
     dt_from_daily = dt_to - dt.timedelta(days=1)
     dt_from_6h = dt_to - dt.timedelta(hours=6)
     dt_from_hourly = dt_to - dt.timedelta(hours=2)
 
-    # Get the largest timespan we need from the database. We can get the others by
-    # slicing this, saving database queries.
-    dt_from_min = min(
-        dt_from_fortnightly, dt_from_weekly, dt_from_daily, dt_from_6h, dt_from_hourly
-    )
-    df_all = aranet_query(dt_from_min, dt_to)
+    # The weekly and daily summaries only need hourly means, which we get from the
+    # hourly rollups. Raw readings are only fetched for the last 6 hours, and for the
+    # stratification sensors.
+    df_hr_weekly = aranet_hourly_query(dt_from_weekly, dt_to)
+    df_recent = aranet_query(min(dt_from_6h, dt_from_hourly), dt_to)
 
     # weekly
-    df_weekly = df_all.loc[df_all["timestamp"] >= dt_from_weekly, :]
-    df_mean_hr_weekly = grp_per_hr_region(df_weekly)
+    df_mean_hr_weekly = grp_per_hr_region(df_hr_weekly)
     df_temp_weekly = bin_trh_data(
         df_mean_hr_weekly, TEMP_BINS, "temperature", expected_total=24 * 7
     )
@@ -476,8 +571,12 @@ def index():
     weekly_vpd_json = json_bin_counts(df_vpd_weekly)
 
     # daily
-    df_daily = df_weekly.loc[df_weekly["timestamp"] >= dt_from_daily, :]
-    df_mean_hr_daily = grp_per_hr_region(df_daily)
+    df_hr_daily = df_hr_weekly.loc[
+        df_hr_weekly["timestamp"]
+        >= queries.floor_to_granularity(dt_from_daily, "hour"),
+        :,
+    ]
+    df_mean_hr_daily = grp_per_hr_region(df_hr_daily)
     df_temp_daily = bin_trh_data(
         df_mean_hr_daily, TEMP_BINS, "temperature", expected_total=24
     )
@@ -490,25 +589,25 @@ def index():
     daily_vpd_json = json_bin_counts(df_vpd_daily)
 
     # hourly
-    df_hourly = df_daily.loc[df_daily["timestamp"] >= dt_from_hourly, :]
+    df_hourly = df_recent.loc[df_recent["timestamp"] >= dt_from_hourly, :]
     if not df_hourly.empty:
         hourly_json = regional_mean_json(df_hourly)
     else:
         hourly_json = {}
 
     # 6h
-    df_6h = df_daily.loc[df_daily["timestamp"] >= dt_from_6h, :]
+    df_6h = df_recent.loc[df_recent["timestamp"] >= dt_from_6h, :]
     if not df_6h.empty:
         recent_minmax_json = regional_minmax_json(df_6h)
     else:
         recent_minmax_json = {}
 
     # fortnightly
-    df_fortnightly = df_all.loc[df_all["timestamp"] >= dt_from_fortnightly, :]
+    df_fortnightly = aranet_query(
+        dt_from_fortnightly, dt_to, sensor_ids=STRATIFICATION_SENSOR_IDS
+    )
     if not df_fortnightly.empty:
-        # Sensor id locations:
-        # 18: 16B1, 21: 1B2, 22: 29B2, 23: 16B4
-        json_strat = stratification(df_fortnightly, (18, 21, 22, 23))
+        json_strat = stratification(df_fortnightly, STRATIFICATION_SENSOR_IDS)
     else:
         json_strat = {}
 
@@ -518,8 +617,7 @@ def index():
     warnings["category_id"] = warnings["type_id"].apply(warning_categories_by_type.get)
     warnings_json = format_warnings_json(warnings)
 
-    return render_template(
-        "index.html",
+    return dict(
         hourly_data=hourly_json,
         recent_minmax_data=recent_minmax_json,
         temperature_data=weekly_temp_json,
@@ -536,6 +634,18 @@ def index():
     )
 
 
+@blueprint.route("/index")
+@login_required
+def index():
+    """
+    Index page
+    """
+    dt_to = dt.datetime.now(dt.timezone.utc)
+    cache = current_app.extensions["crop_cache"]
+    data = cache.get_or_set(index_cache_key(dt_to), lambda: index_data(dt_to))
+    return render_template("index.html", **data)
+
+
 @blueprint.route("/model")
 @login_required
 def model():
@@ -6,6 +6,7 @@ from sqlalchemy import exc
 
 from cropcore.structure import SQLA as db
 from cropcore.structure import LocationClass
+from cropcore.lookups import refresh_location_lookups
 
 
 CONST_ACTION_ADD = "Add"
@@ -73,6 +74,8 @@ def route_template(template):
 
                         db.session.add(location)
                         db.session.commit()
+                        # A new location has no batches yet.
+                        refresh_location_lookups(db.session, rebuild_batch_stats=False)
 
                         # Only after the commit the id property is set
                         loc_message = "New location (ID = {}) has been added.".format(
@@ -89,6 +92,7 @@ def route_template(template):
 
                     if loc_id is not None:
 
+                        zone = LocationClass.query.filter_by(id=loc_id).one().zone
                         LocationClass.query.filter_by(id=loc_id).update(
                             dict(
                                 zone=loc_zone,
@@ -102,6 +106,11 @@ def route_template(template):
                         except Exception as e:
                             db.session.rollback()
                             raise e
+                        # The zone of a location decides whether its sensors are
+                        # propagation sensors for all batches.
+                        refresh_location_lookups(
+                            db.session, all_batches=loc_zone != zone
+                        )
 
                         loc_message = "Location (ID = {}) has been updated.".format(
                             loc_id
@@ -121,6 +130,7 @@ def route_template(template):
                     except Exception as e:
                         db.session.rollback()
                         raise e
+                    refresh_location_lookups(db.session)
 
                     loc_message = "Location (ID = {}) has been deleted.".format(loc_id)
                 else:
@@ -35,9 +35,10 @@ from cropcore.structure import (
 from cropcore.structure import SQLA as db
 
 
-def aranet_trh_query(dt_from, dt_to):
+def aranet_trh_hourly_query(dt_from, dt_to):
     """
-    Performs a query for temperature and relative humidity data.
+    Performs a query for hourly means of temperature and relative humidity data, read
+    from the hourly rollups.
 
     Arguments:
         dt_from_: date range from
@@ -45,22 +46,26 @@ def aranet_trh_query(dt_from, dt_to):
     Returns:
         df: a df with the queried data
     """
+    rollup_query = queries.readings_rollup(
+        db.session,
+        ReadingsAranetTRHClass,
+        ["temperature", "humidity"],
+        dt_from,
+        dt_to,
+        resolution=dt.timedelta(hours=1),
+    ).subquery("trh_rollup")
     locations_query = queries.latest_sensor_locations(db.session).subquery(
         "sensor_locations"
     )
-    query = db.session.query(
-        ReadingsAranetTRHClass.timestamp,
-        ReadingsAranetTRHClass.sensor_id,
-        ReadingsAranetTRHClass.temperature,
-        ReadingsAranetTRHClass.humidity,
-        LocationClass.zone,
-    ).filter(
-        and_(
-            locations_query.c.location_id == LocationClass.id,
-            ReadingsAranetTRHClass.sensor_id == locations_query.c.sensor_id,
-            ReadingsAranetTRHClass.timestamp >= dt_from,
-            ReadingsAranetTRHClass.timestamp <= dt_to,
+    query = (
+        db.session.query(
+            rollup_query.c.timestamp,
+            rollup_query.c.sensor_id,
+            rollup_query.c.temperature,
+            rollup_query.c.humidity,
         )
+        .filter(rollup_query.c.sensor_id == locations_query.c.sensor_id)
+        .order_by(rollup_query.c.sensor_id, rollup_query.c.timestamp)
     )
 
     df = pd.read_sql(query.statement, query.session.bind)
@@ -145,29 +150,6 @@ def model_query(dt_from, dt_to, model_id, sensor_id):
     return df
 
 
-def resample(df):
-    """
-    Resamples (date per hour) to a dataframe.
-
-    Arguments:
-        temp_df: dataframe with temperature assign to bins
-        bins: temperature or humidity bins as a list
-    Returns:
-        temp_df: the df with grouped bins
-    """
-
-    # Reseting index
-    df.sort_values(by=["timestamp"], ascending=True).reset_index(inplace=True)
-    df_grp_hr = (
-        df.groupby("sensor_id")
-        .resample("H", on="timestamp")
-        .agg({"temperature": "mean", "humidity": "mean"})
-        .reset_index()
-    )
-
-    return df_grp_hr
-
-
 def add_time_columns(df, shift_hours=0):
     """Create timestamps from prediction index and convert date to string."""
     time_ = []
@@ -213,11 +195,9 @@ def json_temp_arima(df_arima):
 
 
 def json_temp_trh(dt_from_daily, dt_to):
-    df = aranet_trh_query(dt_from_daily, dt_to)
+    df_grp_hr = aranet_trh_hourly_query(dt_from_daily, dt_to)
 
-    if not df.empty:
-        # resample T&RH data per hour
-        df_grp_hr = resample(df)
+    if not df_grp_hr.empty:
 
         time_ = []
         for i in range(len(df_grp_hr)):
@@ -227,7 +207,6 @@ def json_temp_trh(dt_from_daily, dt_to):
 
         df_grp_hr["time"] = time_
 
-        # .groupby('sensor_id').resample('H', on='timestamp').agg({'temperature':'mean', 'humidity':'mean'})
         return (
             df_grp_hr.groupby(["sensor_id"], as_index=True)  # "measure_name"
             .apply(
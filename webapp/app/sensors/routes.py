@@ -13,6 +13,7 @@ from cropcore.structure import (
     LocationClass,
 )
 from cropcore import queries
+from cropcore.lookups import refresh_location_lookups
 from cropcore.utils import query_result_to_array
 from app.sensors import blueprint
 
@@ -86,6 +87,7 @@ def update_sensor_attributes(request):
     sensor_obj = session.execute(
         session.query(SensorClass).filter_by(id=request.values["query"])
     ).scalar_one()
+    type_id = sensor_obj.type_id
 
     for attr in (
         "type_id",
@@ -109,6 +111,8 @@ def update_sensor_attributes(request):
     except Exception as e:
         session.rollback()
         raise e
+    # The sensor type determines whether it counts as a T&RH sensor in the lookups.
+    refresh_location_lookups(session, all_batches=sensor_obj.type_id != type_id)
     return None
 
 
@@ -128,6 +132,7 @@ def add_sensor_location(request):
     except Exception as e:
         session.rollback()
         raise e
+    refresh_location_lookups(session)
     return None
 
 
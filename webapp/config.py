@@ -23,6 +23,13 @@ class Config(object):
     # DEFAULT_THEME = "themes/dark"
     DEFAULT_THEME = None
 
+    # Cache for the data behind dashboard pages, see cropcore/cache.py. The backend is
+    # one of "memory", "file", or "redis".
+    CACHE_BACKEND = environ.get("CROP_CACHE_BACKEND", "memory")
+    CACHE_TTL = int(environ.get("CROP_CACHE_TTL", 3600))
+    CACHE_DIR = environ.get("CROP_CACHE_DIR")
+    CACHE_REDIS_URL = environ.get("CROP_REDIS_URL")
+
 
 class ProductionConfig(Config):
     DEBUG = False